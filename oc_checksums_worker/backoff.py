@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+Adaptive delay between queue polls
+"""
+
+import random
+
+
+class PollBackoff(object):
+    """
+    Exponential backoff with jitter.
+    Delay is zero while messages keep arriving, grows from 'minimum' up to 'maximum'
+    for each empty poll in a row and is randomly spread by 'jitter' fraction
+    so that replicas do not poll in lockstep.
+    """
+
+    def __init__(self, minimum, maximum, factor=2.0, jitter=0.2):
+        """
+        :param float minimum: delay after first empty poll, seconds
+        :param float maximum: delay ceiling, seconds
+        :param float factor: delay multiplier for each next empty poll
+        :param float jitter: fraction of the delay to spread randomly, 0 to disable
+        """
+        if minimum < 0 or maximum < 0:
+            raise ValueError("Negative delay is not allowed")
+
+        self.minimum = min(minimum, maximum)
+        self.maximum = maximum
+        self.factor = max(factor, 1.0)
+        self.jitter = max(0.0, min(jitter, 1.0))
+        self.empty_polls = 0
+        self.delay = 0.0
+        # delay before jitter, kept instead of an exponent so that it never overflows while idle
+        self._base = self.minimum
+
+    def reset(self):
+        """
+        Messages arrived: poll again immediately
+        """
+        self.empty_polls = 0
+        self.delay = 0.0
+        self._base = self.minimum
+
+    def next_delay(self):
+        """
+        Empty poll: calculate delay before the next one
+        :return float: seconds to wait
+        """
+        _delay = self._base
+        self._base = min(self.maximum, self._base * self.factor)
+        self.empty_polls += 1
+
+        if self.jitter:
+            _delay += _delay * self.jitter * (2 * random.random() - 1)
+
+        self.delay = max(0.0, min(_delay, self.maximum))
+        return self.delay
+
+    def stats(self):
+        """
+        Current state for monitoring
+        :return dict:
+        """
+        return {
+            "delay": self.delay,
+            "empty_polls": self.empty_polls,
+            "minimum": self.minimum,
+            "maximum": self.maximum}
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+"""
+Registration of archive members with bulk database statements
+"""
+
+import logging
+import posixpath
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Exists, OuterRef
+from oc_cdtapi.NexusAPI import gav_to_path
+from oc_delivery_apps.checksums.archive_object import ArchiveObject
+from simple_history.utils import bulk_create_with_history
+
+# extensions of files registered by the controller with SQL normalization, see CheckSumsController._is_sql_extension
+SQL_EXTENSIONS = [".sql", ".plb"]
+# CI type of archive members, the same as CheckSumsController gives when no type is specified
+MEMBER_CI_TYPE = "FILE"
+# number of values in one 'IN' condition
+QUERY_CHUNK = 500
+
+
+def is_sql_path(path, loc_type):
+    """
+    Check location is registered by the controller as an SQL file (if its content is SQL)
+    :param str path: location path
+    :param str loc_type: location type code
+    :return bool:
+    """
+    if loc_type.upper() == "NXS":
+        path = gav_to_path(path)
+
+    return posixpath.splitext(path)[1].lower() in SQL_EXTENSIONS
+
+
+def _chunks(items, size=QUERY_CHUNK):
+    for _start in range(0, len(items), size):
+        yield items[_start:_start + size]
+
+
+def known_checksums(models, checksums):
+    """
+    Checksum records registered already, looked up with 'IN' queries
+    :param module models: Django models module
+    :param list checksums: MD5 checksums
+    :return dict: checksum -> (checksum record id, file id, True if it has 'Regular' provider)
+    """
+    _result = dict()
+    _regular = models.CsProv.objects.filter(cs=OuterRef("pk"), cs_prov="Regular")
+
+    for _chunk in _chunks(sorted(set(checksums))):
+        _query = models.CheckSums.objects.filter(cs_type__code="MD5", checksum__in=_chunk) \
+                .annotate(regular=Exists(_regular)) \
+                .values_list("checksum", "id", "file_id", "regular")
+
+        for _checksum, _id, _file_id, _is_regular in _query:
+            _result[_checksum] = (_id, _file_id, _is_regular)
+
+    return _result
+
+
+def included_checksums(models, file_r):
+    """
+    MD5 checksums of a file and all files included to it at any depth
+    :param module models: Django models module
+    :param file_r: file record
+    :return set: checksums
+    """
+    _seen = set([file_r.pk])
+    _level = [file_r.pk]
+
+    while _level:
+        _next = list()
+
+        for _chunk in _chunks(_level):
+            _next += list(models.Locations.objects.filter(loc_type__code="ARCH", file_dst_id__in=_chunk)
+                    .exclude(file_id__in=_seen).values_list("file_id", flat=True).distinct())
+
+        _level = list(set(_next) - _seen)
+        _seen.update(_level)
+
+    _result = set()
+
+    for _chunk in _chunks(list(_seen)):
+        _result.update(models.CheckSums.objects.filter(cs_type__code="MD5", file_id__in=_chunk)
+                .values_list("checksum", flat=True))
+
+    return _result
+
+
+def remember_included(models, file_r, known_filter):
+    """
+    Put checksums of a file registered by the controller and of its members to the filter
+    :param module models: Django models module
+    :param file_r: file record, may be None
+    :param ChecksumFilter known_filter: filter to update, may be None
+    """
+    if known_filter is None or file_r is None:
+        return
+
+    for _md5 in included_checksums(models, file_r):
+        known_filter.add(_md5)
+
+
+def _create_files(models, files):
+    """
+    Insert file records. Primary keys are necessary, so records are inserted one by one
+    on backends not returning them from bulk insert.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        models.Files.objects.bulk_create(files)
+        return
+
+    for _file in files:
+        _file.save()
+
+
+def register_members(models, file_r, members, known_filter=None, lookup_all=False):
+    """
+    Register files included to an archive: checksums known are looked up with a few queries,
+    missing files, checksums and inclusions are inserted with bulk statements.
+    Should be called in a transaction, IntegrityError is raised if a checksum is inserted concurrently.
+    :param module models: Django models module
+    :param file_r: archive file record
+    :param list members: tuples (path inside the archive, MD5, MIME type)
+    :param ChecksumFilter known_filter: checksums not in the filter are inserted without looking up,
+                                        all checksums of the members are put to it
+    :param bool lookup_all: look up all checksums, the filter is updated only
+    """
+    _checksums = list(_md5 for _path, _md5, _mime in members)
+
+    if known_filter is not None and not lookup_all:
+        _checksums = known_filter.probable(_checksums)
+
+    _known = known_checksums(models, _checksums)
+    _new = dict()
+
+    for _path, _md5, _mime in members:
+        if _md5 not in _known and _md5 not in _new:
+            # the first member with a checksum gives MIME type to the file
+            _new[_md5] = models.Files(ci_type_id=MEMBER_CI_TYPE, mime_type=_mime)
+
+    logging.debug("Archive [%d]: %d members, %d checksums known, %d new",
+            file_r.pk, len(members), len(_known), len(_new))
+    _create_files(models, list(_new.values()))
+    models.CheckSums.objects.bulk_create(list(
+        models.CheckSums(file=_file, cs_type_id="MD5", checksum=_md5) for _md5, _file in _new.items()))
+    _ids = list(_id for _id, _file_id, _is_regular in _known.values() if not _is_regular)
+
+    for _chunk in _chunks(list(_new.keys())):
+        _ids += list(models.CheckSums.objects.filter(cs_type__code="MD5", checksum__in=_chunk).values_list("id", flat=True))
+
+    models.CsProv.objects.bulk_create(list(models.CsProv(cs_id=_id, cs_prov="Regular") for _id in _ids))
+
+    _files = dict((_md5, _file.pk) for _md5, _file in _new.items())
+    _files.update((_md5, _file_id) for _md5, (_id, _file_id, _is_regular) in _known.items())
+    # a file is included to itself always, no location is stored then
+    bulk_create_with_history(list(
+        models.Locations(file_id=_files[_md5], file_dst=file_r, loc_type_id="ARCH", path=_path, revision=None)
+        for _path, _md5, _mime in members if _files[_md5] != file_r.pk), models.Locations)
+
+    if known_filter is not None:
+        # known ones too: some may be registered by another worker after the filter was loaded
+        for _md5 in list(_new.keys()) + list(_known.keys()):
+            known_filter.add(_md5)
+
+
+def _register_members_safe(models, file_r, members, known_filter):
+    """
+    Run 'register_members' in a transaction. Checksums registered concurrently (by another worker,
+    so missing in the filter) make it fail: it is repeated with all checksums looked up then.
+    :return bool: False if registration failed and nothing was changed
+    """
+    for _lookup_all in ([False, True] if known_filter is not None else [True]):
+        try:
+            with transaction.atomic():
+                register_members(models, file_r, members, known_filter, _lookup_all)
+
+            return True
+        except IntegrityError as _e:
+            logging.debug("Bulk registration of [%d] members failed: %s" % (file_r.pk, _e))
+
+    return False
+
+
+def register_archive(controller, models, file_o, ci_type, loc_path, loc_type, md5, known_filter=None):
+    """
+    Register a file with depth 1 the same way CheckSumsController.register_file_obj does,
+    archive members are registered with 'register_members'.
+    Files the controller registers with SQL normalization are passed to it.
+    :param CheckSumsController controller: controller, not a proxy
+    :param module models: Django models module of the controller
+    :param file_o: file object opened in binary mode
+    :param str ci_type: CI type code of the file
+    :param str loc_path: location path
+    :param str loc_type: location type code
+    :param str md5: checksum of the file content
+    :param ChecksumFilter known_filter: filter of registered checksums, see 'register_members'
+    :return: file record
+    """
+    if is_sql_path(loc_path, loc_type) or not models.CiTypes.objects.filter(code=MEMBER_CI_TYPE).exists():
+        _file_r = controller.register_file_obj(file_o, ci_type, loc_path, loc_type, inclusion_level=1)
+        remember_included(models, _file_r, known_filter)
+        return _file_r
+
+    _file_r = controller.register_file_md5(md5, ci_type, controller.mime(file_o), loc_path, loc_type)
+
+    if controller.get_current_inclusion_depth(_file_r) >= 1:
+        logging.debug("'%s' is registered with depth 1 already" % loc_path)
+        return _file_r
+
+    try:
+        _arch = ArchiveObject(file_o)
+    except Exception as _e:
+        logging.debug("Not an archive: '%s': %s" % (loc_path, _e))
+        return _file_r
+
+    _members = list()
+    _sql_members = list()
+
+    for _member_d in _arch.ls_files():
+        _pth_utf, _pth_orig = list(_member_d.items()).pop()
+
+        if is_sql_path(_pth_utf, "ARCH"):
+            _sql_members.append((_pth_utf, _pth_orig))
+            continue
+
+        with _arch.extract_temp(_pth_utf, _pth_orig) as _file_o_memb:
+            _members.append((_pth_utf, controller.md5(_file_o_memb), controller.mime(_file_o_memb)))
+
+    if not _register_members_safe(models, _file_r, _members, known_filter):
+        logging.warning("Bulk registration of '%s' members failed, registering one by one" % loc_path)
+
+        for _pth, _md5, _mime in _members:
+            _file_r_memb = controller.register_file_md5(_md5, MEMBER_CI_TYPE, _mime, _pth, "ARCH")
+            controller.add_inclusion(_file_r_memb, _file_r, _pth)
+
+            if known_filter is not None:
+                known_filter.add(_md5)
+
+    for _pth_utf, _pth_orig in _sql_members:
+        with _arch.extract_temp(_pth_utf, _pth_orig) as _file_o_memb:
+            _file_r_memb = controller.register_file_obj(_file_o_memb, MEMBER_CI_TYPE, _pth_utf, "ARCH", None, 0, MEMBER_CI_TYPE)
+            controller.add_inclusion(_file_r_memb, _file_r, _pth_utf)
+            remember_included(models, _file_r_memb, known_filter)
+
+    return update_depth(_file_r, 1)
+
+
+def update_depth(file_r, depth):
+    """
+    Raise inclusion depth stored the same way CheckSumsController._update_current_inclusion_depth does
+    :param file_r: file record
+    :param int depth: depth calculated
+    :return: file record
+    """
+    file_r.refresh_from_db()
+    file_r.depth_level = max(file_r.depth_level or 0, depth)
+    file_r.save()
+    return file_r
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+In-memory membership filter of registered checksums
+"""
+
+import logging
+import math
+import threading
+import time
+
+
+class ChecksumFilter(object):
+    """
+    Bloom filter of MD5 checksums registered. A checksum not in the filter is not registered
+    (unless another worker has registered it since the filter was loaded), a checksum in the filter
+    is registered with probability of 1 - 'error_rate', so it is to be confirmed by a database query.
+    MD5 checksums are uniformly distributed, so bit positions are taken from checksum value itself.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        :param int capacity: number of checksums expected, false positive rate grows above it
+        :param float error_rate: false positive rate at capacity
+        """
+        self.capacity = max(1, int(capacity))
+        self.bits = max(64, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / self.capacity * math.log(2))))
+        self.entries = 0
+        self.probes = 0
+        self.negatives = 0
+        self._array = bytearray((self.bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, md5):
+        """
+        Bit positions of a checksum, None if it is not a hexadecimal one
+        """
+        try:
+            _value = int(md5, 16)
+        except (TypeError, ValueError):
+            return None
+
+        _h1 = _value & 0xffffffffffffffff
+        _h2 = (_value >> 64) | 1
+        return list((_h1 + _i * _h2) % self.bits for _i in range(self.hashes))
+
+    def add(self, md5):
+        """
+        Put a checksum to the filter
+        :param str md5: checksum registered
+        """
+        _positions = self._positions(md5)
+
+        if _positions is None:
+            return
+
+        with self._lock:
+            for _pos in _positions:
+                self._array[_pos >> 3] |= 1 << (_pos & 7)
+
+            self.entries += 1
+
+    def __contains__(self, md5):
+        _positions = self._positions(md5)
+
+        if _positions is None:
+            return True
+
+        return all(self._array[_pos >> 3] & (1 << (_pos & 7)) for _pos in _positions)
+
+    def probable(self, checksums):
+        """
+        Select checksums which may be registered
+        :param list checksums: checksums to check
+        :return list: checksums found in the filter, the rest are not registered
+        """
+        _result = list(_md5 for _md5 in checksums if _md5 in self)
+
+        with self._lock:
+            self.probes += len(checksums)
+            self.negatives += len(checksums) - len(_result)
+
+        return _result
+
+    @classmethod
+    def load(cls, models, error_rate=0.01, growth=2):
+        """
+        Create a filter of all MD5 checksums in database
+        :param module models: Django models module
+        :param float error_rate: false positive rate at capacity
+        :param int growth: capacity is the number of checksums registered multiplied by this
+        :return ChecksumFilter:
+        """
+        _start_t = time.monotonic()
+        _query = models.CheckSums.objects.filter(cs_type__code="MD5")
+        _result = cls(max(100000, _query.count() * growth), error_rate)
+
+        for _md5 in _query.values_list("checksum", flat=True).iterator(chunk_size=10000):
+            _result.add(_md5)
+
+        logging.info("Checksum filter of %d entries (%d bytes) loaded in %.1f seconds",
+                _result.entries, len(_result._array), time.monotonic() - _start_t)
+        return _result
+
+    def stats(self):
+        """
+        Current state for monitoring
+        :return dict:
+        """
+        return {
+            "entries": self.entries,
+            "bytes": len(self._array),
+            "probes": self.probes,
+            "negatives": self.negatives}
@@ -7,60 +7,573 @@ import argparse
 import logging
 from oc_orm_initializator.orm_initializator import OrmInitializator
 from oc_cdtapi import NexusAPI, PgQAPI
+from .pgq_batch import PgQBatch, PgQFinalizer
+from .backoff import PollBackoff
+from .executors import KeyedExecutor, SlowLaneRequired, current_lane
+from .supervisor import WorkerSupervisor
+from .coalescing import RegistrationCoalescer
+from .streams import HashingWriter, MIME_HEADER_SIZE
+from .download_cache import DownloadCache
+from .prefetch import DownloadPrefetcher
+from . import mvn_metadata
+from . import mvn_ranges
+from . import registration_state
+from . import bulk_registration
+from .checksum_filter import ChecksumFilter
+from .db_health import ConnectionMonitor
 from oc_logging.Logging import setup_logging
 import tempfile
+import io
 import time
+import json
+import threading
+import signal
+import concurrent.futures
+import django.conf
+import django.db
+import requests
+import requests.adapters
+import urllib3.exceptions
+import shutil
 
 class LocationOverwriteError(Exception):
     def __init__(self, path):
         super().__init__("Location '%s' was physically overwritten but removing is disabled" % path)
 
+class MetadataExpiredError(Exception):
+    def __init__(self, path):
+        super().__init__("Cached metadata or sidecar checksum of '%s' differs from database, asking repository again" % path)
+
+class DownloadVerificationError(Exception):
+    def __init__(self, gav, md5, md5_downloaded):
+        super().__init__("Downloaded '%s' checksum '%s' differs from repository one '%s'" % (gav, md5_downloaded, md5))
+
+# errors of interrupted transfer, the download may be resumed after them
+TRANSFER_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+        requests.exceptions.Timeout, urllib3.exceptions.HTTPError)
+
 class QueueWorkerApplication(ChecksumsQueueServer):
 
     def custom_connect(self):
         logging.debug("Reached custom_connect")
         self.pgq = PgQAPI.PgQAPI()
+        self.pgq_batch = PgQBatch(self.pgq, self.queue, min_age=self.args.msg_min_age)
         logging.debug("self.pgq = [%s]", self.pgq)
 
+        if self.args.notify_channel:
+            self.pgq_batch.listen(self.args.notify_channel)
+
+        self._notify_due = None
+        self.poll_backoff = PollBackoff(self.args.sleep_min, float(self.args.sleep), jitter=self.args.sleep_jitter)
+
+        if self.finalizer is None:
+            self.finalizer = PgQFinalizer(self.pgq_batch, max_size=self.args.finalize_size, max_delay=self.args.finalize_delay)
+            return
+
+        # results not written before reconnection: their messages are active and claimed by nobody else
+        self.finalizer.batch = self.pgq_batch
+        self._flush_results()
+
     def custom_run(self):
         logging.debug("Reached custom_run")
         logging.debug("Entering infinite loop")
+        self._stop_requested = False
+        _handler = signal.signal(signal.SIGTERM, self._request_stop)
+
+        try:
+            while not self._stop_requested:
+                if self._process_db_batch():
+                    self.poll_backoff.reset()
+                    continue
+
+                # nothing to buffer results for while the queue is empty
+                self.finalizer.flush()
+                _delay = self.poll_backoff.next_delay()
+                logging.debug("Poll backoff state: %s", self.poll_backoff.stats())
+                self._wait_for_messages(_delay)
+        finally:
+            signal.signal(signal.SIGTERM, _handler)
+            self._flush_results()
+
+        logging.info("Stopped on request")
+
+    def run(self):
+        """
+        AMQP main loop. On SIGTERM new deliveries are not taken any more,
+        ones in flight are finished and acknowledged on disconnection.
+        """
+        self._stop_requested = False
+        _handler = signal.signal(signal.SIGTERM, self._request_stop)
+
+        try:
+            super().run()
+        finally:
+            signal.signal(signal.SIGTERM, _handler)
+
+    def _request_stop(self, signum=None, frame=None):
+        """
+        Finish messages being processed and stop, do not reconnect
+        """
+        logging.info("Stop requested")
+        self._stop_requested = True
+        self.reconnect = False
+        self.stop()
+
+    def _flush_results(self):
+        """
+        Write buffered message results on exit, do not mask the original exception if it fails
+        """
+        try:
+            self.finalizer.flush()
+        except Exception as _e:
+            logging.exception("Unable to finalize buffered messages: %s", _e)
+
+    def stats(self):
+        """
+        Worker state for monitoring
+        :return dict:
+        """
+        _result = {
+            "messages": self.counter_messages,
+            "good": self.counter_good,
+            "bad": self.counter_bad,
+            "coalesced": self.counter_coalesced}
+
+        if self.db_monitor:
+            _result["db"] = self.db_monitor.stats()
+
+        if self.poll_backoff:
+            _result["poll"] = self.poll_backoff.stats()
+
+        if self.finalizer:
+            _result["finalizer"] = self.finalizer.stats()
+
+        if self.download_cache:
+            _result["download_cache"] = self.download_cache.stats()
+
+        if self.prefetcher:
+            _result["prefetch"] = self.prefetcher.stats()
+
+        if self.metadata_cache:
+            _result["metadata_cache"] = self.metadata_cache.stats()
+
+        if self.state_cache:
+            _result["state_cache"] = self.state_cache.stats()
+
+        if self.known_filter:
+            _result["checksum_filter"] = self.known_filter.stats()
+
+        if self.executor and self.executor.lanes:
+            _result["lanes"] = self.executor.lanes
+
+        return _result
+
+    def _wait_for_messages(self, timeout):
+        """
+        Wait for new messages in PSQL queue: sleep for timeout given,
+        or block on notification channel with the timeout as a fallback
+        :param float timeout: seconds to wait
+        """
+        if not self.args.notify_channel:
+            logging.debug("No new messages, sleeping [%s]", timeout)
+            time.sleep(timeout)
+            return
+
+        # messages notified about may be too young to be taken yet,
+        # so wake up as soon as the notified ones become old enough
+        if self._notify_due is not None:
+            timeout = max(0, min(timeout, self._notify_due - time.time()))
+            self._notify_due = None
+
+        logging.debug("No new messages, waiting for notification on [%s] up to [%s]", self.args.notify_channel, timeout)
+
+        if self.pgq_batch.wait(timeout) and self.args.msg_min_age:
+            self._notify_due = time.time() + self.args.msg_min_age
+
+    def _process_db_batch(self):
+        """
+        Claim a batch of messages from PSQL queue, process them and finalize the results
+        :return int: number of messages processed
+        """
+        logging.debug("Trying to get up to [%d] messages from [%s]", self.args.batch_size, self.queue)
+        _messages = self.pgq_batch.claim(self.args.batch_size)
+
+        if not _messages:
+            return 0
+
+        for _msg_id, _msg in _messages:
+            logging.info("Fetched message [%s] with id [%s]", _msg, _msg_id)
+
+        if self.args.coalesce_window is None:
+            _groups = list(([_msg_id], _msg) for _msg_id, _msg in _messages)
+        else:
+            _messages += self._claim_window(len(_messages))
+            _groups = self.coalescer.coalesce(_messages, self._message_key)
+
+        for _msg_ids, _msg in _groups:
+            self._prefetch_message(_msg)
+
+        _pending = list()
+
+        for _msg_ids, _msg in _groups:
+            if len(_msg_ids) > 1:
+                logging.info("Messages %s are merged into [%s]", _msg_ids, _msg)
+
+            _pending.append((_msg_ids, self._submit(self._message_key(_msg), self._process_db_message, _msg)))
+
+        _results = list()
+
+        for _msg_ids, _future in _pending:
+            _error = _future.result()
+            self.counter_coalesced += len(_msg_ids) - 1
+
+            for _msg_id in _msg_ids:
+                self.counter_messages += 1
+
+                if _error is None:
+                    self.counter_good += 1
+                else:
+                    self.counter_bad += 1
+
+                _results.append((_msg_id, _error))
+
+        if self.prefetcher:
+            # messages failed before downloading
+            self.prefetcher.clear()
+
+        self.finalizer.add(_results)
+        return len(_messages)
+
+    def _claim_window(self, claimed):
+        """
+        Wait for coalescing window and claim more messages to merge them with ones got already
+        :param int claimed: number of messages claimed already
+        :return list: tuples (msg_id, payload)
+        """
+        if not self.args.coalesce_window or claimed >= self.args.batch_size:
+            return list()
+
+        logging.debug("Waiting [%s] seconds for messages to coalesce", self.args.coalesce_window)
+        time.sleep(self.args.coalesce_window)
+        _messages = self.pgq_batch.claim(self.args.batch_size - claimed)
+
+        for _msg_id, _msg in _messages:
+            logging.info("Fetched message [%s] with id [%s]", _msg, _msg_id)
+
+        return _messages
+
+    def _process_db_message(self, msg):
+        """
+        Dispatch a single message got from PSQL queue
+        :param list msg: message payload: [msg_type, args, kvargs]
+        :return str: error message, None if processed successfully
+        """
+        try:
+            msg_type, args, kvargs = msg
+            logging.debug("message type: [%s]", msg_type)
+            if msg_type == "register_file":
+                logging.debug("executing register_file")
+                self.register_file(*args, **kvargs)
+            elif msg_type == "register_checksum":
+                logging.debug("executing register_checksum")
+                self.register_checksum(*args, **kvargs)
+            else:
+                logging.error("unknown msg_type")
+                return "unknown msg_type"
+        except SlowLaneRequired:
+            raise
+        except Exception as e:
+            logging.exception("An exception occured: %s", e)
+            return str(e)
+
+        return None
+
+    def _message_key(self, msg):
+        """
+        Ordering key of a message: messages for the same location are processed one by one
+        :param list msg: message payload: [msg_type, args, kvargs]
+        :return tuple: (path, loctype_code), None if message has no location
+        """
+        try:
+            _msg_type, _args, _kvargs = msg
+            _loc = FileLocation(*(_args[0] if _args else _kvargs.get("location")))
+            return (_loc.path, _loc.loctype_code)
+        except Exception:
+            return None
+
+    def _concurrency(self):
+        """
+        Number of messages processed in parallel.
+        Zero in arguments means up to AMQP prefetch window or db batch size.
+        :return int:
+        """
+        if self.args.concurrency > 0:
+            return self.args.concurrency
+
+        if self.args.msg_source == "db":
+            return self.args.batch_size
+
+        return self.prefetch_count
+
+    def _submit(self, key, fn, *args):
+        """
+        Run a job on the thread pool if concurrency is enabled, in current thread otherwise
+        :param key: ordering key, see _message_key
+        :param fn: callable to run
+        :return concurrent.futures.Future: job result
+        """
+        if self._concurrency() <= 1 and not self.args.slow_concurrency:
+            _future = concurrent.futures.Future()
+
+            try:
+                _future.set_result(fn(*args))
+            except Exception as _e:
+                _future.set_exception(_e)
+
+            return _future
+
+        if not self.executor:
+            self._start_executor()
+
+        return self.executor.submit(key, self._run_threaded, fn, *args)
+
+    def _start_executor(self):
+        """
+        Create thread pool for concurrent messages
+        """
+        _concurrency = max(1, self._concurrency())
+        logging.debug("Starting thread pool of [%d] workers, [%d] in slow lane", _concurrency, self.args.slow_concurrency)
+        self.executor = KeyedExecutor(_concurrency, slow_workers=self.args.slow_concurrency)
+
+    def _run_threaded(self, fn, *args, **kvargs):
+        """
+        Run a job in a pool thread. Each thread has its own Django database connection,
+        it is closed or reused after the job according to connection settings.
+        :param fn: callable to run
+        """
+        if self.db_monitor:
+            self.db_monitor.check()
+        elif django.conf.settings.configured:
+            django.db.close_old_connections()
+
+        try:
+            return fn(*args, **kvargs)
+        finally:
+            if django.conf.settings.configured:
+                django.db.close_old_connections()
+
+    def _run_db(self, fn, *args, **kvargs):
+        """
+        Run a message handler with database connection checked, repeat it once if the connection is lost
+        :param fn: callable to run, should be safe to repeat
+        """
+        if not self.db_monitor:
+            return fn(*args, **kvargs)
+
+        return self.db_monitor.run(fn, *args, **kvargs)
+
+    def _shutdown_executor(self):
+        """
+        Wait for all jobs and stop the thread pool
+        """
+        if not self.executor:
+            return
+
+        logging.debug("Stopping thread pool")
+        self.executor.shutdown(wait=True)
+        self.executor = None
+
+        if self.prefetcher:
+            self.prefetcher.clear()
+
+    def _process_message(self, delivery_tag, properties, body):
+        """
+        Process AMQP delivery. With concurrency enabled it is put to the thread pool and
+        acknowledged by the pool thread once processed.
+        """
+        if self._concurrency() <= 1 and not self.args.slow_concurrency:
+            return super()._process_message(delivery_tag, properties, body)
+
+        self.counter_messages += 1
+
+        try:
+            _msg = json.loads(body)
+        except Exception:
+            _msg = None
+
+        _key = self._message_key(_msg)
+        _group = self._coalesce_delivery(_msg, _key, (delivery_tag, properties, body))
+
+        if _group:
+            # scheduled first: the job may be finished before the download would be queued otherwise
+            self._prefetch_message(_msg)
+            self._submit(_key, self._process_delivery_group, _group)
+
+    def _coalesce_delivery(self, msg, key, delivery):
+        """
+        Merge AMQP delivery into a group of the same location and CI type waiting in the pool queue.
+        Groups are open until their processing starts.
+        :param list msg: message payload, None if it can not be parsed
+        :param tuple key: ordering key of the message, see _message_key
+        :param tuple delivery: (delivery_tag, properties, body)
+        :return list: new group [[delivery], msg] to be submitted, None if delivery is merged into a waiting one
+        """
+        _group = [[delivery], msg]
+        _normalized = None if self.args.coalesce_window is None else self.coalescer.normalize(msg)
+
+        with self._counters_lock:
+            if _normalized is None:
+                # keep order of processing for other messages of the same location
+                self._open_groups = dict((_k, _v) for _k, _v in self._open_groups.items() if _k[:2] != key)
+                return _group
+
+            _ckey = self.coalescer.key(_normalized)
+            _waiting = self._open_groups.get(_ckey)
+
+            if _waiting is None:
+                self._open_groups[_ckey] = _group
+                return _group
+
+            self.coalescer.add(_waiting, delivery, _normalized)
+            self.counter_coalesced += 1
+            logging.info("Delivery [%s] is merged into [%s]", delivery[0], _waiting[1])
+            return None
+
+    def _process_delivery_group(self, group):
+        """
+        Close the group for merging and process it
+        :param list group: [[(delivery_tag, properties, body), ...], msg]
+        """
+        with self._counters_lock:
+            self._open_groups = dict((_k, _v) for _k, _v in self._open_groups.items() if _v is not group)
+            _deliveries, _msg = group
+
+        try:
+            if len(_deliveries) == 1:
+                return self._process_delivery(_deliveries, _deliveries[0][2])
+
+            return self._process_delivery(_deliveries, json.dumps(_msg).encode("utf-8"))
+        finally:
+            # the message may fail before its prefetched download is taken
+            _loc = self._prefetch_location(_msg)
+
+            if _loc is not None:
+                self.prefetcher.discard(_loc.path)
+
+    def _process_delivery(self, deliveries, body):
+        """
+        Process AMQP delivery in a pool thread and report the result
+        :param list deliveries: tuples (delivery_tag, properties, body) of all deliveries merged into the body
+        :param bytes body: message body to process
+        """
+        _start_t = time.time()
+
+        try:
+            self.on_message_raw(body, deliveries[0][1])
+        except SlowLaneRequired:
+            raise
+        except Exception as _e:
+            _delay = 0
+
+            with self._counters_lock:
+                for _delivery_tag, _properties, _body in deliveries:
+                    _delay = max(_delay, self._on_nack_delay(_body, _properties, result=_e))
+
+            # other jobs are not blocked on counters while this one backs off
+            if _delay > 0:
+                time.sleep(_delay)
+
+            for _delivery_tag, _properties, _body in deliveries:
+                self._report_message_result(delivery_tag=_delivery_tag, ack=False, requeue=self.deads_disabled)
+
+            return
+
+        _delta_t = time.time() - _start_t
+        logging.debug("Message processing took %f" % _delta_t)
+
+        for _delivery_tag, _properties, _body in deliveries:
+            self._report_message_result(delivery_tag=_delivery_tag, ack=True, requeue=False, time_delta=_delta_t)
+
+            with self._counters_lock:
+                self._on_ack(_body, _properties)
+
+    def _on_nack_delay(self, body, properties, result):
+        """
+        Background actions if nack occurred, the same as QueueServer._on_nack but without sleeping
+        :param bytes body: message body
+        :param properties: message properties
+        :param Exception result: message processing result
+        :return float: seconds to sleep before the message is rejected, zero for none
+        """
+        logging.exception(result)
+        self.counter_bad += 1
+        self._nacks += 1
+        self.on_nack(body, properties, result)
+
+        if self.max_sleep > 0 and self.deads_disabled:
+            return min(2 ** self._nacks, self.max_sleep)
+
+        return 0
+
+    def disconnect(self):
+        """
+        Finish messages being processed before disconnection
+        """
+        self._shutdown_executor()
+        super().disconnect()
+
+    def supervisor_connect(self):
+        logging.debug("Reached supervisor_connect, connections are made by worker processes")
+
+    def supervisor_run(self):
+        """
+        Fork worker processes and supervise them. Supervisor process exits when all workers are finished.
+        """
+        logging.debug("Reached supervisor_run")
+        # database connections must not be shared with children
+        django.db.connections.close_all()
+        _status = WorkerSupervisor(self._run_child, self.args.workers).run()
+        logging.info("All worker processes finished, exit status: %d", _status)
+        raise SystemExit(_status)
+
+    def _run_child(self):
+        """
+        Worker process main loop: the same as QueueApplication.main does after initialization
+        :return int: exit code
+        """
+        self.connect = self._child_connect
+        self.run = self._child_run
+
         while True:
-            msg = None
-            msg_id = None
-            msg_type = None
-            args = None
-            kvargs = None
-            logging.debug("Trying to get message from [%s]", self.queue)
-            ds = self.pgq.new_msg_from_queue(self.queue)
-            if not ds:
-                logging.debug("No new messages, sleeping [%s]", self.args.sleep)
-                time.sleep(int(self.args.sleep))
+            _ret = self._connect_and_run()
+
+            if self.reconnect and _ret != 0:
+                time.sleep(self._terminate_delay)
+                logging.warning("Reconnecting...")
                 continue
-            msg, msg_id = ds
-            logging.info("Fetched message [%s] with id [%s]", msg, msg_id)
-            try:
-                msg_type, args, kvargs = msg
-                logging.debug("message type: [%s]", msg_type)
-                if msg_type == "register_file":
-                    logging.debug("executing register_file")
-                    self.register_file(*args, **kvargs)
-                elif msg_type == "register_checksum":
-                    logging.debug("executing register_checksum")
-                    self.register_checksum(*args, **kvargs)
-                else:
-                    logging.error("unknown msg_type")
-                    self.pgq.msg_proc_fail(msg_id, "unknow msg_type")
-            except Exception as e:
-                logging.exception("An exception occured: %s", e)
-                self.pgq.msg_proc_fail(msg_id, str(e))
-            self.pgq.msg_proc_end(msg_id)
 
+            return _ret
 
     def __init__(self, *args, **kvargs):
         self.setup_orm = kvargs.pop('setup_orm', True)
         self.controller = kvargs.pop('controller', None)
         self.remove = False
+        self.poll_backoff = None
+        self.finalizer = None
+        self.download_cache = None
+        self.prefetcher = None
+        self.metadata_cache = None
+        self.state_cache = None
+        self.known_filter = None
+        self._known_filter_lock = threading.Lock()
+        self.db_monitor = None
+        self._stop_requested = False
+        self.executor = None
+        self._counters_lock = threading.Lock()
+        self._mvn_local = threading.local()
+        self.counter_coalesced = 0
+        self._open_groups = dict()
+        self.coalescer = RegistrationCoalescer(self.register_file)
         super().__init__(*args, **kvargs)
 
     @property
@@ -80,6 +593,37 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         :param argparse.Namespace args: parsed command-line arguments
         """
         setup_logging()
+        self._shutdown_executor()
+        # arguments may differ, so clients are created again
+        self._mvn_local = threading.local()
+        self.download_cache = None
+
+        if args.cache_dir:
+            logging.info("Download cache: [%s], %d bytes", args.cache_dir, args.cache_size)
+            self.download_cache = DownloadCache(args.cache_dir, args.cache_size)
+
+        self.prefetcher = None
+
+        if args.download_prefetch > 0:
+            logging.info("Prefetching downloads up to %d bytes", args.download_prefetch)
+            self.prefetcher = DownloadPrefetcher(args.download_prefetch)
+
+        self.metadata_cache = None
+
+        if args.metadata_ttl > 0 or args.metadata_negative_ttl > 0:
+            logging.info("Caching MVN metadata for %s seconds, absence for %s seconds", args.metadata_ttl, args.metadata_negative_ttl)
+            self.metadata_cache = mvn_metadata.MetadataCache(args.metadata_ttl, args.metadata_negative_ttl)
+
+        self.state_cache = None
+        # loaded from database when the first archive is registered
+        self.known_filter = None
+
+        if args.state_cache_size > 0 and args.state_cache_ttl > 0:
+            logging.info("Caching registration state of %d locations for %s seconds", args.state_cache_size, args.state_cache_ttl)
+            self.state_cache = registration_state.RegistrationStateCache(args.state_cache_size, args.state_cache_ttl)
+
+        self.db_monitor = ConnectionMonitor(None if args.db_conn_max_age < 0 else args.db_conn_max_age, args.db_check_interval)
+
         if args.remove == 'no':
             self.remove = False         # never remove artifacts from DB
         elif args.remove == 'always':
@@ -108,6 +652,7 @@ class QueueWorkerApplication(ChecksumsQueueServer):
             user=self.args.psql_user,
             password=self.args.psql_password,
             installed_apps=_installed_apps)
+        self.db_monitor.configure()
 
         if self.controller:
             logging.debug("ORM initialization done, controller has been provided already")
@@ -128,6 +673,13 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         else:
             self.pgq = None
 
+        if args.workers > 1:
+            logging.debug("Running [%d] worker processes, replacing connect and run methods with supervisor", args.workers)
+            self._child_connect = self.connect
+            self._child_run = self.run
+            self.connect = self.supervisor_connect
+            self.run = self.supervisor_run
+
     def custom_args(self, parser):
         """
         Append specific arguments for this worker
@@ -149,8 +701,58 @@ class QueueWorkerApplication(ChecksumsQueueServer):
                             default=os.getenv("MVN_USER"))
         parser.add_argument("--mvn-password", dest="mvn_password", help="MVN password",
                             default=os.getenv("MVN_PASSWORD"))
+        parser.add_argument("--mvn-pool-size", dest="mvn_pool_size", help="Keep-alive connections to MVN kept by each worker thread",
+                            type=int, default=10)
+        parser.add_argument("--spool-size", dest="spool_size", help="Artifacts up to this size in bytes are downloaded into memory, 0 to always use temporary files",
+                            type=int, default=1048576)
+        parser.add_argument("--cache-dir", dest="cache_dir", help="Directory to keep downloaded artifacts in, no cache if not set",
+                            default=os.getenv("DOWNLOAD_CACHE_DIR"))
+        parser.add_argument("--cache-size", dest="cache_size", help="Download cache size in bytes, least recently used artifacts are removed above it",
+                            type=int, default=10737418240)
+        parser.add_argument("--bulk-members", dest="bulk_members", help="Register archive members with bulk database statements (depth 1 only)",
+                            action="store_true")
+        parser.add_argument("--checksum-filter", dest="checksum_filter", help="Keep a filter of registered checksums in memory to skip looking up new archive members, with --bulk-members",
+                            action="store_true")
+        parser.add_argument("--metadata-ttl", dest="metadata_ttl", help="Seconds MVN metadata of existing artifact is cached, 0 to disable",
+                            type=float, default=0)
+        parser.add_argument("--metadata-negative-ttl", dest="metadata_negative_ttl", help="Seconds absence of artifact in MVN is cached, 0 to disable",
+                            type=float, default=0)
+        parser.add_argument("--state-cache-size", dest="state_cache_size", help="Locations registered by this worker whose checksum and depth are cached, 0 to disable",
+                            type=int, default=0)
+        parser.add_argument("--state-cache-ttl", dest="state_cache_ttl", help="Seconds registration state of a location is cached",
+                            type=float, default=600)
+        parser.add_argument("--download-retries", dest="download_retries", help="Times an interrupted download is resumed with Range requests",
+                            type=int, default=3)
+        parser.add_argument("--download-prefetch", dest="download_prefetch", help="Bytes of artifacts downloaded in background for messages waiting to be processed, 0 to disable",
+                            type=int, default=0)
+        parser.add_argument("--db-conn-max-age", dest="db_conn_max_age", help="Seconds a database connection is reused, 0 to reconnect for each message, -1 for unlimited",
+                            type=float, default=600)
+        parser.add_argument("--db-check-interval", dest="db_check_interval", help="Seconds a database connection is not checked for liveness again before processing a message",
+                            type=float, default=5)
         parser.add_argument("--msg-source", dest="msg_source", help="The source of messages - amqp or db", default=os.getenv("MSG_SOURCE"))
         parser.add_argument("--sleep", dest="sleep", help="Seconds between new messages queries", default="10")
+        parser.add_argument("--sleep-min", dest="sleep_min", help="Seconds before first repeated query on empty queue, doubled up to --sleep",
+                            type=float, default=0.5)
+        parser.add_argument("--sleep-jitter", dest="sleep_jitter", help="Random fraction of sleep time to spread queries of replicas",
+                            type=float, default=0.2)
+        parser.add_argument("--concurrency", dest="concurrency", help="Messages processed in parallel threads, 0 for AMQP prefetch count or db batch size",
+                            type=int, default=1)
+        parser.add_argument("--slow-concurrency", dest="slow_concurrency", help="Messages needing download processed in parallel in a separate slow lane, 0 for no lanes",
+                            type=int, default=0)
+        parser.add_argument("--workers", dest="workers", help="Worker processes forked after initialization",
+                            type=int, default=1)
+        parser.add_argument("--batch-size", dest="batch_size", help="Messages taken from db queue by one query",
+                            type=int, default=1)
+        parser.add_argument("--coalesce-window", dest="coalesce_window", help="Merge register_file messages for the same location waiting up to this seconds, disabled if not set",
+                            type=float, default=None)
+        parser.add_argument("--finalize-size", dest="finalize_size", help="Db message results buffered before they are written",
+                            type=int, default=100)
+        parser.add_argument("--finalize-delay", dest="finalize_delay", help="Seconds db message results may be buffered, 0 to write after each batch",
+                            type=float, default=0)
+        parser.add_argument("--msg-min-age", dest="msg_min_age", help="Seconds a db message has to wait in queue before it is taken",
+                            type=int, default=60)
+        parser.add_argument("--notify-channel", dest="notify_channel", help="PSQL notification channel to wait on instead of sleeping",
+                            default=os.getenv("PSQL_MQ_CHANNEL"))
 
         return parser
 
@@ -192,7 +794,8 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         if self.remove is not None:
             remove = self.remove
 
-        self._register_location(_loc, citype, depth, remove=remove, reason=reason)
+        # registration is safe to repeat if database connection is lost
+        self._run_db(self._register_location, _loc, citype, depth, remove=remove, reason=reason)
 
     def register_checksum(self, location, checksum, citype=None, cs_prov='Regular', mime='Data', cs_alg='MD5', version=None, client=None, parent=None, artifact_deliverable=None):
         """
@@ -214,7 +817,9 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         if cs_alg != 'MD5':
             raise NotImplementedError('MD5 checksum is supported only')
 
-        self.controller.register_file_md5(checksum, citype, mime, loc.path, loc.loctype_code, loc.revision, cs_prov)
+        self._invalidate_state(loc)
+        self._run_db(self.controller.register_file_md5, checksum, citype, mime, loc.path, loc.loctype_code, loc.revision, cs_prov)
+        self._remember_checksum(checksum)
 
     def _register_location(self, location, citype=None, depth=0, remove=False, reason="Object does not exist"):
         """
@@ -229,19 +834,244 @@ class QueueWorkerApplication(ChecksumsQueueServer):
             raise NotImplementedError("Nexus archive registration is currently supported only")
 
         # MVN client is necessary for further actions
+        _mvn = self._mvn_client()
+
+        try:
+            try:
+                self._register_location_with(_mvn, location, citype, depth, remove, reason)
+            except (MetadataExpiredError, DownloadVerificationError) as _e:
+                # cached entry is dropped already, so metadata is got from repository this time
+                # and checksum is calculated from the artifact itself instead of sidecar file
+                logging.info(str(_e))
+                self._register_location_with(_mvn, location, citype, depth, remove, reason, sidecar=False)
+        except requests.exceptions.ConnectionError:
+            # session may be broken, a new one is created for the next message
+            self._drop_mvn_client()
+            raise
+        finally:
+            if self.prefetcher:
+                self.prefetcher.discard(location.path)
+
+    def _prefetch_message(self, msg):
+        """
+        Start background download for a 'register_file' message waiting to be processed
+        :param list msg: message payload: [msg_type, args, kvargs]
+        """
+        _loc = self._prefetch_location(msg)
+
+        if _loc is None:
+            return
+
+        _depth = self.coalescer.normalize(msg)[2].get("depth") or 0
+        self.prefetcher.schedule(_loc.path, self._run_threaded, self._prefetch_download,
+                _loc, min(_depth, self.args.max_depth))
+
+    def _prefetch_location(self, msg):
+        """
+        Location of a message which download may be prefetched
+        :param list msg: message payload: [msg_type, args, kvargs]
+        :return FileLocation: None if prefetching is disabled or not applicable to the message
+        """
+        if not self.prefetcher:
+            return None
+
+        _normalized = self.coalescer.normalize(msg)
+
+        if _normalized is None:
+            return None
+
+        _loc = FileLocation(*_normalized[2]["location"])
+
+        if _loc.loctype_code != "NXS":
+            return None
+
+        return _loc
+
+    def _prefetch_download(self, location, depth, reserve):
+        """
+        Background download job, see DownloadPrefetcher.schedule
+        :param FileLocation location: location tuple
+        :param int depth: registration depth requested
+        :param reserve: callable reserving artifact size in prefetch limit
+        :return tuple: (file object, digests), None if the artifact is not to be downloaded
+        """
+        _mvn = self._mvn_client()
+        _artifact_info = self._describe(_mvn, location.path)
+
+        if _artifact_info is None:
+            return None
+
+        _md5 = _artifact_info.get("md5")
+        self._complete_metadata(_mvn, location.path, _artifact_info)
+
+        if not self._needs_download(location, depth, _artifact_info):
+            return None
+
+        if not reserve(_artifact_info.get("size")):
+            logging.debug("Not prefetching '%s' of size %s", location.path, _artifact_info.get("size"))
+            return None
+
+        logging.debug("Prefetching '%s'", location.path)
+        _digests = dict()
+        _file = self._fetch(_mvn, location.path, digests=_digests, size=_artifact_info.get("size"), md5=_md5)
+        return (_file, _digests)
+
+    def _needs_download(self, location, depth, artifact_info):
+        """
+        Guess whether registration is going to download the artifact, nothing is changed in database
+        :param FileLocation location: location tuple
+        :param int depth: registration depth requested
+        :param dict artifact_info: artifact metadata, see mvn_metadata.describe
+        :return bool:
+        """
+        if not all([artifact_info.get("md5"), artifact_info.get("mime")]):
+            return True
+
+        if not depth or self._cached_registered(location, depth, artifact_info["md5"]):
+            return False
+
+        _state = self._registration_state(location)
+
+        if _state is not None:
+            _checksum_cur, _fl_cur, _depth_cur = _state
+            return _checksum_cur != artifact_info["md5"] or not _fl_cur or _depth_cur < depth
+
+        if self.controller.get_location_checksum(location.path, location.loctype_code) != artifact_info["md5"]:
+            return True
+
+        _fl_cur = self.controller.get_file_by_location(location.path, location.loctype_code, history=False)
+        return not _fl_cur or (self.controller.get_current_inclusion_depth(_fl_cur) or 0) < depth
+
+    def _mvn_client(self):
+        """
+        Get persistent MVN client of the current thread, create it if necessary.
+        Clients are not shared between threads since HTTP session is not thread-safe.
+        :return NexusAPI:
+        """
+        _mvn = getattr(self._mvn_local, "client", None)
+
+        if _mvn is not None:
+            return _mvn
+
+        logging.debug("Creating MVN client for [%s]", self.args.mvn_url)
         _mvn = NexusAPI.NexusAPI(root=self.args.mvn_url,
                 user=self.args.mvn_user,
                 auth=self.args.mvn_password,
                 readonly=False,
                 anonymous=False)
-        # first check if artifact has been removed
+        _web = getattr(_mvn, "web", None)
+
+        if isinstance(_web, requests.Session):
+            # keep retry policy of the client, resize keep-alive connections pool only
+            for _prefix in ["https://", "http://"]:
+                _web.mount(_prefix, requests.adapters.HTTPAdapter(
+                    pool_connections=self.args.mvn_pool_size,
+                    pool_maxsize=self.args.mvn_pool_size,
+                    max_retries=_web.get_adapter(_prefix).max_retries))
+
+        self._mvn_local.client = _mvn
+        return _mvn
+
+    def _drop_mvn_client(self):
+        """
+        Close and forget MVN client of the current thread
+        """
+        _mvn = getattr(self._mvn_local, "client", None)
+        self._mvn_local.client = None
+
+        if isinstance(getattr(_mvn, "web", None), requests.Session):
+            logging.debug("Closing MVN client session")
+            _mvn.web.close()
+
+    def _describe(self, mvn_client, gav):
+        """
+        Get artifact metadata, from cache if enabled
+        :param NexusAPI mvn_client: active NexusAPI instance
+        :param str gav: artifact GAV
+        :return dict: see mvn_metadata.describe; "cached" key is set to True if taken from cache
+        """
+        if not self.metadata_cache:
+            return mvn_metadata.describe(mvn_client, gav)
+
+        _cached, _info = self.metadata_cache.get(gav)
+
+        if _cached:
+            logging.debug("MVN metadata for '%s' taken from cache" % gav)
+
+            if _info is not None:
+                _info["cached"] = True
+
+            return _info
+
+        _info = mvn_metadata.describe(mvn_client, gav)
+        self.metadata_cache.put(gav, _info)
+        return _info
+
+    def _invalidate_metadata(self, gav):
+        """
+        Drop cached metadata of an artifact
+        :param str gav: artifact GAV
+        """
+        if self.metadata_cache:
+            self.metadata_cache.invalidate(gav)
+
+    def _complete_metadata(self, mvn_client, gav, artifact_info, sidecar=True):
+        """
+        Fill MD5 and MIME missing in repository metadata without downloading the artifact:
+        MD5 from '.md5' sidecar file, MIME from the artifact header got with a Range request
+        :param NexusAPI mvn_client: active NexusAPI instance
+        :param str gav: artifact GAV
+        :param dict artifact_info: artifact metadata, modified in place
+        :param bool sidecar: take MD5 from sidecar file
+        """
+        if not artifact_info.get("md5") and sidecar:
+            artifact_info["md5"] = mvn_metadata.sidecar_md5(mvn_client, gav)
+
+            if artifact_info["md5"]:
+                logging.debug("MD5 for '%s' taken from sidecar file: '%s'" % (gav, artifact_info["md5"]))
+
+        if not artifact_info.get("md5") or artifact_info.get("mime") or not mvn_ranges.supports_ranges(mvn_client):
+            return
+
+        if artifact_info.get("size") == 0:
+            # nothing to ask for
+            return
+
+        try:
+            _resp = mvn_ranges.open_range(mvn_client, gav, 0, MIME_HEADER_SIZE - 1)
+        except (mvn_ranges.RangeNotSupported, NexusAPI.NexusAPIError) as _e:
+            logging.debug("Unable to get header of '%s': %s" % (gav, _e))
+            return
+
+        try:
+            _header = _resp.content[:MIME_HEADER_SIZE]
+        finally:
+            _resp.close()
+
+        artifact_info["mime"] = self.controller.mime(io.BytesIO(_header))
+        logging.debug("MIME for '%s' detected from header: '%s'" % (gav, artifact_info["mime"]))
+
+    def _register_location_with(self, mvn_client, location, citype, depth, remove, reason, sidecar=True):
+        """
+        Location registration using MVN client given
+        :param NexusAPI mvn_client: active NexusAPI instance
+        :param FileLocation location: location tuple
+        :param str citype: CI Type code
+        :param int depth: depth of archive calculation
+        :param bool remove: remove non-existent location
+        :param str reason: reason of removing
+        :param bool sidecar: take MD5 from sidecar file if repository metadata have none
+        """
+        # first check if artifact has been removed, metadata is got with the same request
         logging.debug("Checking artifact exists: '%s'" % location.path)
+        _artifact_info = self._describe(mvn_client, location.path)
 
-        if not _mvn.exists(location.path):
+        if _artifact_info is None:
             logging.debug("Not found in MVN: '%s'" % location.path)
 
             if remove:
                 logging.info("Removing from DB: '%s'" % location.path)
+                self._invalidate_state(location)
                 self.controller.delete_location(location.path, location.loctype_code, reason=reason)
             else:
                 logging.info("Not found in MVN but not deleted: '%s'" % location.path)
@@ -254,19 +1084,30 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         # 2. Get location checksum from database and compare to one we have got.
         # 3. Turn full registration if checksum differ. Return
         # 4 Compare depth level. Download and Register if not equal to one we are requested for. Return.
-        _artifact_info = _mvn.info(location.path)
         _tempfile = None
+        # checksum from sidecar file is not trusted enough to verify a download
+        _md5 = _artifact_info.get("md5")
+        self._complete_metadata(mvn_client, location.path, _artifact_info, sidecar=sidecar)
 
-        if not _artifact_info:
-            logging.debug("No info from MVN for '%s'" % location.path)
-            _artifact_info = dict()
+        if not _md5 and _artifact_info.get("md5"):
+            # may be stale, so it is not trusted to detect an overwrite, the same as cached metadata
+            _artifact_info["sidecar"] = True
 
         if not all([_artifact_info.get("md5"), _artifact_info.get("mime")]):
-            _tempfile = self._download(_mvn, location.path)
-            # we should raise an exception in case of failure so no using '.get' dict method
-            logging.debug("Calculating MD5 and MIME from file downloaded")
-            _artifact_info['md5'] = self.controller.md5(_tempfile)
-            _artifact_info['mime'] = self.controller.mime(_tempfile)
+            _digests = dict()
+            _tempfile = self._download(mvn_client, location.path, digests=_digests,
+                    size=_artifact_info.get("size"), md5=_md5)
+
+            if _digests:
+                logging.debug("Taking MD5 and MIME calculated while downloading")
+                _artifact_info['md5'] = _digests["md5"]
+                _artifact_info['mime'] = self.controller.mime(io.BytesIO(_digests["header"]))
+            else:
+                # we should raise an exception in case of failure so no using '.get' dict method
+                logging.debug("Calculating MD5 and MIME from file downloaded")
+                _artifact_info['md5'] = self.controller.md5(_tempfile)
+                _artifact_info['mime'] = self.controller.mime(_tempfile)
+
             logging.debug("MD5 for '%s': '%s'" % (location.path, _artifact_info["md5"]))
             logging.debug("MIME for '%s': '%s'" % (location.path, _artifact_info["mime"]))
 
@@ -274,31 +1115,225 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         # to get rid of possible temfile bugs (was in Python 2.7) we need to close _temfile directly in case of failure too
         try:
             if self._check_artifact_not_registered(location, depth, _artifact_info, remove=remove):
-                _tempfile = self._register_artifact(_mvn, location, citype, depth, _artifact_info, _tempfile)
+                _tempfile = self._register_artifact(mvn_client, location, citype, depth, _artifact_info, _tempfile)
+                self._remember_state(location)
         finally:
             if _tempfile and not _tempfile.closed:
                 logging.debug("Closing TempFile")
                 _tempfile.close()
 
-    def _download(self, mvn_client, gav):
+    def _download_file(self, size=None):
+        """
+        Create file object to download an artifact to: kept in memory until it grows above '--spool-size'
+        :param int size: artifact size if known, a temporary file is created at once for larger ones
+        :return file object: tempfile.SpooledTemporaryFile or tempfile.NamedTemporaryFile
+        """
+        _spool_size = self.args.spool_size
+
+        if _spool_size <= 0 or (size is not None and size > _spool_size):
+            return tempfile.NamedTemporaryFile()
+
+        return tempfile.SpooledTemporaryFile(max_size=_spool_size)
+
+    def _download(self, mvn_client, gav, digests=None, size=None, md5=None):
         """
         Downloads artifact from MVN into temporary file and returns it
         :param NexusAPI mvn_client: active NexusAPI instance
         :param gav: gav to download
-        :return tempfile.NamedTemporaryFile:
+        :param dict digests: if given, "md5" and "header" (leading bytes for MIME detection) calculated
+                             while downloading are put here; left empty if they could not be calculated
+        :param int size: artifact size from MVN metadata if known, see '_download_file'
+        :param str md5: artifact checksum from MVN metadata if known, download cache is looked up by it
+        :return file object: tempfile.SpooledTemporaryFile or tempfile.NamedTemporaryFile, cached file if found
         """
-        _result = tempfile.NamedTemporaryFile()
-        logging.info("Downloading '%s' to '%s'" % (gav, _result.name))
+        _prefetched = self.prefetcher.take(gav) if self.prefetcher else None
+
+        if _prefetched:
+            _file, _digests = _prefetched
+
+            if md5 and _digests.get("md5") not in [None, md5]:
+                logging.info("Prefetched '%s' differs from repository metadata, downloading again" % gav)
+                _file.close()
+            else:
+                logging.info("Taking prefetched '%s'" % gav)
+
+                if digests is not None:
+                    digests.update(_digests)
+
+                _file.seek(0)
+                return _file
+
+        return self._fetch(mvn_client, gav, digests=digests, size=size, md5=md5)
+
+    def _fetch(self, mvn_client, gav, digests=None, size=None, md5=None):
+        """
+        Get artifact from download cache or download it from MVN, arguments are the same as for '_download'
+        :return file object:
+        """
+        _cached = self.download_cache.get(md5) if self.download_cache else None
+
+        if _cached:
+            logging.info("Taking '%s' from download cache: '%s'" % (gav, _cached.name))
+
+            if digests is not None:
+                digests["md5"] = md5
+                digests["header"] = _cached.read(MIME_HEADER_SIZE)
+                _cached.seek(0)
+
+            return _cached
+
+        if current_lane() == "fast":
+            raise SlowLaneRequired("download of '%s'" % gav)
+
+        _result = self._download_file(size)
+        logging.info("Downloading '%s' to '%s'" % (gav, _result.name or "memory"))
         try:
-            mvn_client.cat(gav, binary=True, stream=True, write_to=_result)
+            _writer = HashingWriter(_result)
+            self._transfer(mvn_client, gav, _writer)
+
+            if md5 and _writer.valid and _writer.hexdigest("md5") != md5:
+                self._invalidate_metadata(gav)
+                raise DownloadVerificationError(gav, md5, _writer.hexdigest("md5"))
         except Exception as _e:
             # we have to close tempfile in case of failure due to 'tempfile' module feature
             _result.close()
             raise
 
-        logging.debug("Downloaded '%s' to '%s'" % (gav, _result.name))
+        logging.debug("Downloaded '%s' to '%s'" % (gav, _result.name or "memory"))
+
+        if not _writer.valid:
+            return _result
+
+        if digests is not None:
+            digests["md5"] = _writer.hexdigest("md5")
+            digests["header"] = _writer.header
+
+        if self.download_cache:
+            self.download_cache.put(_writer.hexdigest("md5"), _result)
+
         return _result
 
+    def _transfer(self, mvn_client, gav, writer):
+        """
+        Download artifact content. Interrupted transfer is continued from the last byte written
+        with Range requests, up to '--download-retries' times. Resumed requests are conditional:
+        the download is started over if the artifact has been changed since the first response.
+        :param NexusAPI mvn_client: active NexusAPI instance
+        :param str gav: gav to download
+        :param HashingWriter writer: file to write to
+        """
+        _retries = self.args.download_retries if mvn_ranges.supports_ranges(mvn_client) else 0
+        _backoff = PollBackoff(1.0, 30.0)
+        _attempt = 0
+        _validator = [None]
+
+        def _remember_validator(response, *args, **kvargs):
+            _validator[0] = mvn_ranges.validator(response)
+
+        # response headers are got before content is written
+        _kvargs = {"hooks": {"response": _remember_validator}} if _retries else dict()
+
+        while True:
+            try:
+                if _attempt and _validator[0]:
+                    _resp = mvn_ranges.open_range(mvn_client, gav, writer.size, if_range=_validator[0])
+
+                    try:
+                        if _resp.status_code == 200:
+                            logging.warning("'%s' has been changed since download started, downloading from the beginning", gav)
+                            writer.restart()
+                            _validator[0] = mvn_ranges.validator(_resp)
+
+                        shutil.copyfileobj(_resp.raw, writer)
+                    finally:
+                        _resp.close()
+
+                    writer.flush()
+                    return
+
+                if _attempt:
+                    logging.warning("'%s' has no ETag or Last-Modified header, downloading from the beginning", gav)
+                    writer.restart()
+
+                mvn_client.cat(gav, binary=True, stream=True, write_to=writer, **_kvargs)
+                return
+            except TRANSFER_ERRORS as _e:
+                # position of data written is unknown if writer is not valid
+                if _attempt >= _retries or not writer.valid:
+                    raise
+
+                _attempt += 1
+                _delay = _backoff.next_delay()
+                logging.warning("Download of '%s' interrupted at %d bytes: %s. Resuming in %s seconds, attempt %d of %d",
+                        gav, writer.size, _e, _delay, _attempt, _retries)
+                time.sleep(_delay)
+
+    def _registration_state(self, location):
+        """
+        Current checksum, file and depth of a location got with a single database query
+        instead of three controller calls
+        :param FileLocation location: location tuple
+        :return tuple: (checksum, file id, depth), see registration_state.location_state;
+                       None if controller models are unknown and controller calls are to be used
+        """
+        _models = registration_state.controller_models(self.controller)
+
+        if _models is None:
+            return None
+
+        return registration_state.location_state(_models, location.path, location.loctype_code)
+
+    def _cached_registered(self, location, depth, md5):
+        """
+        Check registration state cache, an entry with another checksum is dropped
+        :param FileLocation location: location tuple
+        :param int depth: registration depth requested
+        :param str md5: current artifact checksum
+        :return bool: True if location is known to be registered with the checksum and depth given or deeper
+        """
+        if not self.state_cache or not md5:
+            return False
+
+        _state = self.state_cache.get(location.path, location.loctype_code)
+
+        if _state is None:
+            return False
+
+        _checksum, _depth = _state
+
+        if _checksum != md5:
+            self._invalidate_state(location)
+            return False
+
+        return _depth >= depth
+
+    def _remember_state(self, location):
+        """
+        Put state of a location just registered to the cache.
+        It is read back from database since the depth registered may differ from the one requested.
+        :param FileLocation location: location tuple
+        """
+        if not self.state_cache:
+            return
+
+        _state = self._registration_state(location)
+
+        if _state is None:
+            return
+
+        _checksum, _fl_cur, _depth = _state
+
+        if _fl_cur:
+            self.state_cache.put(location.path, location.loctype_code, _checksum, _depth)
+
+    def _invalidate_state(self, location):
+        """
+        Forget cached registration state of a location
+        :param FileLocation location: location tuple
+        """
+        if self.state_cache:
+            self.state_cache.invalidate(location.path, location.loctype_code)
+
     def _check_artifact_not_registered(self, location, depth, artifact_info, remove=False):
         """
         Check if artifact is to be registered or not.
@@ -310,7 +1345,18 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         :return bool: is registartion necessary or not
         """
         logging.debug("Checking artifact should be registered")
-        _checksum_cur = self.controller.get_location_checksum(location.path, location.loctype_code)
+
+        if self._cached_registered(location, depth, artifact_info.get("md5")):
+            logging.debug("'%s' is registered with depth %d or more according to cache, returning False" % (location.path, depth))
+            return False
+
+        _state = self._registration_state(location)
+
+        if _state is not None:
+            _checksum_cur, _fl_cur, _depth_cur = _state
+        else:
+            _checksum_cur = self.controller.get_location_checksum(location.path, location.loctype_code)
+
         logging.debug("Current checksum in database: %s" % _checksum_cur)
 
         if not _checksum_cur:
@@ -318,6 +1364,11 @@ class QueueWorkerApplication(ChecksumsQueueServer):
             return True
 
         if _checksum_cur != artifact_info.get("md5"):
+            self._invalidate_metadata(location.path)
+
+            if artifact_info.get("cached") or artifact_info.get("sidecar"):
+                raise MetadataExpiredError(location.path)
+
             # locatin was overwritten!
             logging.info("Location '%s' was overwritten: '%s' <> '%s'" % (location.path, _checksum_cur, artifact_info.get("md5")))
 
@@ -325,29 +1376,60 @@ class QueueWorkerApplication(ChecksumsQueueServer):
                 raise LocationOverwriteError(location.path)
 
             logging.info("Removing old location checksum from DB: '%s'" % location.path)
+            self._invalidate_state(location)
             self.controller.delete_location(location.path, location.loctype_code, reason="Location was overwritten")
             logging.debug("Old '%s' location removed, returning True" % location.path)
             return True
 
         # checksums are equal, next verification is on depth
         logging.debug("Checksums equal, checking registration depth")
-        _fl_cur = self.controller.get_file_by_location(location.path, location.loctype_code, history=False)
+
+        if _state is None:
+            _fl_cur = self.controller.get_file_by_location(location.path, location.loctype_code, history=False)
 
         if not _fl_cur:
             # this should never happen:
             logging.warning("No file by location found in DB, possible data inconsistence: '%s'" % location.path)
             return True
 
-        _depth_cur = self.controller.get_current_inclusion_depth(_fl_cur) or 0
+        if _state is None:
+            _depth_cur = self.controller.get_current_inclusion_depth(_fl_cur) or 0
+
         logging.debug("Current depth is: %d" % _depth_cur)
 
         if _depth_cur < depth:
             logging.info("'%s' is registered with depth %d (needed %d), returning True" % (location.path, _depth_cur, depth))
             return True
 
+        if self.state_cache:
+            self.state_cache.put(location.path, location.loctype_code, _checksum_cur, _depth_cur)
+
         logging.debug("Checking finished, returning False")
         return False
 
+    def _known_filter(self, models):
+        """
+        Get filter of registered checksums, load it on first call
+        :param module models: Django models module
+        :return ChecksumFilter: None if disabled
+        """
+        if not self.args.checksum_filter:
+            return None
+
+        with self._known_filter_lock:
+            if self.known_filter is None:
+                self.known_filter = ChecksumFilter.load(models)
+
+        return self.known_filter
+
+    def _remember_checksum(self, md5):
+        """
+        Put a checksum registered to the filter if one is loaded
+        :param str md5: checksum
+        """
+        if self.known_filter:
+            self.known_filter.add(md5)
+
     def _register_artifact(self, mvn_client, location, citype, depth, artifact_info, tmpfile=None):
         """
         Do registration depending on depth given
@@ -365,14 +1447,29 @@ class QueueWorkerApplication(ChecksumsQueueServer):
         if not depth:
             logging.debug("Registering checksum for '%s' since depth is zero" % location.path)
             self.controller.register_file_md5(artifact_info.get("md5"), citype, artifact_info.get("mime"), location.path, location.loctype_code)
+            self._remember_checksum(artifact_info.get("md5"))
             return tmpfile
 
         logging.debug("Registering '%s' with depth %d" % (location.path, depth))
 
         if not tmpfile:
-            tmpfile = self._download(mvn_client, location.path)
+            tmpfile = self._download(mvn_client, location.path, size=artifact_info.get("size"), md5=artifact_info.get("md5"))
+
+        _models = registration_state.controller_models(self.controller)
+
+        if _models is not None and depth == 1 and self.args.bulk_members:
+            logging.debug("Registering '%s' members with bulk statements" % location.path)
+            bulk_registration.register_archive(self.controller, _models, tmpfile, citype,
+                    location.path, location.loctype_code, artifact_info["md5"], self._known_filter(_models))
+            self._remember_checksum(artifact_info["md5"])
+            return tmpfile
+
+        _file_r = self.controller.register_file_obj(tmpfile, citype, location.path, location.loctype_code, inclusion_level=depth)
+        self._remember_checksum(artifact_info.get("md5"))
 
-        self.controller.register_file_obj(tmpfile, citype, location.path, location.loctype_code, inclusion_level=depth)
+        if self.known_filter and _models is not None:
+            # members registered by the controller are known since now
+            bulk_registration.remember_included(_models, _file_r, self.known_filter)
 
         return tmpfile
 
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+Merging of repeated 'register_file' messages
+"""
+
+import inspect
+import logging
+from oc_checksumsq.checksums_interface import FileLocation
+
+
+class RegistrationCoalescer(object):
+    """
+    Merges 'register_file' messages for the same location and CI type into one:
+    the maximal depth and the strongest 'remove' flag (reason string, then True, then False) are kept.
+    """
+
+    def __init__(self, register_file):
+        """
+        :param register_file: 'register_file' method, its signature is used to normalize message arguments
+        """
+        self.signature = inspect.signature(register_file)
+
+    def normalize(self, msg):
+        """
+        Convert 'register_file' message to keyword-only form
+        :param list msg: message payload: [msg_type, args, kvargs]
+        :return list: ["register_file", [], kvargs], None if message can not be merged
+        """
+        try:
+            _msg_type, _args, _kvargs = msg
+
+            if _msg_type != "register_file":
+                return None
+
+            _bound = self.signature.bind(*_args, **_kvargs)
+        except (TypeError, ValueError):
+            return None
+
+        _bound.apply_defaults()
+        _kvargs = dict(_bound.arguments)
+        _kvargs["location"] = list(_kvargs["location"])
+        return ["register_file", [], _kvargs]
+
+    def key(self, msg):
+        """
+        Messages with equal keys may be merged
+        :param list msg: normalized message, see 'normalize'
+        :return tuple: (path, loctype_code, citype)
+        """
+        _kvargs = msg[2]
+        _loc = FileLocation(*_kvargs["location"])
+        return (_loc.path, _loc.loctype_code, _kvargs.get("citype"))
+
+    def _remove_strength(self, remove):
+        if isinstance(remove, str):
+            return 2
+
+        return 1 if remove else 0
+
+    def merge(self, msg, other):
+        """
+        Merge two normalized messages with equal keys
+        :param list msg: message kept
+        :param list other: message merged into the first one
+        :return list: merged message
+        """
+        _kvargs = dict(msg[2])
+        _other = other[2]
+        _kvargs["depth"] = max(_kvargs.get("depth") or 0, _other.get("depth") or 0)
+
+        if self._remove_strength(_other.get("remove")) > self._remove_strength(_kvargs.get("remove")):
+            _kvargs["remove"] = _other.get("remove")
+
+        logging.debug("Merged registration request for %s: depth=%d remove=%s", _kvargs["location"], _kvargs["depth"], _kvargs["remove"])
+        return ["register_file", [], _kvargs]
+
+    def add(self, group, item, msg):
+        """
+        Merge a message into a group
+        :param list group: [[item, ...], msg], modified in place
+        :param item: message reference
+        :param list msg: normalized message with the same key as the group one
+        """
+        if len(group[0]) == 1:
+            group[1] = self.normalize(group[1])
+
+        group[0].append(item)
+        group[1] = self.merge(group[1], msg)
+
+    def coalesce(self, messages, location_key):
+        """
+        Merge messages of a sequence. A merged message takes the place of the first one of its group.
+        A message of another type for the same location closes the group so the order of processing is kept.
+        :param list messages: tuples (item, msg), 'item' is an arbitrary message reference
+        :param location_key: callable returning ordering key of a message, see QueueWorkerApplication._message_key
+        :return list: tuples ([item, ...], msg)
+        """
+        _result = list()
+        _open = dict()
+
+        for _item, _msg in messages:
+            _normalized = self.normalize(_msg)
+
+            if _normalized is None:
+                _closed = location_key(_msg)
+                _open = dict((_k, _v) for _k, _v in _open.items() if _k[:2] != _closed)
+                _result.append(([_item], _msg))
+                continue
+
+            _key = self.key(_normalized)
+            _group = _open.get(_key)
+
+            if _group is None:
+                # the original message is kept as is unless something is merged into it
+                _group = [[_item], _msg]
+                _open[_key] = _group
+                _result.append(_group)
+                continue
+
+            self.add(_group, _item, _normalized)
+
+        return list((_items, _msg) for _items, _msg in _result)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+"""
+Django database connections management for long-running workers
+"""
+
+import logging
+import threading
+import time
+import django.conf
+import django.db
+
+
+class ConnectionMonitor(object):
+    """
+    Keeps database connections of worker threads usable. Connections are reused for 'max_age' seconds
+    (Django CONN_MAX_AGE), checked with a cheap query before use when not checked for 'check_interval' seconds,
+    and reopened when a job fails because its connection is broken (after a database failover, for example).
+    """
+
+    def __init__(self, max_age=None, check_interval=0):
+        """
+        :param float max_age: seconds a connection is reused, None for unlimited, 0 to close after each job
+        :param float check_interval: seconds a connection is not checked again after a check
+        """
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.checks = 0
+        self.reconnects = 0
+        self.retries = 0
+        self.latency_total = 0
+        self.latency_max = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def configure(self):
+        """
+        Set connection lifetime for all databases configured.
+        Connection objects keep a reference to their settings, so existing ones are changed too.
+        """
+        if not django.conf.settings.configured:
+            return
+
+        for _alias in django.db.connections:
+            django.db.connections.databases[_alias]["CONN_MAX_AGE"] = self.max_age
+
+        logging.debug("Database connections are reused for %s seconds", self.max_age)
+
+    def _opened(self):
+        return list(_conn for _conn in django.db.connections.all() if _conn.connection is not None)
+
+    def check(self):
+        """
+        Close connections of current thread which are obsolete, broken or not usable,
+        so they are reopened on next query
+        """
+        if not django.conf.settings.configured:
+            return
+
+        for _conn in self._opened():
+            if _conn.in_atomic_block:
+                continue
+
+            _conn.close_if_unusable_or_obsolete()
+
+            if _conn.connection is None:
+                continue
+
+            _checked = getattr(self._local, "checked", dict())
+            self._local.checked = _checked
+            _now = time.monotonic()
+
+            if _now - _checked.get(_conn.alias, -self.check_interval) < self.check_interval:
+                continue
+
+            _usable = _conn.is_usable()
+            _latency = time.monotonic() - _now
+            _checked[_conn.alias] = time.monotonic()
+
+            with self._lock:
+                self.checks += 1
+                self.latency_total += _latency
+                self.latency_max = max(self.latency_max, _latency)
+
+            if not _usable:
+                logging.warning("Database connection [%s] is not usable, reconnecting", _conn.alias)
+                self._reconnect(_conn)
+
+    def _reconnect(self, conn):
+        conn.close()
+
+        with self._lock:
+            self.reconnects += 1
+
+    def _broken(self):
+        """
+        Close connections of current thread which are not usable
+        :return bool: True if any connection was broken
+        """
+        _result = False
+
+        for _conn in django.db.connections.all():
+            if _conn.connection is None:
+                # closed by Django already if an error occurred in a transaction
+                if _conn.errors_occurred:
+                    self._reconnect(_conn)
+                    _result = True
+
+                continue
+
+            if _conn.in_atomic_block or _conn.is_usable():
+                continue
+
+            self._reconnect(_conn)
+            _result = True
+
+        return _result
+
+    def run(self, fn, *args, **kvargs):
+        """
+        Call a function using database, once again with new connections if it fails
+        because of broken connection. The function should be safe to repeat.
+        :param fn: callable to run
+        :return: function result
+        """
+        self.check()
+
+        try:
+            return fn(*args, **kvargs)
+        except (django.db.OperationalError, django.db.InterfaceError) as _e:
+            if not django.conf.settings.configured or not self._broken():
+                raise
+
+            logging.warning("Database connection lost (%s), repeating with a new one", _e)
+
+            with self._lock:
+                self.retries += 1
+
+        return fn(*args, **kvargs)
+
+    def stats(self):
+        """
+        Current state for monitoring
+        :return dict:
+        """
+        return {
+            "checks": self.checks,
+            "reconnects": self.reconnects,
+            "retries": self.retries,
+            "latency_avg": self.latency_total / self.checks if self.checks else 0,
+            "latency_max": self.latency_max}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Content-addressed on-disk cache of downloaded artifacts
+"""
+
+import collections
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+
+class DownloadCache(object):
+    """
+    Artifacts downloaded are kept in a directory under their MD5 checksums,
+    least recently used ones are removed when total size exceeds the budget.
+    The same content published under several GAVs is stored once.
+    Artifacts are looked up by MD5 only: a GAV may be overwritten with another content.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        :param str directory: cache directory, created if absent; files found there are taken into the cache
+        :param int max_size: total size budget, bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _path(self, md5):
+        return os.path.join(self.directory, md5)
+
+    def _is_md5(self, name):
+        return len(name) == 32 and all(_c in "0123456789abcdef" for _c in name)
+
+    def _load(self):
+        """
+        Take files left by previous runs, oldest accessed are evicted first
+        """
+        _files = list()
+
+        for _entry in os.scandir(self.directory):
+            if not _entry.is_file() or not self._is_md5(_entry.name):
+                continue
+
+            _stat = _entry.stat()
+            _files.append((_stat.st_atime, _entry.name, _stat.st_size))
+
+        for _atime, _md5, _size in sorted(_files):
+            self._entries[_md5] = _size
+            self.size += _size
+
+        logging.debug("Download cache [%s]: %d entries, %d bytes", self.directory, len(self._entries), self.size)
+        self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the size budget is met.
+        Should be called with the lock held (or from constructor)
+        """
+        while self._entries and self.size > self.max_size:
+            _md5, _size = self._entries.popitem(last=False)
+            self.size -= _size
+            logging.debug("Evicting '%s' from download cache", _md5)
+
+            try:
+                os.remove(self._path(_md5))
+            except FileNotFoundError:
+                pass
+
+    def get(self, md5):
+        """
+        Open cached artifact
+        :param str md5: artifact checksum
+        :return file: file object opened for binary reading, None if not cached
+        """
+        if not md5 or not self._is_md5(md5):
+            return None
+
+        with self._lock:
+            if md5 in self._entries:
+                try:
+                    _result = open(self._path(md5), "rb")
+                    self._entries.move_to_end(md5)
+                    self.hits += 1
+                    return _result
+                except FileNotFoundError:
+                    # removed by someone else
+                    self.size -= self._entries.pop(md5)
+
+            self.misses += 1
+            return None
+
+    def put(self, md5, file_o):
+        """
+        Store a copy of file content in the cache
+        :param str md5: checksum of file content
+        :param file_o: file object opened for binary reading, its position is restored
+        """
+        if not md5 or not self._is_md5(md5):
+            return
+
+        _pos = file_o.tell()
+        file_o.seek(0, os.SEEK_END)
+        _size = file_o.tell()
+
+        with self._lock:
+            if md5 in self._entries or _size > self.max_size:
+                file_o.seek(_pos)
+                return
+
+        # copying is done without the lock, the file is renamed to its place when complete
+        _tmp_name = None
+
+        try:
+            file_o.seek(0)
+
+            with tempfile.NamedTemporaryFile(dir=self.directory, prefix=".", delete=False) as _tmp:
+                _tmp_name = _tmp.name
+                shutil.copyfileobj(file_o, _tmp)
+
+            os.replace(_tmp_name, self._path(md5))
+        except OSError as _e:
+            logging.warning("Unable to put '%s' to download cache: %s", md5, _e)
+
+            if _tmp_name and os.path.exists(_tmp_name):
+                os.remove(_tmp_name)
+
+            return
+        finally:
+            file_o.seek(_pos)
+
+        with self._lock:
+            if md5 not in self._entries:
+                self._entries[md5] = _size
+                self.size += _size
+
+            self._evict()
+
+    def stats(self):
+        """
+        Current state for monitoring
+        :return dict:
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "size": self.size}
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+Executors for concurrent message processing
+"""
+
+import collections
+import concurrent.futures
+import logging
+import threading
+
+_lane = threading.local()
+
+
+class SlowLaneRequired(Exception):
+    """
+    Raised by a job run in the fast lane when it turns out to be expensive,
+    the job is restarted in the slow lane then
+    """
+
+    def __init__(self, reason=None):
+        super().__init__("Slow lane required: %s" % reason)
+
+
+def current_lane():
+    """
+    Lane of the job being run in the current thread
+    :return str: 'fast' or 'slow', None if lanes are not used
+    """
+    return getattr(_lane, "name", None)
+
+
+def _run_in_lane(lane, fn, *args, **kvargs):
+    _lane.name = lane
+
+    try:
+        return fn(*args, **kvargs)
+    finally:
+        _lane.name = None
+
+
+class KeyedExecutor(object):
+    """
+    Bounded thread pool. Jobs submitted with the same key are run one by one in submission order,
+    jobs with different keys are run concurrently.
+    With slow lane enabled jobs are started in the fast lane, a job raising SlowLaneRequired
+    is restarted on the separate slow lane pool; the next job with the same key waits for it.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix="worker", slow_workers=0):
+        """
+        :param int max_workers: number of threads (of the fast lane if slow lane is enabled)
+        :param str thread_name_prefix: prefix for thread names
+        :param int slow_workers: number of slow lane threads, zero to disable lanes
+        """
+        self.max_workers = max_workers
+        self.slow_workers = slow_workers
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slow_pool = None
+
+        if slow_workers:
+            self._slow_pool = concurrent.futures.ThreadPoolExecutor(max_workers=slow_workers, thread_name_prefix=thread_name_prefix + "-slow")
+
+        self._lock = threading.Lock()
+        self._queues = dict()
+        self._pending = set()
+        self._slow_pending = 0
+
+    def submit(self, key, fn, *args, **kvargs):
+        """
+        Schedule a job
+        :param key: hashable ordering key, None for a job without ordering requirements
+        :param fn: callable to run
+        :return concurrent.futures.Future: job result
+        """
+        if key is None:
+            key = object()
+
+        _future = concurrent.futures.Future()
+
+        with self._lock:
+            self._pending.add(_future)
+            _future.add_done_callback(self.__forget)
+            _queue = self._queues.get(key)
+
+            if _queue is not None:
+                # a job with the same key is being run or waiting, this one will be started after it
+                _queue.append((_future, fn, args, kvargs))
+                return _future
+
+            self._queues[key] = collections.deque([(_future, fn, args, kvargs)])
+
+        self.__schedule(key)
+        return _future
+
+    def __schedule(self, key):
+        """
+        Put next job for the key given to the pool, cancel all jobs for it if the pool is shut down
+        """
+        try:
+            self._pool.submit(self.__run, key)
+        except RuntimeError:
+            logging.error("Executor is shut down, cancelling jobs")
+
+            with self._lock:
+                _queue = self._queues.pop(key, list())
+
+            for _future, _fn, _args, _kvargs in _queue:
+                # notify waiters too, 'concurrent.futures.wait' does not wake up on plain 'cancel'
+                _future.cancel()
+                _future.set_running_or_notify_cancel()
+
+    def __forget(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def __escalate(self, key, future, reason):
+        """
+        Restart the first job waiting for the key given in the slow lane
+        :param concurrent.futures.Future future: result of the job
+        :return bool: True if the job is restarted, False if it is failed
+        """
+        logging.debug("%s", reason)
+
+        with self._lock:
+            self._slow_pending += 1
+
+        try:
+            self._slow_pool.submit(self.__run, key, "slow")
+        except RuntimeError as _e:
+            with self._lock:
+                self._slow_pending -= 1
+
+            future.set_exception(_e)
+            return False
+
+        return True
+
+    @property
+    def lanes(self):
+        """
+        Number of jobs waiting or being run in each lane
+        :return dict: {"fast": int, "slow": int}, empty if lanes are not used
+        """
+        if not self._slow_pool:
+            return dict()
+
+        with self._lock:
+            return {"fast": max(0, len(self._pending) - self._slow_pending), "slow": self._slow_pending}
+
+    def __run(self, key, lane=None):
+        """
+        Run the first job waiting for the key given and schedule the next one
+        :param str lane: 'slow' if the job is restarted in the slow lane
+        """
+        with self._lock:
+            _future, _fn, _args, _kvargs = self._queues[key][0]
+
+        if lane or _future.set_running_or_notify_cancel():
+            try:
+                _future.set_result(_run_in_lane(lane or ("fast" if self._slow_pool else None), _fn, *_args, **_kvargs))
+            except SlowLaneRequired as _e:
+                if lane or not self._slow_pool:
+                    _future.set_exception(_e)
+                elif self.__escalate(key, _future, _e):
+                    # the job keeps its key busy until it is finished in the slow lane
+                    return
+            except BaseException as _e:
+                _future.set_exception(_e)
+
+        with self._lock:
+            self._queues[key].popleft()
+
+            if lane:
+                self._slow_pending -= 1
+
+            if not self._queues[key]:
+                del self._queues[key]
+                return
+
+        self.__schedule(key)
+
+    @property
+    def pending(self):
+        """
+        Number of jobs submitted but not finished yet
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def join(self, timeout=None):
+        """
+        Wait for all jobs submitted to finish
+        :param float timeout: seconds to wait, None for infinite
+        :return bool: True if all jobs are finished
+        """
+        with self._lock:
+            _pending = list(self._pending)
+
+        logging.debug("Waiting for [%d] jobs to finish", len(_pending))
+        _done, _not_done = concurrent.futures.wait(_pending, timeout=timeout)
+        return not _not_done
+
+    def shutdown(self, wait=True):
+        """
+        Stop the executor
+        :param bool wait: wait for all jobs submitted to finish
+        """
+        if wait:
+            self.join()
+
+        self._pool.shutdown(wait=wait)
+
+        if self._slow_pool:
+            self._slow_pool.shutdown(wait=wait)
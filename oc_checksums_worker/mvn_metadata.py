@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+Artifact metadata lookup in one repository request, and its cache
+"""
+
+import collections
+import logging
+import os
+import posixpath
+import threading
+import time
+from xml.etree import ElementTree
+from oc_cdtapi.NexusAPI import NexusAPI, NexusAPIError, gav_to_path, parse_gav, gav_to_str
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _describe_nexus(mvn_client, gav, repo):
+    """
+    Nexus 'describe=info' request
+    """
+    _req = posixpath.join("service", "local", "repositories", repo, "content", gav_to_path(gav))
+    _resp = mvn_client.get(_req, {"describe": "info"})
+
+    if not _resp or not _resp.content:
+        return dict()
+
+    _xml = ElementTree.fromstring(_resp.content)
+    _result = dict()
+
+    for _key, _tag in [("md5", "md5Hash"), ("sha1", "sha1Hash"), ("mime", "mimeType"), ("size", "size")]:
+        _value = _xml.find("./data/%s" % _tag)
+        _result[_key] = None if _value is None else _value.text
+
+    _result["size"] = _int_or_none(_result["size"])
+    return _result
+
+
+def _describe_artifactory(mvn_client, gav, repo):
+    """
+    Artifactory storage API request
+    """
+    _req = posixpath.join("api", "storage", repo, gav_to_path(gav))
+    _resp = mvn_client.get(_req)
+
+    if not _resp or not _resp.content:
+        return dict()
+
+    _json = _resp.json() or dict()
+    _checksums = _json.get("checksums") or dict()
+    return {
+        "md5": _checksums.get("md5"),
+        "sha1": _checksums.get("sha1"),
+        "mime": _json.get("mimeType"),
+        "size": _int_or_none(_json.get("size"))}
+
+
+def describe(mvn_client, gav):
+    """
+    Check artifact exists and get its metadata with a single request.
+    Clients other than NexusAPI for Nexus or Artifactory are asked with 'exists' and 'info' calls.
+    :param NexusAPI mvn_client: active MVN client
+    :param str gav: artifact GAV
+    :return dict: "md5", "mime", "size", "sha1" - any of them may be absent or None;
+                  None if artifact does not exist
+    """
+    if isinstance(mvn_client, NexusAPI) and (mvn_client.is_nexus or mvn_client.is_artifactory):
+        _repo = os.getenv("MVN_DOWNLOAD_REPO", mvn_client.repo_default)
+
+        try:
+            if mvn_client.is_nexus:
+                return _describe_nexus(mvn_client, gav, _repo)
+
+            return _describe_artifactory(mvn_client, gav, _repo)
+        except NexusAPIError as _e:
+            if _e.code == 404:
+                return None
+
+            raise
+
+    if not mvn_client.exists(gav):
+        return None
+
+    _info = mvn_client.info(gav)
+
+    if not _info:
+        logging.debug("No info from MVN for '%s'" % gav)
+        return dict()
+
+    return dict(_info)
+
+
+def sidecar_gav(gav, extension="md5"):
+    """
+    GAV of a checksum file published next to an artifact
+    :param str gav: artifact GAV
+    :param str extension: checksum file extension
+    :return str: GAV with the extension appended to packaging
+    """
+    _gav = parse_gav(gav)
+    _gav["p"] = "%s.%s" % (_gav.get("p") or "jar", extension)
+    return gav_to_str(_gav)
+
+
+def sidecar_md5(mvn_client, gav):
+    """
+    Get artifact MD5 from '.md5' sidecar file, one small request
+    :param NexusAPI mvn_client: active MVN client
+    :param str gav: artifact GAV
+    :return str: MD5 checksum, None if there is no sidecar file or its content is not a checksum
+    """
+    try:
+        _content = mvn_client.cat(sidecar_gav(gav), binary=True)
+    except NexusAPIError as _e:
+        if _e.code == 404:
+            return None
+
+        raise
+
+    if isinstance(_content, bytes):
+        _content = _content.decode("utf-8", errors="replace")
+
+    if not isinstance(_content, str) or not _content.split():
+        return None
+
+    # 'md5sum' output format is possible: checksum and file name
+    _md5 = _content.split()[0].lower()
+
+    if len(_md5) != 32 or any(_c not in "0123456789abcdef" for _c in _md5):
+        logging.debug("Not a checksum in sidecar file of '%s'" % gav)
+        return None
+
+    return _md5
+
+
+class MetadataCache(object):
+    """
+    Artifact metadata got by 'describe' kept for a while: existing artifacts for 'ttl' seconds,
+    not existing ones (None) for 'negative_ttl' seconds. Least recently used entries are dropped above 'max_size'.
+    """
+
+    def __init__(self, ttl, negative_ttl, max_size=10000):
+        """
+        :param float ttl: seconds metadata of existing artifact is kept, 0 to not keep
+        :param float negative_ttl: seconds absence of artifact is kept, 0 to not keep
+        :param int max_size: maximal number of entries
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, gav):
+        """
+        Get cached metadata
+        :param str gav: artifact GAV
+        :return tuple: (True, metadata copy or None) if cached, (False, None) otherwise
+        """
+        with self._lock:
+            _entry = self._entries.get(gav)
+
+            if _entry is None or _entry[0] < time.monotonic():
+                self._entries.pop(gav, None)
+                self.misses += 1
+                return (False, None)
+
+            self._entries.move_to_end(gav)
+            self.hits += 1
+            return (True, None if _entry[1] is None else dict(_entry[1]))
+
+    def put(self, gav, info):
+        """
+        Keep metadata
+        :param str gav: artifact GAV
+        :param dict info: metadata as returned by 'describe', None if artifact does not exist
+        """
+        _ttl = self.negative_ttl if info is None else self.ttl
+
+        if _ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[gav] = (time.monotonic() + _ttl, None if info is None else dict(info))
+            self._entries.move_to_end(gav)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, gav):
+        """
+        Forget metadata of an artifact
+        :param str gav: artifact GAV
+        """
+        with self._lock:
+            self._entries.pop(gav, None)
+
+    def stats(self):
+        """
+        Current state for monitoring
+        :return dict:
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries)}
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+Partial artifact reading with HTTP Range requests
+"""
+
+from oc_cdtapi.NexusAPI import NexusAPI
+
+
+class RangeNotSupported(Exception):
+    def __init__(self, gav, status):
+        super().__init__("Range request for '%s' is not supported: HTTP status %s" % (gav, status))
+
+
+def supports_ranges(mvn_client):
+    """
+    Check client may be asked for a part of an artifact
+    :param mvn_client: MVN client
+    :return bool:
+    """
+    return isinstance(mvn_client, NexusAPI) and (mvn_client.is_nexus or mvn_client.is_artifactory)
+
+
+def validator(response):
+    """
+    Artifact version identifier to make a Range request conditional with 'If-Range' header
+    :param requests.Response response: artifact response
+    :return str: strong ETag or Last-Modified date, None if the response has neither
+    """
+    _etag = response.headers.get("ETag")
+
+    # weak ETags are not allowed in 'If-Range'
+    if _etag and not _etag.startswith("W/"):
+        return _etag
+
+    return response.headers.get("Last-Modified")
+
+
+def open_range(mvn_client, gav, start, end=None, if_range=None):
+    """
+    Request a part of an artifact, response content is not read
+    :param NexusAPI mvn_client: active MVN client
+    :param str gav: artifact GAV
+    :param int start: first byte offset
+    :param int end: last byte offset (inclusive), None for the end of the artifact
+    :param str if_range: artifact validator, see 'validator': the whole artifact is sent if it has been changed
+    :return requests.Response: streamed response with '206' status, or '200' one if 'if_range' does not match
+    """
+    _headers = {"Range": "bytes=%d-%s" % (start, "" if end is None else str(end))}
+
+    if if_range:
+        _headers["If-Range"] = if_range
+
+    _resp = mvn_client.cat(gav, binary=True, response=True, stream=True, headers=_headers)
+
+    if _resp.status_code != 206 and (not if_range or _resp.status_code != 200):
+        _resp.close()
+        raise RangeNotSupported(gav, _resp.status_code)
+
+    return _resp
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+Batched access to PgQ 'queue_message' table
+"""
+
+import logging
+import select
+import time
+import psycopg2.extras
+import psycopg2.sql
+
+
+class PgQBatch(object):
+    """
+    Claims and finalizes PgQ messages in groups using the connection of PgQAPI instance given.
+    Message statuses are the same as for PgQAPI: N - new, A - active, F - failed, P - processed
+    """
+
+    def __init__(self, pgq, queue_code, min_age=60):
+        """
+        :param PgQAPI pgq: connected PgQAPI instance
+        :param str queue_code: queue code
+        :param int min_age: messages younger than this (seconds) are not taken,
+                            the same as PgQAPI.new_msg_from_queue does
+        """
+        self.pgq = pgq
+        self.queue_code = queue_code
+        self.min_age = min_age
+        self.channel = None
+        self.__queue_id = None
+
+    @property
+    def queue_id(self):
+        """
+        Queue identifier, cached after first successful query
+        """
+        if self.__queue_id is None:
+            self.__queue_id = self.pgq.get_queue_id(self.queue_code)
+
+        return self.__queue_id
+
+    def claim(self, limit):
+        """
+        Take up to 'limit' new messages from the queue and mark them active in one statement.
+        Rows locked by concurrent consumers are skipped.
+        :param int limit: maximal number of messages to take
+        :return list: tuples (msg_id, payload) ordered by msg_id
+        """
+        if not self.queue_id:
+            logging.error("Queue [%s] does not exist", self.queue_code)
+            return list()
+
+        _csr = self.pgq.conn.cursor()
+        _csr.execute(
+            "update queue_message set proc_start=now(), status=%s "
+            "where id in ("
+            "select id from queue_message "
+            "where creation_date < current_timestamp - %s * interval '1 second' "
+            "and queue_type__oid = %s and status = %s "
+            "order by id limit %s for update skip locked) "
+            "returning id, payload",
+            ('A', self.min_age, self.queue_id, 'N', limit))
+        _result = sorted(_csr.fetchall(), key=lambda x: x[0])
+        logging.debug("Claimed [%d] messages from [%s]", len(_result), self.queue_code)
+        return _result
+
+    def finalize(self, results):
+        """
+        Mark messages processed or failed. Only active messages are touched.
+        :param list results: tuples (msg_id, error_message), error_message is None for processed ones
+        """
+        _processed = list(_msg_id for _msg_id, _error in results if _error is None)
+        _failed = list((_msg_id, _error) for _msg_id, _error in results if _error is not None)
+        _csr = self.pgq.conn.cursor()
+
+        if _processed:
+            logging.debug("Finalizing [%d] processed messages", len(_processed))
+            _csr.execute(
+                "update queue_message set proc_end=now(), status=%s, error_message=null, comment_text=null "
+                "where id = any(%s) and status = %s",
+                ('P', _processed, 'A'))
+
+        if _failed:
+            logging.debug("Finalizing [%d] failed messages", len(_failed))
+            psycopg2.extras.execute_values(_csr,
+                "update queue_message as q set proc_end=now(), status='F', error_message=v.error_message "
+                "from (values %s) as v(id, error_message) "
+                "where q.id = v.id and q.status = 'A'",
+                _failed)
+
+        if not self.pgq.conn.autocommit:
+            self.pgq.conn.commit()
+
+    def listen(self, channel):
+        """
+        Subscribe to PostgreSQL notifications on the channel given
+        :param str channel: notification channel name
+        """
+        logging.debug("Listening for notifications on [%s]", channel)
+        _csr = self.pgq.conn.cursor()
+        _csr.execute(psycopg2.sql.SQL("listen {}").format(psycopg2.sql.Identifier(channel)))
+
+        if not self.pgq.conn.autocommit:
+            self.pgq.conn.commit()
+
+        self.channel = channel
+
+    def wait(self, timeout):
+        """
+        Block until a notification arrives or timeout expires.
+        Notifications received while processing previous messages are taken into account immediately.
+        :param float timeout: maximal time to wait, seconds
+        :return bool: True if notified, False on timeout
+        """
+        _conn = self.pgq.conn
+
+        if not _conn.notifies:
+            if select.select([_conn], [], [], timeout) == ([], [], []):
+                logging.debug("No notifications on [%s] within [%s] seconds", self.channel, timeout)
+                return False
+
+            _conn.poll()
+
+        _notified = bool(_conn.notifies)
+        logging.debug("Got [%d] notifications on [%s]", len(_conn.notifies), self.channel)
+        _conn.notifies.clear()
+        return _notified
+
+
+class PgQFinalizer(object):
+    """
+    Buffers message results and writes them with PgQBatch.finalize in groups,
+    when enough results are collected or the oldest one waits too long.
+    'flush' has to be called before the connection is closed, otherwise buffered
+    messages stay active and are not finished.
+    """
+
+    def __init__(self, batch, max_size=100, max_delay=0):
+        """
+        :param PgQBatch batch: batch access to the queue
+        :param int max_size: flush when this number of results is buffered
+        :param float max_delay: flush when the oldest result is buffered for this long, seconds; zero to flush each time
+        """
+        self.batch = batch
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.flushes = 0
+        self._results = list()
+        self._since = None
+
+    def add(self, results):
+        """
+        Buffer results and flush them if thresholds are reached
+        :param list results: tuples (msg_id, error_message), see PgQBatch.finalize
+        """
+        if not self._results:
+            self._since = time.monotonic()
+
+        self._results += results
+
+        if len(self._results) >= self.max_size or time.monotonic() - self._since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered results
+        """
+        if not self._results:
+            return
+
+        logging.debug("Flushing [%d] message results", len(self._results))
+        self.batch.finalize(self._results)
+        self.flushes += 1
+        self._results = list()
+        self._since = None
+
+    def stats(self):
+        """
+        :return dict: finalizer state for monitoring
+        """
+        return {"buffered": len(self._results), "flushes": self.flushes}
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Background downloads of artifacts for messages waiting to be processed
+"""
+
+import concurrent.futures
+import logging
+import threading
+
+
+class DownloadPrefetcher(object):
+    """
+    Runs download jobs for messages ahead of the one being processed, so network transfer
+    of the next artifact overlaps registration of the current one.
+    Total size of artifacts being downloaded and waiting to be taken is limited.
+    """
+
+    def __init__(self, max_bytes, workers=1):
+        """
+        :param int max_bytes: size limit of artifacts prefetched but not taken yet
+        :param int workers: number of downloads in parallel
+        """
+        self.max_bytes = max_bytes
+        self.reserved = 0
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self._jobs = dict()
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="prefetch")
+
+    def schedule(self, key, fn, *args):
+        """
+        Start a download job unless one for the same key is scheduled already.
+        The job is called with 'reserve' keyword argument: a callable taking artifact size
+        and returning False if the size limit would be exceeded - the job should not download then.
+        :param key: artifact key, the result is taken by it
+        :param fn: job returning (file object, any data) or None if nothing was downloaded
+        """
+        with self._lock:
+            if key in self._jobs:
+                return
+
+            _job = [None, 0]
+            self._jobs[key] = _job
+            _job[0] = self._pool.submit(fn, *args, reserve=lambda size: self._reserve(_job, size))
+
+    def _reserve(self, job, size):
+        with self._lock:
+            if size is None or self.reserved + size > self.max_bytes:
+                return False
+
+            self.reserved += size
+            job[1] = size
+            return True
+
+    def _pop(self, key):
+        """
+        Forget a job: cancel it if not started, wait for it otherwise
+        :return tuple: job result, None if there is no job or nothing was downloaded
+        """
+        with self._lock:
+            _job = self._jobs.pop(key, None)
+
+        if _job is None or _job[0].cancel():
+            return None
+
+        try:
+            return _job[0].result()
+        except Exception as _e:
+            logging.warning("Prefetch of [%s] failed: %s", key, _e)
+            return None
+        finally:
+            with self._lock:
+                self.reserved -= _job[1]
+
+    def take(self, key):
+        """
+        Get result of a download job, waiting for it if it is running
+        :param key: artifact key
+        :return tuple: (file object, data) as returned by the job, None if not prefetched
+        """
+        _result = self._pop(key)
+
+        with self._lock:
+            if _result:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return _result
+
+    def discard(self, key):
+        """
+        Close a file prefetched but not needed
+        :param key: artifact key
+        """
+        _result = self._pop(key)
+
+        if not _result:
+            return
+
+        logging.debug("Discarding prefetched [%s]", key)
+        _result[0].close()
+
+        with self._lock:
+            self.discarded += 1
+
+    def clear(self):
+        """
+        Discard all jobs
+        """
+        with self._lock:
+            _keys = list(self._jobs.keys())
+
+        for _key in _keys:
+            self.discard(_key)
+
+    def stats(self):
+        """
+        Current state for monitoring
+        :return dict:
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "discarded": self.discarded,
+            "pending": len(self._jobs),
+            "reserved": self.reserved}
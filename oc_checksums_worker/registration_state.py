@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""
+Registration state of locations: single database query and in-process cache
+"""
+
+import collections
+import sys
+import threading
+import time
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+def controller_models(controller):
+    """
+    Django models module used by a CheckSumsController
+    :param controller: controller instance
+    :return module: None if the controller is not a CheckSumsController
+    """
+    return getattr(sys.modules.get(type(controller).__module__), "models", None)
+
+
+def location_state(models, path, loc_type, cs_type="MD5", cs_prov="Regular"):
+    """
+    Current file checksum and its calculated depth for a location (no history, no revision),
+    the same as CheckSumsController 'get_location_checksum', 'get_file_by_location' and 'get_current_inclusion_depth' give
+    :param module models: Django models module, see 'controller_models'
+    :param str path: location path
+    :param str loc_type: location type code
+    :param str cs_type: checksum type code
+    :param str cs_prov: checksum provider
+    :return tuple: (checksum, file_id, depth); (None, None, None) if location is not registered
+    """
+    _checksum = models.CsProv.objects.filter(cs__file=OuterRef("file"), cs__cs_type__code=cs_type, cs_prov=cs_prov) \
+            .order_by("-id").values("cs__checksum")[:1]
+    _state = models.Locations.objects.filter(loc_type__code=loc_type.upper(), path=path.strip(),
+            input_date__lte=timezone.now(), revision=None, file_dst=None) \
+            .order_by("-input_date") \
+            .annotate(checksum=Subquery(_checksum)) \
+            .values_list("checksum", "file_id", "file__depth_level") \
+            .first()
+
+    if _state is None:
+        return (None, None, None)
+
+    _checksum, _file_id, _depth = _state
+    return (_checksum, _file_id, _depth or 0)
+
+
+class RegistrationStateCache(object):
+    """
+    Checksum and depth of locations known to be registered, kept for 'ttl' seconds.
+    Filled after registrations and checks done by this worker, entries are invalidated
+    when the location is deleted or overwritten. Changes made by other workers are seen after 'ttl' only.
+    Least recently used entries are dropped above 'max_size'.
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        :param int max_size: maximal number of entries
+        :param float ttl: seconds an entry is kept
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, loc_type):
+        """
+        Get cached state
+        :param str path: location path
+        :param str loc_type: location type code
+        :return tuple: (checksum, depth), None if not cached
+        """
+        _key = (path, loc_type)
+
+        with self._lock:
+            _entry = self._entries.get(_key)
+
+            if _entry is None or _entry[0] < time.monotonic():
+                self._entries.pop(_key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(_key)
+            self.hits += 1
+            return _entry[1:]
+
+    def put(self, path, loc_type, checksum, depth):
+        """
+        Keep state of a registered location
+        :param str path: location path
+        :param str loc_type: location type code
+        :param str checksum: checksum registered
+        :param int depth: depth registered
+        """
+        if not checksum or self.ttl <= 0:
+            return
+
+        _key = (path, loc_type)
+
+        with self._lock:
+            self._entries[_key] = (time.monotonic() + self.ttl, checksum, depth)
+            self._entries.move_to_end(_key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path, loc_type):
+        """
+        Forget state of a location
+        :param str path: location path
+        :param str loc_type: location type code
+        """
+        with self._lock:
+            self._entries.pop((path, loc_type), None)
+
+    def stats(self):
+        """
+        Current state for monitoring
+        :return dict:
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries)}
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+File object wrappers used while artifacts are downloaded
+"""
+
+import hashlib
+import io
+import os
+
+# bytes of file beginning used by CheckSumsController.mime
+MIME_HEADER_SIZE = 512
+
+
+class HashingWriter(object):
+    """
+    Writable file object wrapper calculating digests and keeping the file header while data are written,
+    so downloaded file is not to be read back to get its checksums.
+    Other attributes (name, flush, close, ...) are taken from the wrapped file.
+    """
+
+    def __init__(self, target, algorithms=("md5",), header_size=MIME_HEADER_SIZE):
+        """
+        :param target: file object to write to
+        :param tuple algorithms: 'hashlib' algorithm names
+        :param int header_size: number of leading bytes kept, see 'header'
+        """
+        self.target = target
+        self.algorithms = tuple(algorithms)
+        self.header_size = header_size
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything written
+        """
+        self._hashes = dict((_name, hashlib.new(_name)) for _name in self.algorithms)
+        self._header = bytearray()
+        self.size = 0
+        self.valid = True
+
+    def restart(self):
+        """
+        Drop everything written to the target file to write it from the beginning again
+        """
+        self.target.seek(0)
+        self.target.truncate()
+        self.reset()
+
+    def write(self, data):
+        """
+        Write data to the target file and update digests
+        :param bytes data: data chunk
+        :return int: number of bytes written
+        """
+        for _hash in self._hashes.values():
+            _hash.update(data)
+
+        if len(self._header) < self.header_size:
+            self._header += data[:self.header_size - len(self._header)]
+
+        self.size += len(data)
+        return self.target.write(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Seek in the target file. Digests are not valid any more if position differs from the end of data written
+        """
+        _pos = self.target.seek(offset, whence)
+
+        if _pos != self.size:
+            self.valid = False
+
+        return _pos
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+    @property
+    def header(self):
+        """
+        Leading bytes of data written
+        :return bytes:
+        """
+        return bytes(self._header)
+
+    def header_file(self):
+        """
+        File object with the leading bytes written, enough to detect MIME type
+        :return io.BytesIO:
+        """
+        return io.BytesIO(self.header)
+
+    def hexdigest(self, algorithm="md5"):
+        """
+        Digest of data written, None if digests are not valid (data were written to random positions)
+        :param str algorithm: algorithm name, one of given to constructor
+        :return str:
+        """
+        if not self.valid:
+            return None
+
+        return self._hashes[algorithm].hexdigest()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Pre-forking supervisor for worker processes
+"""
+
+import logging
+import os
+import random
+import signal
+import time
+from .backoff import PollBackoff
+
+
+class WorkerSupervisor(object):
+    """
+    Forks child processes running the target given, restarts crashed ones
+    and collects their exit statuses.
+    Everything initialized before 'run' (ORM, heavy imports) is shared by children.
+    """
+
+    def __init__(self, target, workers, restart_delay=1.0, restart_delay_max=60.0, stable_time=60.0):
+        """
+        :param target: callable run in each child, its return value is child exit code
+        :param int workers: number of children
+        :param float restart_delay: delay before first restart of a crashed child, seconds
+        :param float restart_delay_max: restart delay ceiling for children crashing repeatedly, seconds
+        :param float stable_time: child running longer than this is not considered as crashing repeatedly, seconds
+        """
+        self.target = target
+        self.workers = workers
+        self.stable_time = stable_time
+        self.children = dict()
+        self.restarts = 0
+        self.exit_codes = dict()
+        self._stopping = False
+        self._backoff = PollBackoff(restart_delay, restart_delay_max)
+
+    def _exit_code(self, status):
+        """
+        Convert 'os.wait' status to exit code, killed by signal are reported as 128+signal
+        :param int status: status from 'os.wait'
+        :return int:
+        """
+        if os.WIFSIGNALED(status):
+            return 128 + os.WTERMSIG(status)
+
+        return os.WEXITSTATUS(status)
+
+    def _start(self, slot):
+        """
+        Fork a child for the slot given
+        :param int slot: child number
+        """
+        _pid = os.fork()
+
+        if _pid:
+            logging.info("Started worker [%d] with pid [%d]", slot, _pid)
+            self.children[_pid] = (slot, time.monotonic())
+            return
+
+        # child: never return to the supervisor code
+        _code = 1
+
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # otherwise all children share random state of the parent
+            random.seed()
+            _code = self.target()
+        except BaseException as _e:
+            logging.exception(_e)
+        finally:
+            logging.shutdown()
+            os._exit(_code if isinstance(_code, int) else 0)
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stop all children and do not restart them any more
+        """
+        logging.info("Stopping workers: %s", list(self.children.keys()))
+        self._stopping = True
+
+        for _pid in list(self.children.keys()):
+            try:
+                os.kill(_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """
+        Start children and supervise them until all are finished
+        :return int: aggregated exit status: zero if all children finished normally or were stopped, maximal exit code otherwise
+        """
+        _handlers = dict((_sig, signal.signal(_sig, self.stop)) for _sig in [signal.SIGTERM, signal.SIGINT])
+
+        try:
+            for _slot in range(0, self.workers):
+                self._start(_slot)
+
+            while self.children:
+                _pid, _status = os.wait()
+
+                if _pid not in self.children:
+                    continue
+
+                _slot, _started = self.children.pop(_pid)
+                _code = self._exit_code(_status)
+                logging.info("Worker [%d] with pid [%d] finished with code [%d]", _slot, _pid, _code)
+
+                if self._stopping:
+                    # terminated by our request
+                    self.exit_codes[_slot] = 0 if _code in [0, 128 + signal.SIGTERM] else _code
+                    continue
+
+                self.exit_codes[_slot] = _code
+
+                if not _code:
+                    continue
+
+                if time.monotonic() - _started > self.stable_time:
+                    self._backoff.reset()
+
+                _delay = self._backoff.next_delay()
+                logging.warning("Worker [%d] crashed, restarting in [%s] seconds", _slot, _delay)
+                time.sleep(_delay)
+
+                if self._stopping:
+                    continue
+
+                self.restarts += 1
+                self._start(_slot)
+        finally:
+            for _sig, _handler in _handlers.items():
+                signal.signal(_sig, _handler)
+
+        return max(list(self.exit_codes.values()) + [0])
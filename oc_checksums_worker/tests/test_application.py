@@ -1,11 +1,26 @@
 import unittest
 import unittest.mock
+import threading
+import json
+import os
+import signal
+import concurrent.futures
+import requests
+import urllib3.exceptions
 
 from oc_cdt_queue2.test.synchron.mocks.queue_loopback import LoopbackConnection, global_messaging, global_message_queue
 from .mocks.checksums_worker import QueueWorkerApplicationMock
 from oc_checksumsq.checksums_interface import ChecksumsQueueClient, FileLocation
 import tempfile
-from ..checksums_worker import LocationOverwriteError
+import hashlib
+from oc_cdtapi.NexusAPI import NexusAPIError
+from ..checksums_worker import LocationOverwriteError, DownloadVerificationError, QueueWorkerApplication
+from ..executors import current_lane, _run_in_lane
+from ..download_cache import DownloadCache
+from ..prefetch import DownloadPrefetcher
+from ..mvn_metadata import MetadataCache
+from ..registration_state import RegistrationStateCache
+from ..pgq_batch import PgQFinalizer
 
 # disable extra logging output
 import logging
@@ -76,6 +91,12 @@ class WorkerLogicTest(unittest.TestCase):
         _app = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
         _args = unittest.mock.MagicMock()
         _args.psql_url="amqp://localhost:5672?search_path=test_schema"
+        _args.cache_dir = None
+        _args.download_prefetch = 0
+        _args.metadata_ttl = 0
+        _args.metadata_negative_ttl = 0
+        _args.state_cache_size = 0
+        _args.db_conn_max_age = 600
         _args.remove = 'no'
         _app.args = _args
         _app.init(_args)
@@ -92,6 +113,12 @@ class WorkerLogicTest(unittest.TestCase):
         _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
         _args = unittest.mock.MagicMock()
         _args.remove = 'no'
+        _args.cache_dir = None
+        _args.download_prefetch = 0
+        _args.metadata_ttl = 0
+        _args.metadata_negative_ttl = 0
+        _args.state_cache_size = 0
+        _args.db_conn_max_age = 600
         _args.psql_url = "amqp://localhost:5672?search_path=test_schema"
         _args.psql_url = "amqp://localhost:5672?search_path=test_schema"
         _args.psql_user = "test_user"
@@ -101,10 +128,35 @@ class WorkerLogicTest(unittest.TestCase):
             _wrk.init(_args)
             _x.assert_not_called()
 
+    def test_init__db_monitor(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _args = unittest.mock.MagicMock()
+        _args.remove = 'no'
+        _args.cache_dir = None
+        _args.download_prefetch = 0
+        _args.metadata_ttl = 0
+        _args.metadata_negative_ttl = 0
+        _args.state_cache_size = 0
+        _args.db_conn_max_age = -1
+        _args.db_check_interval = 10
+        _args.psql_url = "amqp://localhost:5672?search_path=test_schema"
+        _wrk.args = _args
+        self.assertNotIn("db", _wrk.stats())
+        _wrk.init(_args)
+        self.assertIsNone(_wrk.db_monitor.max_age)
+        self.assertEqual(10, _wrk.db_monitor.check_interval)
+        self.assertEqual(0, _wrk.stats()["db"]["reconnects"])
+
     def test_init__orm_true(self):
         _wrk = QueueWorkerApplicationMock(setup_orm=True, controller=unittest.mock.MagicMock())
         _args = unittest.mock.MagicMock()
         _args.remove = 'no'
+        _args.cache_dir = None
+        _args.download_prefetch = 0
+        _args.metadata_ttl = 0
+        _args.metadata_negative_ttl = 0
+        _args.state_cache_size = 0
+        _args.db_conn_max_age = 600
         _args.psql_url = "amqp://localhost:5672?search_path=test_schema"
         _args.psql_user = "test_user"
         _args.psql_password = "test_password"
@@ -134,7 +186,695 @@ class WorkerLogicTest(unittest.TestCase):
         _prs.add_argument.assert_any_call("--mvn-password", dest="mvn_password", help="MVN password", default=None)
         _prs.add_argument.assert_any_call("--msg-source", dest="msg_source", help="The source of messages - amqp or db", default=None)
         _prs.add_argument.assert_any_call("--sleep", dest="sleep", help="Seconds between new messages queries", default="10")
-        self.assertEqual(10, _prs.add_argument.call_count)        
+        _prs.add_argument.assert_any_call("--batch-size", dest="batch_size", help="Messages taken from db queue by one query",
+                            type=int, default=1)
+        _prs.add_argument.assert_any_call("--msg-min-age", dest="msg_min_age", help="Seconds a db message has to wait in queue before it is taken",
+                            type=int, default=60)
+        _prs.add_argument.assert_any_call("--notify-channel", dest="notify_channel", help="PSQL notification channel to wait on instead of sleeping",
+                            default=None)
+        _prs.add_argument.assert_any_call("--sleep-min", dest="sleep_min", help="Seconds before first repeated query on empty queue, doubled up to --sleep",
+                            type=float, default=0.5)
+        _prs.add_argument.assert_any_call("--sleep-jitter", dest="sleep_jitter", help="Random fraction of sleep time to spread queries of replicas",
+                            type=float, default=0.2)
+        _prs.add_argument.assert_any_call("--concurrency", dest="concurrency", help="Messages processed in parallel threads, 0 for AMQP prefetch count or db batch size",
+                            type=int, default=1)
+        _prs.add_argument.assert_any_call("--workers", dest="workers", help="Worker processes forked after initialization",
+                            type=int, default=1)
+        _prs.add_argument.assert_any_call("--coalesce-window", dest="coalesce_window", help="Merge register_file messages for the same location waiting up to this seconds, disabled if not set",
+                            type=float, default=None)
+        _prs.add_argument.assert_any_call("--slow-concurrency", dest="slow_concurrency", help="Messages needing download processed in parallel in a separate slow lane, 0 for no lanes",
+                            type=int, default=0)
+        _prs.add_argument.assert_any_call("--finalize-size", dest="finalize_size", help="Db message results buffered before they are written",
+                            type=int, default=100)
+        _prs.add_argument.assert_any_call("--finalize-delay", dest="finalize_delay", help="Seconds db message results may be buffered, 0 to write after each batch",
+                            type=float, default=0)
+        _prs.add_argument.assert_any_call("--mvn-pool-size", dest="mvn_pool_size", help="Keep-alive connections to MVN kept by each worker thread",
+                            type=int, default=10)
+        _prs.add_argument.assert_any_call("--spool-size", dest="spool_size", help="Artifacts up to this size in bytes are downloaded into memory, 0 to always use temporary files",
+                            type=int, default=1048576)
+        _prs.add_argument.assert_any_call("--cache-dir", dest="cache_dir", help="Directory to keep downloaded artifacts in, no cache if not set",
+                            default=None)
+        _prs.add_argument.assert_any_call("--cache-size", dest="cache_size", help="Download cache size in bytes, least recently used artifacts are removed above it",
+                            type=int, default=10737418240)
+        _prs.add_argument.assert_any_call("--bulk-members", dest="bulk_members", help="Register archive members with bulk database statements (depth 1 only)",
+                            action="store_true")
+        _prs.add_argument.assert_any_call("--checksum-filter", dest="checksum_filter", help="Keep a filter of registered checksums in memory to skip looking up new archive members, with --bulk-members",
+                            action="store_true")
+        _prs.add_argument.assert_any_call("--state-cache-size", dest="state_cache_size", help="Locations registered by this worker whose checksum and depth are cached, 0 to disable",
+                            type=int, default=0)
+        _prs.add_argument.assert_any_call("--state-cache-ttl", dest="state_cache_ttl", help="Seconds registration state of a location is cached",
+                            type=float, default=600)
+        _prs.add_argument.assert_any_call("--db-conn-max-age", dest="db_conn_max_age", help="Seconds a database connection is reused, 0 to reconnect for each message, -1 for unlimited",
+                            type=float, default=600)
+        _prs.add_argument.assert_any_call("--db-check-interval", dest="db_check_interval", help="Seconds a database connection is not checked for liveness again before processing a message",
+                            type=float, default=5)
+        _prs.add_argument.assert_any_call("--download-prefetch", dest="download_prefetch", help="Bytes of artifacts downloaded in background for messages waiting to be processed, 0 to disable",
+                            type=int, default=0)
+        _prs.add_argument.assert_any_call("--download-retries", dest="download_retries", help="Times an interrupted download is resumed with Range requests",
+                            type=int, default=3)
+        _prs.add_argument.assert_any_call("--metadata-ttl", dest="metadata_ttl", help="Seconds MVN metadata of existing artifact is cached, 0 to disable",
+                            type=float, default=0)
+        _prs.add_argument.assert_any_call("--metadata-negative-ttl", dest="metadata_negative_ttl", help="Seconds absence of artifact in MVN is cached, 0 to disable",
+                            type=float, default=0)
+        self.assertEqual(35, _prs.add_argument.call_count)        
+
+    def test_supervisor_run(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.workers = 3
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.WorkerSupervisor") as _sup, \
+                unittest.mock.patch("oc_checksums_worker.checksums_worker.django.db.connections") as _conns:
+            _sup.return_value.run.return_value = 2
+
+            with self.assertRaises(SystemExit) as _exc:
+                _wrk.supervisor_run()
+
+            self.assertEqual(2, _exc.exception.code)
+            _sup.assert_called_once_with(_wrk._run_child, 3)
+            _conns.close_all.assert_called_once()
+
+    def test_run_child(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk._child_connect = unittest.mock.MagicMock()
+        _wrk._child_run = unittest.mock.MagicMock()
+        _wrk._terminate_delay = 0
+        _wrk.reconnect = True
+        _wrk._connect_and_run = unittest.mock.MagicMock(side_effect=[1, 3, 0])
+        self.assertEqual(0, _wrk._run_child())
+        self.assertEqual(3, _wrk._connect_and_run.call_count)
+        self.assertEqual(_wrk._child_connect, _wrk.connect)
+        self.assertEqual(_wrk._child_run, _wrk.run)
+        _wrk.reconnect = False
+        _wrk._connect_and_run = unittest.mock.MagicMock(side_effect=[2])
+        self.assertEqual(2, _wrk._run_child())
+
+    def test_process_db_batch(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.batch_size = 3
+        _wrk.args.concurrency = 1
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 0
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+        _wrk.pgq_batch.claim.return_value = [
+                (1, ["register_file", [["g:a:v:p", "NXS", None], "CTYPE", 0], {}]),
+                (2, ["register_checksum", [["g:a:v:p", "NXS", None], "abcdef"], {"citype": "CTYPE"}]),
+                (3, ["unknown_method", [], {}]),
+                (4, ["register_file", [["g:a:v:p1", "NXS", None], "CTYPE"], {}])]
+        _wrk.register_file = unittest.mock.MagicMock(side_effect=[None, Exception("Registration Failed")])
+        _wrk.register_checksum = unittest.mock.MagicMock()
+        self.assertEqual(4, _wrk._process_db_batch())
+        _wrk.pgq_batch.claim.assert_called_once_with(3)
+        _wrk.register_file.assert_has_calls([
+            unittest.mock.call(["g:a:v:p", "NXS", None], "CTYPE", 0),
+            unittest.mock.call(["g:a:v:p1", "NXS", None], "CTYPE")])
+        _wrk.register_checksum.assert_called_once_with(["g:a:v:p", "NXS", None], "abcdef", citype="CTYPE")
+        _wrk.pgq_batch.finalize.assert_called_once_with([
+            (1, None), (2, None), (3, "unknown msg_type"), (4, "Registration Failed")])
+        self.assertEqual({"messages": 4, "good": 2, "bad": 2, "coalesced": 0, "finalizer": {"buffered": 0, "flushes": 1}}, _wrk.stats())
+
+    def test_process_db_batch__empty(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.batch_size = 1
+        _wrk.args.concurrency = 1
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 0
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+        _wrk.pgq_batch.claim.return_value = list()
+        self.assertEqual(0, _wrk._process_db_batch())
+        _wrk.pgq_batch.finalize.assert_not_called()
+
+    def test_process_db_batch__concurrency(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.batch_size = 4
+        _wrk.args.concurrency = 3
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 0
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+        _wrk.pgq_batch.claim.return_value = [
+                (1, ["register_file", [["g:a:v:p", "NXS", None], "CTYPE", 0], {}]),
+                (2, ["register_file", [["g:a:v:p", "NXS", None], "CTYPE", 1], {}]),
+                (3, ["register_file", [["g:a:v:p1", "NXS", None], "CTYPE", 0], {}]),
+                (4, ["register_file", [], {"location": ["g:a:v:p", "NXS", None], "citype": "CTYPE", "depth": 2}])]
+        _calls = list()
+
+        def _register_file(location, citype, depth=0):
+            _calls.append((location[0], depth))
+
+            if location[0] == "g:a:v:p1":
+                raise Exception("Registration Failed")
+
+        _wrk.register_file = unittest.mock.MagicMock(side_effect=_register_file)
+        self.assertEqual(4, _wrk._process_db_batch())
+        _wrk.pgq_batch.finalize.assert_called_once_with([
+            (1, None), (2, None), (3, "Registration Failed"), (4, None)])
+        # same location is processed in order of messages
+        self.assertEqual([("g:a:v:p", 0), ("g:a:v:p", 1), ("g:a:v:p", 2)], list(filter(lambda x: x[0] == "g:a:v:p", _calls)))
+        self.assertEqual(0, _wrk.executor.pending)
+        _wrk._shutdown_executor()
+        self.assertIsNone(_wrk.executor)
+
+    def test_process_db_batch__coalesce(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.batch_size = 10
+        _wrk.args.concurrency = 1
+        _wrk.args.coalesce_window = 0.01
+        _wrk.args.slow_concurrency = 0
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+        _wrk.pgq_batch.claim.side_effect = [[
+                (1, ["register_file", [["g:a:v:p", "NXS", None], "CTYPE", 0], {}]),
+                (2, ["register_file", [["g:a:v:p1", "NXS", None], "CTYPE", 1], {}]),
+                (3, ["register_file", [["g:a:v:p", "NXS", None], "CTYPE"], {"depth": 2, "remove": True}])], [
+                (4, ["register_file", [], {"location": ["g:a:v:p", "NXS", None], "citype": "CTYPE", "depth": 1, "remove": "Deleted"}]),
+                (5, ["register_file", [["g:a:v:p", "NXS", None], "OTHER_CTYPE", 0], {}])]]
+        _wrk.register_file = unittest.mock.MagicMock()
+        self.assertEqual(5, _wrk._process_db_batch())
+        _wrk.pgq_batch.claim.assert_has_calls([unittest.mock.call(10), unittest.mock.call(7)])
+        self.assertEqual(3, _wrk.register_file.call_count)
+        _wrk.register_file.assert_has_calls([
+            unittest.mock.call(location=["g:a:v:p", "NXS", None], citype="CTYPE", depth=2, remove="Deleted",
+                version=None, client=None, parent=None, artifact_deliverable=None),
+            unittest.mock.call(["g:a:v:p1", "NXS", None], "CTYPE", 1),
+            unittest.mock.call(["g:a:v:p", "NXS", None], "OTHER_CTYPE", 0)])
+        _wrk.pgq_batch.finalize.assert_called_once_with([
+            (1, None), (3, None), (4, None), (2, None), (5, None)])
+        self.assertEqual({"messages": 5, "good": 5, "bad": 0, "coalesced": 2, "finalizer": {"buffered": 0, "flushes": 1}}, _wrk.stats())
+
+    def test_custom_connect__pending_results(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock(notify_channel=None, sleep_min=0, sleep=5, sleep_jitter=0,
+                finalize_size=10, finalize_delay=3600)
+        _wrk.queue = "test_queue"
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.PgQAPI.PgQAPI"), \
+                unittest.mock.patch("oc_checksums_worker.checksums_worker.PgQBatch") as _batch:
+            _wrk.custom_connect()
+            _old = _wrk.finalizer.batch
+            _old.finalize.side_effect = Exception("Connection lost")
+            _wrk.finalizer.add([(1, None), (2, "Failed")])
+
+            with self.assertRaises(Exception):
+                _wrk.finalizer.flush()
+
+            # written on the new connection
+            _batch.return_value = unittest.mock.MagicMock()
+            _wrk.custom_connect()
+            _batch.return_value.finalize.assert_called_once_with([(1, None), (2, "Failed")])
+            self.assertEqual({"buffered": 0, "flushes": 1}, _wrk.finalizer.stats())
+
+    def test_process_message__coalesce(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.concurrency = 2
+        _wrk.args.coalesce_window = 0
+        _wrk.args.slow_concurrency = 0
+        _wrk._report_message_result = unittest.mock.MagicMock()
+        _event = threading.Event()
+        _bodies = list()
+
+        def _on_message_raw(body, properties):
+            _event.wait(10)
+            _bodies.append(json.loads(body))
+
+        _wrk.on_message_raw = unittest.mock.MagicMock(side_effect=_on_message_raw)
+        _wrk._process_message(1, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p", "NXS", null], "CTYPE", 0], {}]')
+        # these are waiting for the first one to finish
+        _wrk._process_message(2, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p", "NXS", null], "CTYPE", 1], {}]')
+        _wrk._process_message(3, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p", "NXS", null], "CTYPE", 2], {}]')
+        _event.set()
+        self.assertTrue(_wrk.executor.join(timeout=10))
+        self.assertEqual(2, len(_bodies))
+        self.assertEqual(["register_file", [["g:a:v:p", "NXS", None], "CTYPE", 0], {}], _bodies[0])
+        self.assertEqual(2, _bodies[1][2]["depth"])
+        _wrk._report_message_result.assert_has_calls([
+            unittest.mock.call(delivery_tag=1, ack=True, requeue=False, time_delta=unittest.mock.ANY),
+            unittest.mock.call(delivery_tag=2, ack=True, requeue=False, time_delta=unittest.mock.ANY),
+            unittest.mock.call(delivery_tag=3, ack=True, requeue=False, time_delta=unittest.mock.ANY)])
+        self.assertEqual(3, _wrk.counter_good)
+        self.assertEqual(1, _wrk.counter_coalesced)
+        self.assertEqual(dict(), _wrk._open_groups)
+        _wrk._shutdown_executor()
+
+    def _cat_without_sidecars(self, gav, write_to=None, **kvargs):
+        if write_to is None:
+            raise NexusAPIError(code=404, text="Not found: %s" % gav)
+
+        write_to.write(b"the_test_data")
+
+    def test_process_message__prefetch(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.concurrency = 2
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 0
+        _wrk.args.max_depth = 0
+        _wrk.prefetcher = DownloadPrefetcher(100)
+        _wrk._report_message_result = unittest.mock.MagicMock()
+        _files = list()
+
+        def _prefetch_download(location, depth, reserve):
+            self.assertTrue(reserve(13))
+            _files.append(tempfile.TemporaryFile())
+            return (_files[-1], dict())
+
+        def _on_message_raw(body, properties):
+            # neither message takes its download: the second one fails before
+            if json.loads(body)[1][0][0] == "g:a:v:p1":
+                raise ValueError("Failed")
+
+        _wrk._prefetch_download = unittest.mock.MagicMock(side_effect=_prefetch_download)
+        _wrk.on_message_raw = unittest.mock.MagicMock(side_effect=_on_message_raw)
+        _wrk._process_message(1, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p", "NXS", null], "CTYPE", 0], {}]')
+        _wrk._process_message(2, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p1", "NXS", null], "CTYPE", 0], {}]')
+        self.assertTrue(_wrk.executor.join(timeout=10))
+        _stats = _wrk.prefetcher.stats()
+        self.assertEqual(0, _stats["pending"])
+        self.assertEqual(0, _stats["reserved"])
+        self.assertTrue(all(_f.closed for _f in _files))
+        self.assertEqual(1, _wrk.counter_good)
+        self.assertEqual(1, _wrk.counter_bad)
+        _wrk._shutdown_executor()
+
+    def test_process_db_batch__prefetch(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.batch_size = 3
+        _wrk.args.concurrency = 1
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 0
+        _wrk.args.max_depth = 0
+        _wrk.args.spool_size = 1024
+        _wrk.remove = False
+        _wrk.prefetcher = DownloadPrefetcher(20)
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+        _wrk.pgq_batch.claim.return_value = [
+                (1, ["register_file", [["g:a:v:p", "NXS", None], "CTYPE"], {}]),
+                (2, ["register_file", [["g:a:v:p1", "NXS", None], "CTYPE"], {}]),
+                (3, ["register_checksum", [["g:a:v:p2", "NXS", None], "abcdef"], {}])]
+        _mvn = unittest.mock.MagicMock()
+        _mvn.cat = unittest.mock.MagicMock(side_effect=self._cat_without_sidecars)
+        _wrk._mvn_client = unittest.mock.MagicMock(return_value=_mvn)
+        _wrk.controller.get_location_checksum.return_value = None
+        _wrk.controller.mime.return_value = "text/plain"
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.mvn_metadata.describe", side_effect=lambda mvn_client, gav: {"size": 13}):
+            self.assertEqual(3, _wrk._process_db_batch())
+
+        _wrk.pgq_batch.finalize.assert_called_once_with([(1, None), (2, None), (3, None)])
+        self.assertEqual(2, len(list(_c for _c in _mvn.cat.call_args_list if _c.kwargs.get("write_to"))))
+        _md5 = hashlib.md5(b"the_test_data").hexdigest()
+        _wrk.controller.register_file_md5.assert_any_call(_md5, "CTYPE", "text/plain", "g:a:v:p1", "NXS")
+        _stats = _wrk.stats()["prefetch"]
+        self.assertEqual(2, _stats["hits"] + _stats["misses"])
+        self.assertEqual(0, _stats["pending"])
+        self.assertEqual(0, _stats["reserved"])
+
+    def test_register_location__metadata_cache(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.metadata_cache = MetadataCache(60, 10)
+        _wrk._mvn_client = unittest.mock.MagicMock()
+        _wrk._register_artifact = unittest.mock.MagicMock()
+        _loc = FileLocation("g:a:v:p", "NXS", None)
+        _wrk.controller.get_location_checksum.return_value = "abcdef"
+        _wrk.controller.get_current_inclusion_depth.return_value = 0
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.mvn_metadata.describe") as _describe:
+            _describe.side_effect = lambda mvn_client, gav: {"md5": "abcdef", "mime": "text/plain"}
+
+            for _i in range(0, 2):
+                _wrk._register_location(_loc, "CTYPE", remove=False)
+
+            _describe.assert_called_once()
+            _wrk._register_artifact.assert_not_called()
+
+            # overwritten by someone else: cached metadata are dropped and got again, not a LocationOverwriteError
+            _describe.side_effect = lambda mvn_client, gav: {"md5": "012345", "mime": "text/plain"}
+            _wrk.controller.get_location_checksum.return_value = "012345"
+            _wrk._register_location(_loc, "CTYPE", remove=False)
+            self.assertEqual(2, _describe.call_count)
+            _wrk.controller.delete_location.assert_not_called()
+
+            # absence is cached too
+            _describe.side_effect = lambda mvn_client, gav: None
+            _loc = FileLocation("g:a:v:p1", "NXS", None)
+
+            for _i in range(0, 2):
+                _wrk._register_location(_loc, "CTYPE", remove=True)
+
+            self.assertEqual(3, _describe.call_count)
+            self.assertEqual(2, _wrk.controller.delete_location.call_count)
+
+        self.assertEqual({"hits": 3, "misses": 3, "entries": 2}, _wrk.stats()["metadata_cache"])
+
+    def test_check_artifact_not_registered__state_cache(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.state_cache = RegistrationStateCache(10, 60)
+        _loc = FileLocation("g:a:v:p", "NXS", None)
+        _wrk.controller.get_location_checksum.return_value = "abcdef"
+        _wrk.controller.get_current_inclusion_depth.return_value = 1
+
+        # checked in database first, cached then
+        self.assertFalse(_wrk._check_artifact_not_registered(_loc, 1, {"md5": "abcdef"}))
+        self.assertFalse(_wrk._check_artifact_not_registered(_loc, 0, {"md5": "abcdef"}))
+        self.assertFalse(_wrk._needs_download(_loc, 1, {"md5": "abcdef", "mime": "application/zip"}))
+        _wrk.controller.get_location_checksum.assert_called_once()
+        _wrk.controller.get_current_inclusion_depth.assert_called_once()
+
+        # deeper registration is checked in database
+        self.assertTrue(_wrk._check_artifact_not_registered(_loc, 2, {"md5": "abcdef"}))
+        self.assertEqual(2, _wrk.controller.get_location_checksum.call_count)
+
+        # overwritten artifact drops the entry
+        self.assertTrue(_wrk._check_artifact_not_registered(_loc, 0, {"md5": "012345"}, remove=True))
+        _wrk.controller.delete_location.assert_called_once_with("g:a:v:p", "NXS", reason="Location was overwritten")
+        self.assertIsNone(_wrk.state_cache.get("g:a:v:p", "NXS"))
+        self.assertEqual({"hits": 4, "misses": 2, "entries": 0}, _wrk.stats()["state_cache"])
+
+    def test_complete_metadata(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.controller.mime.return_value = "text/plain"
+        _mvn = unittest.mock.MagicMock()
+        _mvn.cat.return_value = b"0123456789ABCDEF0123456789abcdef  test-1.0.jar\n"
+        _resp = unittest.mock.MagicMock(content=b"the_header")
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.mvn_ranges.supports_ranges", return_value=True), \
+                unittest.mock.patch("oc_checksums_worker.checksums_worker.mvn_ranges.open_range", return_value=_resp) as _range:
+            _info = {"size": 100}
+            _wrk._complete_metadata(_mvn, "g:a:v:jar", _info)
+            self.assertEqual({"size": 100, "md5": "0123456789abcdef0123456789abcdef", "mime": "text/plain"}, _info)
+            _mvn.cat.assert_called_once_with("g:a:v:jar.md5", binary=True)
+            _range.assert_called_once_with(_mvn, "g:a:v:jar", 0, 511)
+            self.assertEqual(b"the_header", _wrk.controller.mime.call_args.args[0].read())
+
+            # no sidecar file: no range request
+            _range.reset_mock()
+            _mvn.cat.side_effect = NexusAPIError(code=404)
+            _info = {"mime": None}
+            _wrk._complete_metadata(_mvn, "g:a:v:jar", _info)
+            self.assertEqual({"mime": None, "md5": None}, _info)
+            _range.assert_not_called()
+
+    def test_register_location__sidecar(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _mvn = unittest.mock.MagicMock()
+        _mvn.exists.return_value = True
+        _mvn.info.return_value = {"mime": "text/plain"}
+        _mvn.cat.return_value = b"0123456789abcdef0123456789abcdef"
+        _wrk._download = unittest.mock.MagicMock()
+        _wrk._check_artifact_not_registered = unittest.mock.MagicMock(return_value=True)
+        _wrk.controller.register_file_md5 = unittest.mock.MagicMock()
+        _wrk._register_location_with(_mvn, FileLocation("g:a:v:txt", "NXS", None), "CTYPE", 0, False, None)
+        _wrk._download.assert_not_called()
+        _wrk.controller.register_file_md5.assert_called_once_with("0123456789abcdef0123456789abcdef", "CTYPE", "text/plain", "g:a:v:txt", "NXS")
+
+    def test_register_location__stale_sidecar(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.spool_size = 1024
+        _md5 = hashlib.md5(b"the_test_data").hexdigest()
+        _mvn = unittest.mock.MagicMock()
+        _wrk._mvn_client = unittest.mock.MagicMock(return_value=_mvn)
+        _wrk._register_artifact = unittest.mock.MagicMock()
+        _wrk.controller.get_location_checksum.return_value = _md5
+        _wrk.controller.get_current_inclusion_depth.return_value = 0
+        _wrk.controller.mime.return_value = "text/plain"
+
+        def _cat(gav, write_to=None, **kvargs):
+            if write_to is None:
+                # not updated on redeploy
+                return b"0123456789abcdef0123456789abcdef"
+
+            write_to.write(b"the_test_data")
+
+        _mvn.cat = unittest.mock.MagicMock(side_effect=_cat)
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.mvn_metadata.describe",
+                side_effect=lambda mvn_client, gav: {"size": 13, "mime": "text/plain"}):
+            # checksum calculated from the artifact matches database: not an overwrite
+            _wrk._register_location(FileLocation("g:a:v:p", "NXS", None), "CTYPE", remove=False)
+
+        _wrk._register_artifact.assert_not_called()
+        _wrk.controller.delete_location.assert_not_called()
+        self.assertEqual(1, len(list(_c for _c in _mvn.cat.call_args_list if _c.kwargs.get("write_to"))))
+
+    def test_register_location__verification_retry(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.spool_size = 1024
+        _wrk.args.download_retries = 0
+        _wrk.metadata_cache = MetadataCache(60, 10)
+        _md5 = hashlib.md5(b"the_test_data").hexdigest()
+        _mvn = unittest.mock.MagicMock()
+        _mvn.cat = unittest.mock.MagicMock(side_effect=lambda gav, write_to=None, **kvargs: write_to.write(b"the_test_data"))
+        _wrk._mvn_client = unittest.mock.MagicMock(return_value=_mvn)
+        _wrk.controller.get_location_checksum.return_value = None
+        _wrk.controller.mime.return_value = "text/plain"
+        _loc = FileLocation("g:a:v:zip", "NXS", None)
+        # cached before redeploy
+        _wrk.metadata_cache.put("g:a:v:zip", {"md5": "0" * 32, "mime": "application/zip"})
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.mvn_metadata.describe") as _describe:
+            _describe.return_value = {"md5": _md5, "mime": "application/zip"}
+            _wrk._register_location(_loc, "CTYPE", depth=1, remove=False)
+            _describe.assert_called_once()
+            _wrk.controller.register_file_obj.assert_called_once()
+
+            # real mismatch fails after one retry
+            _wrk.metadata_cache.invalidate("g:a:v:zip")
+            _describe.return_value = {"md5": "0" * 32, "mime": "application/zip"}
+
+            with self.assertRaises(DownloadVerificationError):
+                _wrk._register_location(_loc, "CTYPE", depth=1, remove=False)
+
+            self.assertEqual(3, _describe.call_count)
+
+    def test_needs_download(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _loc = FileLocation("g:a:v:p", "NXS", None)
+        _info = {"md5": "abcdef", "mime": "text/plain"}
+        self.assertTrue(_wrk._needs_download(_loc, 0, {"md5": "abcdef"}))
+        self.assertFalse(_wrk._needs_download(_loc, 0, _info))
+        _wrk.controller.get_location_checksum.return_value = "012345"
+        self.assertTrue(_wrk._needs_download(_loc, 1, _info))
+        _wrk.controller.get_location_checksum.return_value = "abcdef"
+        _wrk.controller.get_current_inclusion_depth.return_value = 1
+        self.assertFalse(_wrk._needs_download(_loc, 1, _info))
+        self.assertTrue(_wrk._needs_download(_loc, 2, _info))
+        _wrk.controller.get_location_checksum.assert_called_with("g:a:v:p", "NXS")
+
+    def test_process_db_batch__lanes(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.batch_size = 3
+        _wrk.args.concurrency = 1
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 1
+        _wrk.args.spool_size = 0
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+        _wrk.pgq_batch.claim.return_value = [
+                (1, ["register_file", [["g:a:v:p", "NXS", None], "CTYPE", 1], {}]),
+                (2, ["register_file", [["g:a:v:p1", "NXS", None], "CTYPE", 0], {}]),
+                (3, ["register_file", [["g:a:v:p2", "NXS", None], "CTYPE", 0], {}])]
+        _mvn = unittest.mock.MagicMock()
+        _lanes = dict()
+
+        def _register_file(location, citype, depth):
+            _lanes.setdefault(location[0], list()).append(current_lane())
+
+            if depth or location[0] == "g:a:v:p2":
+                _wrk._download(_mvn, location[0]).close()
+
+        _wrk.register_file = unittest.mock.MagicMock(side_effect=_register_file)
+        self.assertEqual(3, _wrk._process_db_batch())
+        _wrk.pgq_batch.finalize.assert_called_once_with([(1, None), (2, None), (3, None)])
+        self.assertEqual({"g:a:v:p": ["fast", "slow"], "g:a:v:p1": ["fast"], "g:a:v:p2": ["fast", "slow"]}, _lanes)
+        self.assertEqual(2, _mvn.cat.call_count)
+        self.assertEqual({"fast": 0, "slow": 0}, _wrk.stats()["lanes"])
+        _wrk._shutdown_executor()
+
+    def test_custom_run(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.reconnect = True
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch, max_size=10, max_delay=3600)
+        _wrk.poll_backoff = unittest.mock.MagicMock()
+        _wrk.poll_backoff.next_delay.return_value = 0
+        _batches = [[(1, None), (2, "Failed")], [(3, None)]]
+
+        def _process_db_batch():
+            if not _batches:
+                return 0
+
+            _wrk.finalizer.add(_batches.pop(0))
+            return 1
+
+        def _wait_for_messages(timeout):
+            # queue is empty: results are written before waiting
+            _wrk.pgq_batch.finalize.assert_called_once_with([(1, None), (2, "Failed"), (3, None)])
+            _wrk._request_stop()
+            _wrk.finalizer.add([(4, None)])
+
+        _wrk._process_db_batch = _process_db_batch
+        _wrk._wait_for_messages = _wait_for_messages
+        _wrk.custom_run()
+        # buffered results are written on stop
+        _wrk.pgq_batch.finalize.assert_has_calls([
+            unittest.mock.call([(1, None), (2, "Failed"), (3, None)]), unittest.mock.call([(4, None)])])
+        self.assertFalse(_wrk.reconnect)
+
+    def test_concurrency(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.concurrency = 3
+        self.assertEqual(3, _wrk._concurrency())
+        _wrk.args.concurrency = 0
+        _wrk.args.msg_source = "amqp"
+        _wrk.prefetch_count = 4
+        self.assertEqual(4, _wrk._concurrency())
+        _wrk.args.msg_source = "db"
+        _wrk.args.batch_size = 10
+        self.assertEqual(10, _wrk._concurrency())
+
+    def test_run__drain(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.concurrency = 0
+        _wrk.args.msg_source = "amqp"
+        _wrk.args.slow_concurrency = 0
+        _wrk.args.coalesce_window = None
+        _wrk.prefetch_count = 2
+        _wrk.reconnect = True
+        _wrk._report_message_result = unittest.mock.MagicMock()
+        _event = threading.Event()
+        _wrk.on_message_raw = unittest.mock.MagicMock(side_effect=lambda body, properties: _event.wait(10))
+        _handler = signal.getsignal(signal.SIGTERM)
+
+        def _run():
+            _wrk._process_message(1, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p", "NXS", null], "CTYPE", 0], {}]')
+            _wrk._process_message(2, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p1", "NXS", null], "CTYPE", 0], {}]')
+            self.assertEqual(2, _wrk.executor.pending)
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertTrue(_wrk._stop)
+            _event.set()
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.ChecksumsQueueServer.run", side_effect=_run), \
+                unittest.mock.patch("oc_checksums_worker.checksums_worker.ChecksumsQueueServer.disconnect") as _disconnect:
+            QueueWorkerApplication.run(_wrk)
+            self.assertEqual(_handler, signal.getsignal(signal.SIGTERM))
+            self.assertFalse(_wrk.reconnect)
+            # deliveries in flight are finished and acknowledged before disconnection
+            _wrk.disconnect()
+            _disconnect.assert_called_once()
+
+        self.assertIsNone(_wrk.executor)
+        _wrk._report_message_result.assert_has_calls([
+            unittest.mock.call(delivery_tag=1, ack=True, requeue=False, time_delta=unittest.mock.ANY),
+            unittest.mock.call(delivery_tag=2, ack=True, requeue=False, time_delta=unittest.mock.ANY)], any_order=True)
+
+    def test_message_key(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        self.assertEqual(("g:a:v:p", "NXS"), _wrk._message_key(["register_file", [["g:a:v:p", "NXS", None], "CTYPE"], {}]))
+        self.assertEqual(("g:a:v:p", "NXS"), _wrk._message_key(["register_checksum", [], {"location": ["g:a:v:p", "NXS", None]}]))
+        self.assertIsNone(_wrk._message_key(["ping", [], {}]))
+        self.assertIsNone(_wrk._message_key("trash"))
+
+    def test_process_message__concurrency(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.concurrency = 2
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 0
+        _wrk._report_message_result = unittest.mock.MagicMock()
+        _wrk.max_sleep = 0
+        _wrk.on_message_raw = unittest.mock.MagicMock(side_effect=[None, Exception("Registration Failed")])
+        _body = b'["register_file", [["g:a:v:p", "NXS", null], "CTYPE", 0], {}]'
+        _wrk._process_message(1, unittest.mock.MagicMock(), _body)
+        _wrk._process_message(2, unittest.mock.MagicMock(), _body)
+        self.assertTrue(_wrk.executor.join(timeout=10))
+        _wrk._report_message_result.assert_has_calls([
+            unittest.mock.call(delivery_tag=1, ack=True, requeue=False, time_delta=unittest.mock.ANY),
+            unittest.mock.call(delivery_tag=2, ack=False, requeue=_wrk.deads_disabled)])
+        self.assertEqual(2, _wrk.counter_messages)
+        self.assertEqual(1, _wrk.counter_good)
+        self.assertEqual(1, _wrk.counter_bad)
+        _wrk._shutdown_executor()
+
+    def test_process_message__nack_sleep(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.concurrency = 2
+        _wrk.args.coalesce_window = None
+        _wrk.args.slow_concurrency = 0
+        _wrk._report_message_result = unittest.mock.MagicMock()
+        _wrk.max_sleep = 3
+        _wrk.deads_disabled = True
+        _wrk.on_message_raw = unittest.mock.MagicMock(side_effect=Exception("Registration Failed"))
+        _locked = list()
+
+        def _sleep(delay):
+            # counters are not locked while sleeping, nothing is rejected yet
+            _locked.append(not _wrk._counters_lock.acquire(blocking=False))
+            _wrk._counters_lock.release()
+            _wrk._report_message_result.assert_not_called()
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.time.sleep", side_effect=_sleep) as _sleep_mock:
+            _wrk._process_message(1, unittest.mock.MagicMock(), b'["register_file", [["g:a:v:p", "NXS", null], "CTYPE", 0], {}]')
+            self.assertTrue(_wrk.executor.join(timeout=10))
+
+        _sleep_mock.assert_called_once_with(2)
+        self.assertEqual([False], _locked)
+        _wrk._report_message_result.assert_called_once_with(delivery_tag=1, ack=False, requeue=True)
+        self.assertEqual(1, _wrk.counter_bad)
+        _wrk._shutdown_executor()
+
+    def test_wait_for_messages__sleep(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.notify_channel = None
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.time.sleep") as _sleep:
+            _wrk._wait_for_messages(10)
+            _sleep.assert_called_once_with(10)
+
+        _wrk.pgq_batch.wait.assert_not_called()
+
+    def test_wait_for_messages__notify(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.notify_channel = "test_channel"
+        _wrk.args.msg_min_age = 5
+        _wrk._notify_due = None
+        _wrk.pgq_batch = unittest.mock.MagicMock()
+        _wrk.finalizer = PgQFinalizer(_wrk.pgq_batch)
+        _wrk.pgq_batch.wait.return_value = True
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.time.sleep") as _sleep:
+            _wrk._wait_for_messages(10)
+            _wrk.pgq_batch.wait.assert_called_once_with(10)
+            # notified messages are not old enough yet, so next wait is shortened to their age limit
+            _wrk.pgq_batch.wait.reset_mock()
+            _wrk.pgq_batch.wait.return_value = False
+            _wrk._wait_for_messages(10)
+            _timeout = _wrk.pgq_batch.wait.call_args[0][0]
+            self.assertTrue(0 <= _timeout <= 5)
+            # and not shortened any more without new notifications
+            _wrk.pgq_batch.wait.reset_mock()
+            _wrk._wait_for_messages(10)
+            _wrk.pgq_batch.wait.assert_called_once_with(10)
+            _sleep.assert_not_called()
 
     def test_register_file(self):
         _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
@@ -201,6 +941,51 @@ class WorkerLogicTest(unittest.TestCase):
             _mvn.exists.assert_called_once_with("G:A:V:P")
             _wrk.controller.delete_location.assert_called_once_with("G:A:V:P", "NXS", reason="Object does not exist")
 
+    def test_mvn_client__reused(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.NexusAPI.NexusAPI") as _mmck:
+            _mmck.side_effect = lambda **kvargs: unittest.mock.MagicMock()
+            _mvn = _wrk._mvn_client()
+            self.assertEqual(_mvn, _wrk._mvn_client())
+            _mmck.assert_called_once()
+            # each thread has its own client
+            _threaded = concurrent.futures.ThreadPoolExecutor(1).submit(_wrk._mvn_client).result()
+            self.assertNotEqual(_mvn, _threaded)
+            _wrk._drop_mvn_client()
+            self.assertNotEqual(_mvn, _wrk._mvn_client())
+            self.assertEqual(3, _mmck.call_count)
+
+    def test_mvn_client__pool(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.mvn_url = "http://test.example.com/something"
+        _wrk.args.mvn_user = "test_yser"
+        _wrk.args.mvn_password = "test_xassword"
+        _wrk.args.mvn_pool_size = 3
+        _mvn = _wrk._mvn_client()
+        _adapter = _mvn.web.get_adapter("http://test.example.com/something")
+        self.assertEqual(3, _adapter._pool_maxsize)
+        self.assertEqual(2, _adapter.max_retries.total)
+        _wrk._drop_mvn_client()
+
+    def test_register_location__connection_error(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.NexusAPI.NexusAPI") as _mmck:
+            _mmck.return_value.exists.side_effect = requests.exceptions.ConnectionError("Connection reset")
+
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                _wrk._register_location(FileLocation("G:A:V:P", "NXS", None), "CTYPE")
+
+            _mmck.return_value.exists.side_effect = None
+            _mmck.return_value.exists.return_value = False
+            _wrk._register_location(FileLocation("G:A:V:P", "NXS", None), "CTYPE")
+            # client is re-created after failure
+            self.assertEqual(2, _mmck.call_count)
+
     def test_register_location__no_info(self):
         _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
         _wrk.args = unittest.mock.MagicMock()
@@ -225,7 +1010,7 @@ class WorkerLogicTest(unittest.TestCase):
             _mvn.exists.assert_called_once_with("G:A:V:P")
             _wrk.controller.delete_location.assert_not_called()
             _mvn.info.assert_called_once_with("G:A:V:P")
-            _wrk._download.assert_called_once_with(_mvn, "G:A:V:P")
+            _wrk._download.assert_called_once_with(_mvn, "G:A:V:P", digests={}, size=None, md5=None)
             _wrk.controller.md5.assert_called_once_with(_tf)
             _wrk.controller.mime.assert_called_once_with(_tf)
             _wrk._check_artifact_not_registered.assert_called_once_with(FileLocation('G:A:V:P', 'NXS', None), 0, {'md5': 'abcdef', 'mime': 'unknown/unknown'}, remove=False)
@@ -356,6 +1141,171 @@ class WorkerLogicTest(unittest.TestCase):
             _wrk._check_artifact_not_registered.assert_called_once_with(FileLocation('G:A:V:P', 'NXS', None), 3, {'md5': 'abcdef1234', 'mime': 'test/unknown'}, remove=False)
             _wrk._register_artifact.assert_called_once_with(_mvn, FileLocation('G:A:V:P', 'NXS', None), 'CTYPE', 3, {'md5': 'abcdef1234', 'mime': 'test/unknown'}, None)
 
+    def test_register_location__digests_while_downloading(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _tf = tempfile.NamedTemporaryFile()
+
+        def _download(mvn_client, gav, digests=None, size=None, md5=None):
+            digests["md5"] = "abcdef"
+            digests["header"] = b"the_test"
+            return _tf
+
+        _mvn = unittest.mock.MagicMock()
+        _mvn.exists = unittest.mock.MagicMock(return_value=True)
+        _mvn.info = unittest.mock.MagicMock(return_value=None)
+        _wrk.controller.mime = unittest.mock.MagicMock(return_value="unknown/unknown")
+        _wrk._download = unittest.mock.MagicMock(side_effect=_download)
+        _wrk._check_artifact_not_registered = unittest.mock.MagicMock(return_value=False)
+        _wrk._register_location_with(_mvn, FileLocation("G:A:V:P", "NXS", None), "CTYPE", 0, False, None)
+        _wrk.controller.md5.assert_not_called()
+        self.assertEqual(b"the_test", _wrk.controller.mime.call_args.args[0].read())
+        _wrk._check_artifact_not_registered.assert_called_once_with(FileLocation('G:A:V:P', 'NXS', None), 0, {'md5': 'abcdef', 'mime': 'unknown/unknown'}, remove=False)
+        self.assertTrue(_tf.closed)
+
+    def test_download__digests(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _mvn = unittest.mock.MagicMock()
+        _mvn.cat = unittest.mock.MagicMock(side_effect=lambda gav, write_to, **kvargs: write_to.write(b"the_test_data"))
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.spool_size = 1024
+        _digests = dict()
+        _tf = _wrk._download(_mvn, "G:A:V:P", digests=_digests)
+        self.assertEqual(hashlib.md5(b"the_test_data").hexdigest(), _digests["md5"])
+        self.assertEqual(b"the_test_data", _digests["header"])
+        _tf.seek(0)
+        self.assertEqual(b"the_test_data", _tf.read())
+        _tf.close()
+
+    def test_download__cache(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.spool_size = 1024
+        _md5 = hashlib.md5(b"the_test_data").hexdigest()
+
+        with tempfile.TemporaryDirectory() as _dir:
+            _wrk.download_cache = DownloadCache(_dir, 1024)
+            _mvn = unittest.mock.MagicMock()
+            _mvn.cat = unittest.mock.MagicMock(side_effect=lambda gav, write_to, **kvargs: write_to.write(b"the_test_data"))
+            _wrk._download(_mvn, "G:A:V:P", md5=_md5).close()
+            self.assertEqual({"hits": 0, "misses": 1, "entries": 1, "size": 13}, _wrk.stats()["download_cache"])
+            # the same content is taken from cache in a fast lane for another GAV
+            _digests = dict()
+            _fl = _run_in_lane("fast", _wrk._download, _mvn, "G:A:V1:P", digests=_digests, md5=_md5)
+            self.assertEqual(b"the_test_data", _fl.read())
+            _fl.close()
+            self.assertEqual({"md5": _md5, "header": b"the_test_data"}, _digests)
+            _mvn.cat.assert_called_once()
+            self.assertEqual(1, _wrk.download_cache.hits)
+
+    def _resumable_mvn(self, data, failures, etags=("\"v1\"",)):
+        """
+        MVN client mock sending 'data' with transfer interrupted after each of 'failures' offsets.
+        Artifact is redeployed with next of 'etags' after each response, its data are reversed then.
+        """
+        _failures = list(failures)
+        _responses = [0]
+
+        def _stream(start, data):
+            _end = _failures.pop(0) if _failures else len(data)
+            yield data[start:_end]
+
+            if _end < len(data):
+                raise urllib3.exceptions.ProtocolError("broken")
+
+        def _response(status):
+            _version = min(_responses[0], len(etags) - 1)
+            _responses[0] += 1
+            _resp = unittest.mock.MagicMock(status_code=status)
+            _resp.headers = {"ETag": etags[_version]} if etags[_version] else dict()
+            return _resp, data[::-1] if _version else data
+
+        def _cat(gav, binary=False, response=False, stream=False, write_to=None, headers=None, hooks=None):
+            if write_to is not None:
+                _resp, _data = _response(200)
+
+                if hooks:
+                    hooks["response"](_resp)
+
+                for _chunk in _stream(0, _data):
+                    write_to.write(_chunk)
+
+                return _resp
+
+            _resp, _data = _response(206)
+
+            if headers.get("If-Range") != _resp.headers.get("ETag"):
+                _resp.status_code = 200
+
+            _chunks = _stream(0 if _resp.status_code == 200 else int(headers["Range"][len("bytes="):-1]), _data)
+            _resp.raw.read = lambda size=-1: next(_chunks, b"")
+            return _resp
+
+        _mvn = unittest.mock.MagicMock()
+        _mvn.cat = unittest.mock.MagicMock(side_effect=_cat)
+        return _mvn
+
+    def test_download__resume(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.spool_size = 1024
+        _wrk.args.download_retries = 2
+        _data = b"the_test_data_to_resume"
+        _md5 = hashlib.md5(_data).hexdigest()
+
+        with unittest.mock.patch("oc_checksums_worker.checksums_worker.mvn_ranges.supports_ranges", return_value=True), \
+                unittest.mock.patch("oc_checksums_worker.checksums_worker.time.sleep") as _sleep:
+            _mvn = self._resumable_mvn(_data, [5, 12])
+            _digests = dict()
+            _fl = _wrk._download(_mvn, "G:A:V:P", digests=_digests, md5=_md5)
+            _fl.seek(0)
+            self.assertEqual(_data, _fl.read())
+            _fl.close()
+            self.assertEqual(_md5, _digests["md5"])
+            self.assertEqual(3, _mvn.cat.call_count)
+            self.assertEqual({"Range": "bytes=12-", "If-Range": "\"v1\""}, _mvn.cat.call_args.kwargs["headers"])
+            self.assertEqual(2, _sleep.call_count)
+
+            # redeployed between attempts: started over
+            for _etags in [["\"v1\"", "\"v2\""], [None]]:
+                _mvn = self._resumable_mvn(_data, [5], etags=_etags)
+                _fl = _wrk._download(_mvn, "G:A:V:P", md5=hashlib.md5(_data[::-1] if _etags[0] else _data).hexdigest())
+                _fl.seek(0)
+                self.assertEqual(_data[::-1] if _etags[0] else _data, _fl.read())
+                _fl.close()
+
+            # retries are exhausted
+            with self.assertRaises(urllib3.exceptions.ProtocolError):
+                _wrk._download(self._resumable_mvn(_data, [1, 2, 3]), "G:A:V:P")
+
+            # resumed data do not match
+            with self.assertRaises(DownloadVerificationError):
+                _wrk._download(self._resumable_mvn(_data, [5]), "G:A:V:P", md5="0" * 32)
+
+    def test_download_file(self):
+        _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.spool_size = 10
+
+        with _wrk._download_file() as _fl:
+            self.assertIsInstance(_fl, tempfile.SpooledTemporaryFile)
+            _fl.write(b"the_test")
+            self.assertFalse(_fl._rolled)
+            _fl.write(b"_data")
+            self.assertTrue(_fl._rolled)
+
+        with _wrk._download_file(10) as _fl:
+            self.assertIsInstance(_fl, tempfile.SpooledTemporaryFile)
+
+        with _wrk._download_file(11) as _fl:
+            self.assertNotIsInstance(_fl, tempfile.SpooledTemporaryFile)
+            self.assertTrue(os.path.exists(_fl.name))
+
+        _wrk.args.spool_size = 0
+
+        with _wrk._download_file(1) as _fl:
+            self.assertNotIsInstance(_fl, tempfile.SpooledTemporaryFile)
+
     def test_download(self):
         class AnyTempFile():
             def __eq__(self, other):
@@ -364,6 +1314,8 @@ class WorkerLogicTest(unittest.TestCase):
                 return True
 
         _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
+        _wrk.args.spool_size = 0
         _mvn = unittest.mock.MagicMock()
         _wrk._download(_mvn, "G:A:V:P")
         _mvn.cat.assert_called_once_with("G:A:V:P", binary=True, stream=True, write_to=AnyTempFile())
@@ -472,10 +1424,11 @@ class WorkerLogicTest(unittest.TestCase):
         _tf = tempfile.NamedTemporaryFile()
         _tf.write(b"TestData")
         _wrk = QueueWorkerApplicationMock(setup_orm=False, controller=unittest.mock.MagicMock())
+        _wrk.args = unittest.mock.MagicMock()
         _wrk._download = unittest.mock.MagicMock(return_value=_tf)
         _mvn = unittest.mock.MagicMock()
         _wrk._register_artifact(_mvn, FileLocation("groupId:artifactId:version:packaging", "NXS", None), "CITYPE", 1, {"md5": "abcd", "mime": "unknown/data"})
-        _wrk._download.assert_called_once_with(_mvn, "groupId:artifactId:version:packaging")
+        _wrk._download.assert_called_once_with(_mvn, "groupId:artifactId:version:packaging", size=None, md5="abcd")
         _wrk.controller.register_file_md5.assert_not_called()
         _wrk.controller.register_file_obj.assert_called_once_with(_tf, "CITYPE", "groupId:artifactId:version:packaging", "NXS", inclusion_level=1)
         _tf.close()
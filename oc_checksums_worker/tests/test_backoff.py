@@ -0,0 +1,41 @@
+import unittest
+import unittest.mock
+from ..backoff import PollBackoff
+
+class PollBackoffTest(unittest.TestCase):
+    def test_exponential_growth(self):
+        _bo = PollBackoff(0.5, 10, jitter=0)
+        self.assertEqual([0.5, 1, 2, 4, 8, 10, 10], [_bo.next_delay() for _i in range(0, 7)])
+        self.assertEqual({"delay": 10, "empty_polls": 7, "minimum": 0.5, "maximum": 10}, _bo.stats())
+
+    def test_long_idle(self):
+        _bo = PollBackoff(0.5, 10, jitter=0)
+        self.assertEqual([10] * 5000, list(_bo.next_delay() for _i in range(0, 5005))[5:])
+        self.assertEqual(5005, _bo.stats().get("empty_polls"))
+
+    def test_reset(self):
+        _bo = PollBackoff(1, 10, jitter=0)
+        _bo.next_delay()
+        _bo.next_delay()
+        _bo.reset()
+        self.assertEqual(0, _bo.stats().get("delay"))
+        self.assertEqual(0, _bo.stats().get("empty_polls"))
+        self.assertEqual(1, _bo.next_delay())
+
+    def test_jitter(self):
+        _bo = PollBackoff(4, 10, jitter=0.5)
+
+        with unittest.mock.patch("oc_checksums_worker.backoff.random.random", return_value=0.0):
+            self.assertEqual(2, _bo.next_delay())
+
+        with unittest.mock.patch("oc_checksums_worker.backoff.random.random", return_value=1.0):
+            # never above the ceiling
+            self.assertEqual(10, _bo.next_delay())
+
+    def test_minimum_above_maximum(self):
+        _bo = PollBackoff(20, 10, jitter=0)
+        self.assertEqual(10, _bo.next_delay())
+
+    def test_negative(self):
+        with self.assertRaises(ValueError):
+            PollBackoff(-1, 10)
@@ -0,0 +1,147 @@
+from .helpers import archive_test_case
+from .. import bulk_registration
+from ..bulk_registration import is_sql_path, known_checksums
+from ..checksum_filter import ChecksumFilter
+import hashlib
+import os
+import tempfile
+import unittest.mock
+import zipfile
+
+_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mocks", "sql-stubs", "plain", "delete_as_regular_id.sql")
+
+class BulkRegistrationTest(archive_test_case.ArchiveTestCase):
+
+    def _zip(self, gav, members):
+        _tf = tempfile.NamedTemporaryFile(suffix=".zip")
+
+        with zipfile.ZipFile(_tf, mode="w") as _zip:
+            for _path, _data in members.items():
+                # fixed date so the archive checksum is the same in each scenario run
+                _zip.writestr(zipfile.ZipInfo(_path, date_time=(2020, 1, 1, 0, 0, 0)), _data)
+
+        self.mvn.set_gav_content(gav, _tf)
+
+    def _snapshot(self):
+        _models = archive_test_case.base_test_case.models
+        _md5 = dict(_models.CheckSums.objects.filter(csprov__cs_prov="Regular").values_list("file_id", "checksum"))
+        return {
+            "files": sorted((_md5.get(_f.id), _f.mime_type, _f.ci_type_id, _f.depth_level) for _f in _models.Files.objects.all()),
+            "checksums": sorted(_models.CsProv.objects.values_list("cs__checksum", "cs_prov")),
+            "locations": sorted((_md5.get(_l.file_id), _l.loc_type_id, _l.path, _md5.get(_l.file_dst_id), _l.revision)
+                for _l in _models.Locations.objects.all()),
+            "history": _models.Locations.history.count()}
+
+    def _reset(self):
+        self.tearDown()
+        self.setUp()
+
+    def _compare(self, scenario):
+        scenario([])
+        _expected = self._snapshot()
+
+        for _args in [["--bulk-members"], ["--bulk-members", "--checksum-filter"]]:
+            self._reset()
+            scenario(_args)
+            self.assertEqual(_expected, self._snapshot())
+
+    def test_new_members(self):
+        def _scenario(add_args):
+            self._zip("g:a:v:zip", {"a.txt": b"first", "dir/b.txt": b"second", "c.txt": b"first", "empty.txt": b""})
+            self.register_check("g:a:v:zip", depth=1, add_args=add_args)
+
+        self._compare(_scenario)
+        self.check_counters(Files=3, Locations=4, CheckSums=3, HistoricalLocations=4)
+
+    def test_known_members(self):
+        def _scenario(add_args):
+            self.mvn.set_gav_content("g:a:v:txt", self._file(b"first"))
+            self.register_check("g:a:v:txt", depth=0, add_args=add_args)
+            self._zip("g:a:v:zip", {"a.txt": b"first", "b.txt": b"second"})
+            self.register_check("g:a:v:zip", depth=0, add_args=add_args)
+            self.register_check("g:a:v:zip", depth=1, add_args=add_args)
+            # registered with depth already
+            self.register_check("g:a:v:zip", depth=1, add_args=add_args)
+
+        self._compare(_scenario)
+        self.check_counters(Files=3, Locations=4, CheckSums=3)
+
+    def test_sql_members(self):
+        def _scenario(add_args):
+            with open(_SQL, "rb") as _sql:
+                self._zip("g:a:v:zip", {"db/script.sql": _sql.read(), "a.txt": b"first"})
+
+            self.register_check("g:a:v:zip", depth=1, add_args=add_args)
+
+        self._compare(_scenario)
+
+    def test_not_archive(self):
+        def _scenario(add_args):
+            self.mvn.set_gav_content("g:a:v:zip", self._file(b"not an archive"))
+            self.register("g:a:v:zip", depth=1, add_args=add_args)
+
+        self._compare(_scenario)
+        self.assertEqual(0, self.ck_controller.get_file_by_location("g:a:v:zip", "NXS").depth_level)
+
+    def test_filter_outdated(self):
+        # checksum registered by someone else after the filter was loaded
+        self.app.args = unittest.mock.MagicMock(checksum_filter=True)
+        _filter = self.app._known_filter(archive_test_case.base_test_case.models)
+        self.ck_controller.register_file_md5(hashlib.md5(b"first").hexdigest(), "FILE", "text/plain")
+        self.assertNotIn(hashlib.md5(b"first").hexdigest(), _filter)
+        self._zip("g:a:v:zip", {"a.txt": b"first", "b.txt": b"second"})
+
+        self._zip("g:a:v2:zip", {"c.txt": b"first", "d.txt": b"third"})
+
+        with unittest.mock.patch.object(self.app, "_known_filter", return_value=_filter), \
+                unittest.mock.patch.object(bulk_registration, "register_members",
+                        wraps=bulk_registration.register_members) as _register:
+            self.register_check("g:a:v:zip", depth=1, add_args=["--bulk-members", "--checksum-filter"])
+            # found on retry and remembered
+            self.assertEqual([False, True], list(_c.args[4] for _c in _register.call_args_list))
+            self.assertIn(hashlib.md5(b"first").hexdigest(), _filter)
+            self.assertIn(hashlib.md5(b"second").hexdigest(), _filter)
+            _register.reset_mock()
+            self.register_check("g:a:v2:zip", depth=1, add_args=["--bulk-members", "--checksum-filter"])
+            self.assertEqual([False], list(_c.args[4] for _c in _register.call_args_list))
+
+        self.check_counters(Files=5, Locations=6, CheckSums=5)
+
+    def test_filter_controller_path(self):
+        # the first message loads the filter, the second one is registered by the controller (depth 2)
+        with open(_SQL, "rb") as _sql:
+            self._zip("g:a:v:zip", {"db/script.sql": _sql.read(), "a.txt": b"first"})
+
+        self._zip("g:a:v2:zip", {"b.txt": b"second", "c.txt": b"third"})
+        self.rpc.register_file(archive_test_case.base_test_case.FileLocation("g:a:v:zip", "NXS", None), None, 1)
+        self.rpc.register_file(archive_test_case.base_test_case.FileLocation("g:a:v2:zip", "NXS", None), None, 2)
+        self.run_main(["--bulk-members", "--checksum-filter", "--max-depth", "2"])
+        _models = archive_test_case.base_test_case.models
+
+        for _md5 in _models.CheckSums.objects.filter(cs_type__code="MD5").values_list("checksum", flat=True):
+            self.assertIn(_md5, self.app.known_filter)
+
+        self.assertIn(hashlib.md5(b"third").hexdigest(), self.app.known_filter)
+
+    def test_filter_load(self):
+        self.ck_controller.register_file_md5("0" * 32, "FILE", "text/plain")
+        _filter = ChecksumFilter.load(archive_test_case.base_test_case.models)
+        self.assertEqual(1, _filter.entries)
+        self.assertIn("0" * 32, _filter)
+
+    def _file(self, data):
+        _tf = tempfile.NamedTemporaryFile()
+        _tf.write(data)
+        return _tf
+
+    def test_known_checksums(self):
+        self.ck_controller.register_file_md5("0" * 32, "FILE", "text/plain")
+        _known = known_checksums(archive_test_case.base_test_case.models, ["0" * 32, "1" * 32])
+        self.assertEqual(["0" * 32], list(_known.keys()))
+        self.assertTrue(_known["0" * 32][2])
+
+    def test_is_sql_path(self):
+        self.assertTrue(is_sql_path("g:a:v:sql", "NXS"))
+        self.assertTrue(is_sql_path("dir/script.PLB", "ARCH"))
+        self.assertFalse(is_sql_path("g:a:v:zip", "NXS"))
+        self.assertFalse(is_sql_path("dir/sql", "ARCH"))
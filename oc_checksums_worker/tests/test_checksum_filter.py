@@ -0,0 +1,44 @@
+import unittest
+import hashlib
+from ..checksum_filter import ChecksumFilter
+
+class ChecksumFilterTest(unittest.TestCase):
+
+    def _md5(self, value):
+        return hashlib.md5(str(value).encode()).hexdigest()
+
+    def test_no_false_negatives(self):
+        _filter = ChecksumFilter(1000)
+        _checksums = list(self._md5(_i) for _i in range(0, 1000))
+
+        for _md5 in _checksums:
+            _filter.add(_md5)
+
+        self.assertTrue(all(_md5 in _filter for _md5 in _checksums))
+        self.assertEqual(1000, _filter.entries)
+
+    def test_false_positives(self):
+        _filter = ChecksumFilter(1000, error_rate=0.01)
+
+        for _i in range(0, 1000):
+            _filter.add(self._md5(_i))
+
+        _positives = len(_filter.probable(list(self._md5(-_i - 1) for _i in range(0, 10000))))
+        self.assertLess(_positives, 300)
+        self.assertEqual(10000, _filter.stats()["probes"])
+        self.assertEqual(10000 - _positives, _filter.stats()["negatives"])
+
+    def test_probable(self):
+        _filter = ChecksumFilter(100)
+        _filter.add(self._md5(1))
+        self.assertEqual([self._md5(1)], _filter.probable([self._md5(1), self._md5(2)]))
+        # case does not matter
+        self.assertIn(self._md5(1).upper(), _filter)
+
+    def test_not_hexadecimal(self):
+        _filter = ChecksumFilter(100)
+        _filter.add("not a checksum")
+        self.assertEqual(0, _filter.entries)
+        # unknown values have to be looked up in database
+        self.assertIn("not a checksum", _filter)
+        self.assertIn(None, _filter)
@@ -0,0 +1,43 @@
+import unittest
+from ..coalescing import RegistrationCoalescer
+
+class RegistrationCoalescerTest(unittest.TestCase):
+    def _register_file(self, location, citype, depth=0, remove=False, version=None):
+        pass
+
+    def setUp(self):
+        self.coalescer = RegistrationCoalescer(self._register_file)
+
+    def test_normalize(self):
+        self.assertEqual(["register_file", [], {"location": ["g:a:v:p", "NXS", None], "citype": "CTYPE", "depth": 1,
+            "remove": False, "version": None}],
+            self.coalescer.normalize(["register_file", [("g:a:v:p", "NXS", None), "CTYPE"], {"depth": 1}]))
+        self.assertIsNone(self.coalescer.normalize(["register_checksum", [("g:a:v:p", "NXS", None), "abcdef"], {}]))
+        self.assertIsNone(self.coalescer.normalize(["register_file", [], {"unknown": 1}]))
+        self.assertIsNone(self.coalescer.normalize("trash"))
+
+    def test_merge(self):
+        _msg = self.coalescer.normalize(["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 2], {}])
+        _msg = self.coalescer.merge(_msg, self.coalescer.normalize(["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 1, True], {}]))
+        self.assertEqual(2, _msg[2]["depth"])
+        self.assertTrue(_msg[2]["remove"])
+        _msg = self.coalescer.merge(_msg, self.coalescer.normalize(["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 3, "Deleted"], {}]))
+        self.assertEqual(3, _msg[2]["depth"])
+        self.assertEqual("Deleted", _msg[2]["remove"])
+        _msg = self.coalescer.merge(_msg, self.coalescer.normalize(["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 0, True], {}]))
+        self.assertEqual(3, _msg[2]["depth"])
+        self.assertEqual("Deleted", _msg[2]["remove"])
+
+    def test_coalesce(self):
+        _key = lambda msg: (msg[1][0][0], msg[1][0][1])
+        _messages = [
+            (1, ["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 0], {}]),
+            (2, ["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 1], {}]),
+            (3, ["register_checksum", [("g:a:v:p", "NXS", None), "abcdef"], {}]),
+            (4, ["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 0], {}]),
+            (5, ["register_file", [("g:a:v:p1", "NXS", None), "CTYPE", 0], {}]),
+            (6, ["register_file", [("g:a:v:p", "NXS", None), "CTYPE", 0], {}])]
+        _result = self.coalescer.coalesce(_messages, _key)
+        self.assertEqual([[1, 2], [3], [4, 6], [5]], list(_items for _items, _msg in _result))
+        self.assertEqual(1, _result[0][1][2]["depth"])
+        self.assertEqual(_messages[4][1], _result[3][1])
@@ -0,0 +1,119 @@
+import unittest
+import unittest.mock
+import django.db
+from ..db_health import ConnectionMonitor
+
+class ConnectionMonitorTest(unittest.TestCase):
+
+    def _conn(self, alias="default", usable=True):
+        _conn = unittest.mock.MagicMock(alias=alias, in_atomic_block=False, errors_occurred=False)
+        _conn.is_usable.return_value = usable
+        _conn.close.side_effect = lambda: setattr(_conn, "connection", None)
+        return _conn
+
+    def setUp(self):
+        self._conns = list()
+        _handler = unittest.mock.MagicMock()
+        _handler.all.side_effect = lambda: list(self._conns)
+        _handler.__iter__.side_effect = lambda: iter(list(_conn.alias for _conn in self._conns))
+        _handler.databases = dict()
+        self._handler = _handler
+        self._patches = [
+                unittest.mock.patch.object(django.db, "connections", _handler),
+                unittest.mock.patch("django.conf.settings", unittest.mock.MagicMock(configured=True))]
+
+        for _patch in self._patches:
+            _patch.start()
+
+    def tearDown(self):
+        for _patch in self._patches:
+            _patch.stop()
+
+    def test_configure(self):
+        self._conns.append(self._conn())
+        self._handler.databases["default"] = {"CONN_MAX_AGE": 0}
+        ConnectionMonitor(max_age=300).configure()
+        self.assertEqual({"CONN_MAX_AGE": 300}, self._handler.databases["default"])
+
+    def test_check(self):
+        _monitor = ConnectionMonitor(check_interval=60)
+        _usable = self._conn()
+        _broken = self._conn(alias="other", usable=False)
+        _closed = self._conn(alias="closed")
+        _closed.connection = None
+        self._conns += [_usable, _broken, _closed]
+        _monitor.check()
+        _usable.close_if_unusable_or_obsolete.assert_called_once()
+        _usable.close.assert_not_called()
+        _broken.close.assert_called_once()
+        _closed.is_usable.assert_not_called()
+        self.assertEqual(2, _monitor.stats()["checks"])
+        self.assertEqual(1, _monitor.stats()["reconnects"])
+
+        # not checked again within interval
+        _monitor.check()
+        self.assertEqual(1, _usable.is_usable.call_count)
+        self.assertEqual(2, _monitor.stats()["checks"])
+
+    def test_check_in_transaction(self):
+        _conn = self._conn(usable=False)
+        _conn.in_atomic_block = True
+        self._conns.append(_conn)
+        ConnectionMonitor().check()
+        _conn.close_if_unusable_or_obsolete.assert_not_called()
+        _conn.close.assert_not_called()
+
+    def test_run_retried(self):
+        _monitor = ConnectionMonitor(check_interval=60)
+        _conn = self._conn()
+        self._conns.append(_conn)
+
+        def _job(value):
+            if _job.failed:
+                return value
+
+            _job.failed = True
+            _conn.is_usable.return_value = False
+            raise django.db.OperationalError("server closed the connection unexpectedly")
+
+        _job.failed = False
+        self.assertEqual("done", _monitor.run(_job, "done"))
+        _conn.close.assert_called_once()
+        self.assertEqual(1, _monitor.stats()["retries"])
+        self.assertEqual(1, _monitor.stats()["reconnects"])
+
+    def test_run_closed_by_django(self):
+        _monitor = ConnectionMonitor()
+        _conn = self._conn()
+        self._conns.append(_conn)
+        _job = unittest.mock.MagicMock(side_effect=[django.db.InterfaceError("connection already closed"), "done"])
+
+        def _fail():
+            _conn.connection = None
+            _conn.errors_occurred = True
+            return _job()
+
+        self.assertEqual("done", _monitor.run(_fail))
+        self.assertEqual(1, _monitor.stats()["retries"])
+
+    def test_run_not_connection_error(self):
+        _monitor = ConnectionMonitor()
+        self._conns.append(self._conn())
+        _job = unittest.mock.MagicMock(side_effect=django.db.OperationalError("deadlock detected"))
+
+        with self.assertRaises(django.db.OperationalError):
+            _monitor.run(_job)
+
+        _job.assert_called_once()
+        self.assertEqual(0, _monitor.stats()["retries"])
+
+    def test_run_other_error(self):
+        _monitor = ConnectionMonitor()
+        _conn = self._conn(usable=False)
+        self._conns.append(_conn)
+        _job = unittest.mock.MagicMock(side_effect=ValueError("test"))
+
+        with self.assertRaises(ValueError):
+            _monitor.run(_job)
+
+        _job.assert_called_once()
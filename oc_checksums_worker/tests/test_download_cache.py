@@ -0,0 +1,66 @@
+import unittest
+import hashlib
+import io
+import os
+import tempfile
+from ..download_cache import DownloadCache
+
+class DownloadCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _md5(self, data):
+        return hashlib.md5(data).hexdigest()
+
+    def test_get_put(self):
+        _cache = DownloadCache(self.directory.name, 100)
+        _data = b"the_test_data"
+        self.assertIsNone(_cache.get(self._md5(_data)))
+        _fl = io.BytesIO(_data)
+        _fl.seek(3)
+        _cache.put(self._md5(_data), _fl)
+        self.assertEqual(3, _fl.tell())
+
+        with _cache.get(self._md5(_data)) as _cached:
+            self.assertEqual(_data, _cached.read())
+
+        self.assertEqual({"hits": 1, "misses": 1, "entries": 1, "size": 13}, _cache.stats())
+        # not a checksum
+        self.assertIsNone(_cache.get("../something"))
+        _cache.put("../something", _fl)
+        self.assertEqual(1, _cache.stats()["entries"])
+
+    def test_eviction(self):
+        _cache = DownloadCache(self.directory.name, 25)
+        _first, _second, _third = b"first_data", b"second_data", b"third_data"
+
+        for _data in [_first, _second]:
+            _cache.put(self._md5(_data), io.BytesIO(_data))
+
+        # first one becomes the most recently used
+        _cache.get(self._md5(_first)).close()
+        _cache.put(self._md5(_third), io.BytesIO(_third))
+        self.assertEqual(20, _cache.size)
+        self.assertIsNone(_cache.get(self._md5(_second)))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, self._md5(_second))))
+        _cache.get(self._md5(_first)).close()
+        # larger than the whole budget
+        _cache.put(self._md5(b"x" * 26), io.BytesIO(b"x" * 26))
+        self.assertEqual(2, _cache.stats()["entries"])
+
+    def test_load(self):
+        _data = b"the_test_data"
+        DownloadCache(self.directory.name, 100).put(self._md5(_data), io.BytesIO(_data))
+
+        with open(os.path.join(self.directory.name, "unknown"), "wb") as _fl:
+            _fl.write(b"unknown")
+
+        _cache = DownloadCache(self.directory.name, 100)
+        self.assertEqual({"hits": 0, "misses": 0, "entries": 1, "size": 13}, _cache.stats())
+        _cache.get(self._md5(_data)).close()
+        # budget reduced
+        _cache = DownloadCache(self.directory.name, 10)
+        self.assertEqual(0, _cache.stats()["entries"])
@@ -0,0 +1,122 @@
+import concurrent.futures
+import unittest
+import threading
+import time
+from ..executors import KeyedExecutor, SlowLaneRequired, current_lane
+
+class KeyedExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = KeyedExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_results(self):
+        _futures = list(self.executor.submit(_i % 2, lambda x: x * 2, _i) for _i in range(0, 10))
+        self.assertEqual(list(range(0, 20, 2)), list(_f.result() for _f in _futures))
+        self.assertTrue(self.executor.join(timeout=10))
+        self.assertEqual(0, self.executor.pending)
+
+    def test_exception(self):
+        def _fail():
+            raise ValueError("Failed")
+
+        _future = self.executor.submit("key", _fail)
+        _next = self.executor.submit("key", lambda: "next")
+
+        with self.assertRaises(ValueError):
+            _future.result()
+
+        # failed job does not break the chain for its key
+        self.assertEqual("next", _next.result())
+
+    def test_same_key_ordered(self):
+        _order = list()
+        _active = list()
+        _overlap = list()
+        _lock = threading.Lock()
+
+        def _job(key, i):
+            with _lock:
+                if key in _active:
+                    _overlap.append(key)
+
+                _active.append(key)
+
+            time.sleep(0.01)
+
+            with _lock:
+                _active.remove(key)
+                _order.append((key, i))
+
+        _futures = list(self.executor.submit(_k, _job, _k, _i) for _i in range(0, 5) for _k in ["a", "b"])
+        list(_f.result() for _f in _futures)
+        self.assertEqual([], _overlap)
+        self.assertEqual(list(range(0, 5)), list(_i for _k, _i in _order if _k == "a"))
+        self.assertEqual(list(range(0, 5)), list(_i for _k, _i in _order if _k == "b"))
+
+    def test_different_keys_concurrent(self):
+        _barrier = threading.Barrier(3, timeout=10)
+        _futures = list(self.executor.submit(_k, _barrier.wait) for _k in ["a", "b", None])
+        list(_f.result() for _f in _futures)
+
+    def test_shutdown_no_wait(self):
+        _event = threading.Event()
+        _first = self.executor.submit("key", _event.wait, 10)
+        _second = self.executor.submit("key", lambda: "second")
+        self.executor.shutdown(wait=False)
+        _event.set()
+        self.assertTrue(_first.result())
+        # the next job is cancelled after the first one has its result
+        concurrent.futures.wait([_second], timeout=10)
+        self.assertTrue(_second.cancelled())
+
+
+class KeyedExecutorLanesTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = KeyedExecutor(2, slow_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_escalation(self):
+        _event = threading.Event()
+        _lanes = list()
+
+        def _job(name, slow):
+            _lanes.append((name, current_lane()))
+
+            if slow and current_lane() == "fast":
+                raise SlowLaneRequired(name)
+
+            if slow:
+                _event.wait(10)
+
+            return name
+
+        _slow = self.executor.submit("a", _job, "slow", True)
+        _next = self.executor.submit("a", _job, "next", False)
+        _other = self.executor.submit("b", _job, "other", False)
+        # fast lane is not blocked by the slow job
+        self.assertEqual("other", _other.result(timeout=10))
+        self.assertFalse(_next.done())
+        self.assertEqual({"fast": 1, "slow": 1}, self.executor.lanes)
+        _event.set()
+        self.assertEqual("slow", _slow.result(timeout=10))
+        self.assertEqual("next", _next.result(timeout=10))
+        self.assertEqual([("slow", "fast"), ("slow", "slow"), ("other", "fast"), ("next", "fast")],
+                sorted(_lanes, key=lambda x: ["slow", "other", "next"].index(x[0])))
+        self.assertEqual({"fast": 0, "slow": 0}, self.executor.lanes)
+
+    def test_no_lanes(self):
+        _executor = KeyedExecutor(2)
+
+        def _job():
+            raise SlowLaneRequired("test")
+
+        with self.assertRaises(SlowLaneRequired):
+            _executor.submit(None, _job).result(timeout=10)
+
+        self.assertIsNone(_executor.submit(None, current_lane).result(timeout=10))
+        self.assertEqual(dict(), _executor.lanes)
+        _executor.shutdown()
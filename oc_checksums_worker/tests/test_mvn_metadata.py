@@ -0,0 +1,121 @@
+import unittest
+import unittest.mock
+import os
+from oc_cdtapi.NexusAPI import NexusAPI, NexusAPIError
+from ..mvn_metadata import describe, MetadataCache, sidecar_gav, sidecar_md5
+from .mocks.mvn_mock import MvnClientMock
+
+class DescribeTest(unittest.TestCase):
+    def setUp(self):
+        self.env = unittest.mock.patch.dict(os.environ, {"MVN_DOWNLOAD_REPO": "releases"})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+
+    def _client(self, root, content=None, error=None):
+        _mvn = NexusAPI(root=root, user="test_user", auth="test_password")
+        _mvn.get = unittest.mock.MagicMock()
+        _mvn.get.return_value.content = content
+        _mvn.get.side_effect = error
+        return _mvn
+
+    def test_nexus(self):
+        _mvn = self._client("http://nexus.example.com/nexus", content=b"<?xml version='1.0'?>"
+                b"<org.sonatype.nexus.rest.model.ArtifactInfoResourceResponse><data>"
+                b"<md5Hash>d41d8cd98f00b204e9800998ecf8427e</md5Hash>"
+                b"<sha1Hash>da39a3ee5e6b4b0d3255bfef95601890afd80709</sha1Hash>"
+                b"<mimeType>application/zip</mimeType><size>1024</size>"
+                b"</data></org.sonatype.nexus.rest.model.ArtifactInfoResourceResponse>")
+        self.assertEqual({"md5": "d41d8cd98f00b204e9800998ecf8427e", "sha1": "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+            "mime": "application/zip", "size": 1024}, describe(_mvn, "g:a:v:zip"))
+        _mvn.get.assert_called_once_with("service/local/repositories/releases/content/g/a/v/a-v.zip", {"describe": "info"})
+
+    def test_nexus__partial(self):
+        _mvn = self._client("http://nexus.example.com/nexus", content=b"<response><data><size>1</size></data></response>")
+        self.assertEqual({"md5": None, "sha1": None, "mime": None, "size": 1}, describe(_mvn, "g:a:v:zip"))
+
+    def test_nexus__missing(self):
+        _mvn = self._client("http://nexus.example.com/nexus", error=NexusAPIError(code=404, text="Not found"))
+        self.assertIsNone(describe(_mvn, "g:a:v:zip"))
+
+    def test_nexus__error(self):
+        _mvn = self._client("http://nexus.example.com/nexus", error=NexusAPIError(code=500, text="Failure"))
+
+        with self.assertRaises(NexusAPIError):
+            describe(_mvn, "g:a:v:zip")
+
+    def test_artifactory(self):
+        _mvn = self._client("http://artifactory.example.com/artifactory", content=b"{}")
+        _mvn.get.return_value.json.return_value = {
+                "checksums": {"md5": "d41d8cd98f00b204e9800998ecf8427e", "sha1": "da39a3ee5e6b4b0d3255bfef95601890afd80709"},
+                "mimeType": "application/zip", "size": "1024"}
+        self.assertEqual({"md5": "d41d8cd98f00b204e9800998ecf8427e", "sha1": "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+            "mime": "application/zip", "size": 1024}, describe(_mvn, "g:a:v:zip"))
+        _mvn.get.assert_called_once_with("api/storage/releases/g/a/v/a-v.zip")
+
+    def test_artifactory__missing(self):
+        _mvn = self._client("http://artifactory.example.com/artifactory", error=NexusAPIError(code=404, text="Not found"))
+        self.assertIsNone(describe(_mvn, "g:a:v:zip"))
+
+    def test_other_client(self):
+        _mvn = MvnClientMock()
+        self.assertIsNone(describe(_mvn, "g:a:v:zip"))
+        _mvn.create_gav("g:a:v:jar")
+        self.assertEqual(_mvn.info("g:a:v:jar"), describe(_mvn, "g:a:v:jar"))
+        _mvn.clear()
+        _mvn = unittest.mock.MagicMock()
+        _mvn.exists.return_value = True
+        _mvn.info.return_value = None
+        self.assertEqual(dict(), describe(_mvn, "g:a:v:jar"))
+
+class SidecarTest(unittest.TestCase):
+    def test_sidecar_gav(self):
+        self.assertEqual("g:a:v:jar.md5", sidecar_gav("g:a:v"))
+        self.assertEqual("g:a:v:zip.sha1:dist", sidecar_gav("g:a:v:zip:dist", "sha1"))
+
+    def test_sidecar_md5(self):
+        _mvn = unittest.mock.MagicMock()
+        _mvn.cat.return_value = b"not a checksum"
+        self.assertIsNone(sidecar_md5(_mvn, "g:a:v:p"))
+        _mvn.cat.side_effect = NexusAPIError(code=404)
+        self.assertIsNone(sidecar_md5(_mvn, "g:a:v:p"))
+        _mvn.cat.side_effect = NexusAPIError(code=500)
+
+        with self.assertRaises(NexusAPIError):
+            sidecar_md5(_mvn, "g:a:v:p")
+
+class MetadataCacheTest(unittest.TestCase):
+    def test_ttl(self):
+        _cache = MetadataCache(60, 5, max_size=2)
+
+        with unittest.mock.patch("oc_checksums_worker.mvn_metadata.time.monotonic", return_value=100):
+            _cache.put("g:a:v:p", {"md5": "abcdef"})
+            _cache.put("g:a:v:p1", None)
+            _found, _info = _cache.get("g:a:v:p")
+            self.assertTrue(_found)
+            self.assertEqual({"md5": "abcdef"}, _info)
+            # a copy is returned
+            _info["md5"] = "012345"
+            self.assertEqual((True, {"md5": "abcdef"}), _cache.get("g:a:v:p"))
+            self.assertEqual((True, None), _cache.get("g:a:v:p1"))
+            self.assertEqual((False, None), _cache.get("g:a:v:p2"))
+
+        with unittest.mock.patch("oc_checksums_worker.mvn_metadata.time.monotonic", return_value=106):
+            self.assertEqual((False, None), _cache.get("g:a:v:p1"))
+            self.assertEqual((True, {"md5": "abcdef"}), _cache.get("g:a:v:p"))
+            _cache.invalidate("g:a:v:p")
+            self.assertEqual((False, None), _cache.get("g:a:v:p"))
+
+        self.assertEqual({"hits": 4, "misses": 3, "entries": 0}, _cache.stats())
+
+    def test_limits(self):
+        _cache = MetadataCache(60, 0, max_size=2)
+        _cache.put("g:a:v:p", None)
+        self.assertEqual((False, None), _cache.get("g:a:v:p"))
+
+        for _gav in ["g:a:v:p1", "g:a:v:p2", "g:a:v:p3"]:
+            _cache.put(_gav, dict())
+
+        self.assertEqual((False, None), _cache.get("g:a:v:p1"))
+        self.assertEqual((True, dict()), _cache.get("g:a:v:p3"))
@@ -0,0 +1,41 @@
+import unittest
+import unittest.mock
+import re
+from ..mvn_ranges import RangeNotSupported, open_range, validator
+
+class RangeClientMock(object):
+    def __init__(self, data, status=206):
+        self.data = data
+        self.status = status
+        self.ranges = list()
+
+    def cat(self, gav, binary=False, response=False, stream=False, headers=None):
+        _start, _end = re.match(r"^bytes=(\d+)-(\d*)$", headers["Range"]).groups()
+        self.ranges.append((int(_start), int(_end) if _end else None))
+        _resp = unittest.mock.MagicMock()
+        _resp.status_code = self.status
+        _resp.content = self.data[int(_start):int(_end) + 1 if _end else None]
+        return _resp
+
+class MvnRangesTest(unittest.TestCase):
+    def test_not_supported(self):
+        _mvn = RangeClientMock(b"the_test_data", status=200)
+
+        with self.assertRaises(RangeNotSupported):
+            open_range(_mvn, "g:a:v:p", 0)
+
+    def test_if_range(self):
+        _mvn = RangeClientMock(b"the_test_data", status=200)
+        # changed since: the whole artifact is sent
+        self.assertEqual(200, open_range(_mvn, "g:a:v:p", 4, if_range="\"v1\"").status_code)
+
+        _mvn = unittest.mock.MagicMock()
+        _mvn.cat.return_value = unittest.mock.MagicMock(status_code=206)
+        open_range(_mvn, "g:a:v:p", 4, if_range="\"v1\"")
+        self.assertEqual({"Range": "bytes=4-", "If-Range": "\"v1\""}, _mvn.cat.call_args.kwargs["headers"])
+
+    def test_validator(self):
+        _date = "Wed, 21 Oct 2015 07:28:00 GMT"
+        self.assertEqual("\"v1\"", validator(unittest.mock.MagicMock(headers={"ETag": "\"v1\"", "Last-Modified": _date})))
+        self.assertEqual(_date, validator(unittest.mock.MagicMock(headers={"ETag": "W/\"v1\"", "Last-Modified": _date})))
+        self.assertIsNone(validator(unittest.mock.MagicMock(headers=dict())))
@@ -0,0 +1,141 @@
+import unittest
+import unittest.mock
+from ..pgq_batch import PgQBatch, PgQFinalizer
+
+class PgQBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.pgq = unittest.mock.MagicMock()
+        self.pgq.get_queue_id.return_value = 12
+        self.pgq.conn.autocommit = True
+        self.csr = self.pgq.conn.cursor.return_value
+
+    def test_claim(self):
+        self.csr.fetchall.return_value = [(5, ["m5"]), (3, ["m3"])]
+        _batch = PgQBatch(self.pgq, "test.queue")
+        self.assertEqual([(3, ["m3"]), (5, ["m5"])], _batch.claim(10))
+        self.assertEqual([(3, ["m3"]), (5, ["m5"])], _batch.claim(10))
+        # queue identifier is asked once
+        self.pgq.get_queue_id.assert_called_once_with("test.queue")
+        self.assertEqual(2, self.csr.execute.call_count)
+        _query, _params = self.csr.execute.call_args[0]
+        self.assertIn("for update skip locked", _query)
+        self.assertIn("returning id, payload", _query)
+        self.assertEqual(('A', 60, 12, 'N', 10), _params)
+
+    def test_claim__min_age(self):
+        self.csr.fetchall.return_value = []
+        _batch = PgQBatch(self.pgq, "test.queue", min_age=0)
+        _batch.claim(1)
+        self.assertEqual(('A', 0, 12, 'N', 1), self.csr.execute.call_args[0][1])
+
+    def test_claim__no_queue(self):
+        self.pgq.get_queue_id.return_value = None
+        _batch = PgQBatch(self.pgq, "test.queue")
+        self.assertEqual([], _batch.claim(10))
+        self.csr.execute.assert_not_called()
+
+    def test_finalize(self):
+        _batch = PgQBatch(self.pgq, "test.queue")
+
+        with unittest.mock.patch("oc_checksums_worker.pgq_batch.psycopg2.extras.execute_values") as _ev:
+            _batch.finalize([(1, None), (2, "Failure"), (3, None)])
+            _ev.assert_called_once()
+            self.assertEqual([(2, "Failure")], _ev.call_args[0][2])
+
+        self.csr.execute.assert_called_once()
+        _query, _params = self.csr.execute.call_args[0]
+        self.assertIn("id = any(%s)", _query)
+        self.assertEqual(('P', [1, 3], 'A'), _params)
+        self.pgq.conn.commit.assert_not_called()
+
+    def test_finalize__no_autocommit(self):
+        self.pgq.conn.autocommit = False
+        _batch = PgQBatch(self.pgq, "test.queue")
+        _batch.finalize([(1, None)])
+        self.pgq.conn.commit.assert_called_once()
+
+    def test_listen(self):
+        _batch = PgQBatch(self.pgq, "test.queue")
+        _batch.listen("test_channel")
+        self.csr.execute.assert_called_once()
+        self.assertEqual("test_channel", _batch.channel)
+
+    def test_wait__pending(self):
+        # notification arrived while previous query was executed
+        self.pgq.conn.notifies = ["notify"]
+        _batch = PgQBatch(self.pgq, "test.queue")
+
+        with unittest.mock.patch("oc_checksums_worker.pgq_batch.select.select") as _select:
+            self.assertTrue(_batch.wait(10))
+            _select.assert_not_called()
+
+        self.assertEqual([], self.pgq.conn.notifies)
+
+    def test_wait__timeout(self):
+        self.pgq.conn.notifies = []
+        _batch = PgQBatch(self.pgq, "test.queue")
+
+        with unittest.mock.patch("oc_checksums_worker.pgq_batch.select.select", return_value=([], [], [])) as _select:
+            self.assertFalse(_batch.wait(3))
+            _select.assert_called_once_with([self.pgq.conn], [], [], 3)
+
+        self.pgq.conn.poll.assert_not_called()
+
+    def test_wait__notified(self):
+        self.pgq.conn.notifies = []
+        self.pgq.conn.poll.side_effect = lambda: self.pgq.conn.notifies.append("notify")
+        _batch = PgQBatch(self.pgq, "test.queue")
+
+        with unittest.mock.patch("oc_checksums_worker.pgq_batch.select.select", return_value=([self.pgq.conn], [], [])):
+            self.assertTrue(_batch.wait(3))
+
+        self.pgq.conn.poll.assert_called_once()
+        self.assertEqual([], self.pgq.conn.notifies)
+
+
+class PgQFinalizerTest(unittest.TestCase):
+    def setUp(self):
+        self.batch = unittest.mock.MagicMock()
+
+    def test_size(self):
+        _finalizer = PgQFinalizer(self.batch, max_size=3, max_delay=3600)
+        _finalizer.add([(1, None), (2, "Failed")])
+        self.batch.finalize.assert_not_called()
+        self.assertEqual({"buffered": 2, "flushes": 0}, _finalizer.stats())
+        _finalizer.add([(3, None)])
+        self.batch.finalize.assert_called_once_with([(1, None), (2, "Failed"), (3, None)])
+        self.assertEqual({"buffered": 0, "flushes": 1}, _finalizer.stats())
+
+    def test_delay(self):
+        _finalizer = PgQFinalizer(self.batch, max_size=100, max_delay=60)
+
+        with unittest.mock.patch("oc_checksums_worker.pgq_batch.time.monotonic") as _monotonic:
+            _monotonic.return_value = 100
+            _finalizer.add([(1, None)])
+            _monotonic.return_value = 159
+            _finalizer.add([(2, None)])
+            self.batch.finalize.assert_not_called()
+            _monotonic.return_value = 160
+            _finalizer.add([(3, None)])
+            self.batch.finalize.assert_called_once_with([(1, None), (2, None), (3, None)])
+
+    def test_no_delay(self):
+        _finalizer = PgQFinalizer(self.batch)
+        _finalizer.add([(1, None)])
+        self.batch.finalize.assert_called_once_with([(1, None)])
+
+    def test_flush(self):
+        _finalizer = PgQFinalizer(self.batch, max_size=100, max_delay=3600)
+        _finalizer.flush()
+        self.batch.finalize.assert_not_called()
+        _finalizer.add([(1, None)])
+        # results are kept if writing fails
+        self.batch.finalize.side_effect = Exception("Connection lost")
+
+        with self.assertRaises(Exception):
+            _finalizer.flush()
+
+        self.batch.finalize.side_effect = None
+        _finalizer.flush()
+        self.batch.finalize.assert_called_with([(1, None)])
+        self.assertEqual({"buffered": 0, "flushes": 1}, _finalizer.stats())
@@ -0,0 +1,64 @@
+import unittest
+import io
+import threading
+from ..prefetch import DownloadPrefetcher
+
+class DownloadPrefetcherTest(unittest.TestCase):
+    def _job(self, size, data=b"data", reserve=None):
+        if not reserve(size):
+            return None
+
+        return (io.BytesIO(data), {"size": size})
+
+    def test_take(self):
+        _prefetcher = DownloadPrefetcher(10)
+        _prefetcher.schedule("g:a:v:p", self._job, 4)
+        # scheduled once
+        _prefetcher.schedule("g:a:v:p", self._job, 4, b"other")
+        _file, _data = _prefetcher.take("g:a:v:p")
+        self.assertEqual(b"data", _file.read())
+        self.assertEqual({"size": 4}, _data)
+        self.assertIsNone(_prefetcher.take("g:a:v:p"))
+        self.assertEqual({"hits": 1, "misses": 1, "discarded": 0, "pending": 0, "reserved": 0}, _prefetcher.stats())
+
+    def test_limit(self):
+        _prefetcher = DownloadPrefetcher(10)
+        _started = threading.Event()
+        _release = threading.Event()
+
+        def _slow_job(reserve=None):
+            _started.set()
+            _release.wait(5)
+            return self._job(8, reserve=reserve)
+
+        _prefetcher.schedule("g:a:v:p", _slow_job)
+        _started.wait(5)
+        # not started yet and cancelled
+        _prefetcher.schedule("g:a:v:p1", self._job, 4)
+        self.assertIsNone(_prefetcher.take("g:a:v:p1"))
+        _release.set()
+        self.assertIsNotNone(_prefetcher.take("g:a:v:p"))
+
+        # above the limit or unknown size
+        for _size in [11, None]:
+            _prefetcher.schedule("g:a:v:p2", self._job, _size)
+            self.assertIsNone(_prefetcher.take("g:a:v:p2"))
+
+        self.assertEqual(0, _prefetcher.reserved)
+
+    def test_discard(self):
+        _prefetcher = DownloadPrefetcher(10)
+        _file = io.BytesIO(b"data")
+        _done = threading.Event()
+
+        def _failed_job(reserve=None):
+            _done.set()
+            raise ValueError("failed")
+
+        _prefetcher.schedule("g:a:v:p", lambda reserve: (_file, None) if reserve(4) else None)
+        _prefetcher.schedule("g:a:v:p1", _failed_job)
+        # jobs are run one by one, so the first one is finished
+        _done.wait(5)
+        _prefetcher.clear()
+        self.assertTrue(_file.closed)
+        self.assertEqual({"hits": 0, "misses": 0, "discarded": 1, "pending": 0, "reserved": 0}, _prefetcher.stats())
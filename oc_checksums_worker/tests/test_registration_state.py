@@ -0,0 +1,106 @@
+from .helpers import archive_test_case
+from .generators.generators import generate_many_different_gavs
+from ..registration_state import controller_models, location_state, RegistrationStateCache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import unittest
+import unittest.mock
+
+class RegistrationStateTest(archive_test_case.ArchiveTestCase):
+
+    def _controller_state(self, gav):
+        _file = self.ck_controller.get_file_by_location(gav, "NXS", history=False)
+        return (self.ck_controller.get_location_checksum(gav, "NXS"),
+                _file.id if _file else None,
+                self.ck_controller.get_current_inclusion_depth(_file) if _file else None)
+
+    def test_controller_models(self):
+        self.assertIs(controller_models(self.ck_controller), archive_test_case.base_test_case.models)
+        self.assertIsNone(controller_models(unittest.mock.MagicMock()))
+
+    def test_not_registered(self):
+        self.assertEqual((None, None, None), location_state(archive_test_case.base_test_case.models, "g:a:v:zip", "NXS"))
+
+    def test_same_as_controller(self):
+        _gav = "gg:aa:vv:zip"
+        self.mvn.create_gav(_gav, include=generate_many_different_gavs(2, p="txt"))
+        self.register_check(_gav, depth=0)
+        _state = location_state(archive_test_case.base_test_case.models, _gav, "nxs")
+        self.assertEqual(self._controller_state(_gav), _state)
+        self.assertEqual(0, _state[2])
+
+        # deeper registration is seen as well
+        self.register_check(_gav, depth=1)
+        _state = location_state(archive_test_case.base_test_case.models, _gav, "NXS")
+        self.assertEqual(self._controller_state(_gav), _state)
+        self.assertEqual(1, _state[2])
+        self.assertEqual(self.mvn.info(_gav).get("md5"), _state[0])
+
+    def test_deleted_location(self):
+        _gav = "g:a:v:txt"
+        self.mvn.create_gav(_gav)
+        self.register_check(_gav)
+        self.ck_controller.delete_location(_gav, "NXS", reason="test")
+        self.assertEqual((None, None, None), location_state(archive_test_case.base_test_case.models, _gav, "NXS"))
+
+    def test_single_query(self):
+        _gav = "g:a:v:txt"
+        self.mvn.create_gav(_gav)
+        self.register_check(_gav)
+
+        with CaptureQueriesContext(connection) as _queries:
+            location_state(archive_test_case.base_test_case.models, _gav, "NXS")
+
+        self.assertEqual(1, len(_queries))
+
+    def test_cache_after_registration(self):
+        _gav = "gg:aa:vv:zip"
+        self.mvn.create_gav(_gav, include=generate_many_different_gavs(2, p="txt"))
+        self.register_check(_gav, depth=1, add_args=["--state-cache-size", "100"])
+        _md5 = self.mvn.info(_gav).get("md5")
+        self.assertEqual((_md5, 1), self.app.state_cache.get(_gav, "NXS"))
+        _loc = archive_test_case.base_test_case.FileLocation(_gav, "NXS", None)
+
+        with CaptureQueriesContext(connection) as _queries:
+            self.assertFalse(self.app._check_artifact_not_registered(_loc, 1, {"md5": _md5}))
+
+        self.assertEqual(0, len(_queries))
+
+
+class RegistrationStateCacheTest(unittest.TestCase):
+
+    def test_get_put(self):
+        _cache = RegistrationStateCache(10, 60)
+        self.assertIsNone(_cache.get("g:a:v:p", "NXS"))
+        _cache.put("g:a:v:p", "NXS", "abcdef", 1)
+        self.assertEqual(("abcdef", 1), _cache.get("g:a:v:p", "NXS"))
+        self.assertIsNone(_cache.get("g:a:v:p", "SMB"))
+        _cache.invalidate("g:a:v:p", "NXS")
+        self.assertIsNone(_cache.get("g:a:v:p", "NXS"))
+        self.assertEqual({"hits": 1, "misses": 3, "entries": 0}, _cache.stats())
+
+    def test_no_checksum(self):
+        _cache = RegistrationStateCache(10, 60)
+        _cache.put("g:a:v:p", "NXS", None, 0)
+        self.assertIsNone(_cache.get("g:a:v:p", "NXS"))
+
+    def test_expired(self):
+        _cache = RegistrationStateCache(10, 60)
+
+        with unittest.mock.patch("oc_checksums_worker.registration_state.time.monotonic", return_value=100):
+            _cache.put("g:a:v:p", "NXS", "abcdef", 0)
+
+        with unittest.mock.patch("oc_checksums_worker.registration_state.time.monotonic", return_value=161):
+            self.assertIsNone(_cache.get("g:a:v:p", "NXS"))
+
+        self.assertEqual(0, _cache.stats()["entries"])
+
+    def test_least_recently_used_dropped(self):
+        _cache = RegistrationStateCache(2, 60)
+        _cache.put("g:a:v:p1", "NXS", "abcdef", 0)
+        _cache.put("g:a:v:p2", "NXS", "abcdef", 0)
+        _cache.get("g:a:v:p1", "NXS")
+        _cache.put("g:a:v:p3", "NXS", "abcdef", 0)
+        self.assertIsNotNone(_cache.get("g:a:v:p1", "NXS"))
+        self.assertIsNone(_cache.get("g:a:v:p2", "NXS"))
+        self.assertIsNotNone(_cache.get("g:a:v:p3", "NXS"))
@@ -0,0 +1,49 @@
+import unittest
+import hashlib
+import io
+import shutil
+from ..streams import HashingWriter
+
+class HashingWriterTest(unittest.TestCase):
+    def test_write(self):
+        _target = io.BytesIO()
+        _writer = HashingWriter(_target, algorithms=("md5", "sha1"), header_size=4)
+        shutil.copyfileobj(io.BytesIO(b"the_test_data"), _writer, 3)
+        _writer.flush()
+        self.assertEqual(b"the_test_data", _target.getvalue())
+        self.assertEqual(hashlib.md5(b"the_test_data").hexdigest(), _writer.hexdigest())
+        self.assertEqual(hashlib.sha1(b"the_test_data").hexdigest(), _writer.hexdigest("sha1"))
+        self.assertEqual(b"the_", _writer.header)
+        self.assertEqual(b"the_", _writer.header_file().read())
+        self.assertEqual(13, _writer.size)
+
+    def test_seek(self):
+        _target = io.BytesIO()
+        _writer = HashingWriter(_target)
+        # rewinding of an empty file and seeking to the end do not break calculation
+        _writer.seek(0)
+        _writer.write(b"data")
+        _writer.seek(0, io.SEEK_END)
+        self.assertTrue(_writer.valid)
+        self.assertEqual(hashlib.md5(b"data").hexdigest(), _writer.hexdigest())
+        self.assertEqual(b"data", _writer.header)
+
+    def test_random_seek(self):
+        _writer = HashingWriter(io.BytesIO())
+        _writer.write(b"the_test_data")
+        _writer.seek(3)
+        _writer.write(b"-")
+        self.assertFalse(_writer.valid)
+        self.assertIsNone(_writer.hexdigest())
+
+    def test_restart(self):
+        _target = io.BytesIO()
+        _writer = HashingWriter(_target)
+        _writer.write(b"the_test_data")
+        _writer.seek(3)
+        _writer.restart()
+        _writer.write(b"data")
+        self.assertTrue(_writer.valid)
+        self.assertEqual(b"data", _target.getvalue())
+        self.assertEqual(hashlib.md5(b"data").hexdigest(), _writer.hexdigest())
+        self.assertEqual(b"data", _writer.header)
@@ -0,0 +1,56 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+from ..supervisor import WorkerSupervisor
+
+class WorkerSupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _mark(self):
+        # each child leaves a file, so we can count runs
+        _fd, _pth = tempfile.mkstemp(dir=self.tmpdir.name)
+        os.close(_fd)
+        return len(os.listdir(self.tmpdir.name))
+
+    def test_normal_exit(self):
+        _sup = WorkerSupervisor(lambda: self._mark() and 0, 3)
+        self.assertEqual(0, _sup.run())
+        self.assertEqual(3, len(os.listdir(self.tmpdir.name)))
+        self.assertEqual(0, _sup.restarts)
+        self.assertEqual({0: 0, 1: 0, 2: 0}, _sup.exit_codes)
+
+    def test_crash_restarted(self):
+        # first run crashes, restarted one finishes normally
+        _sup = WorkerSupervisor(lambda: 5 if self._mark() == 1 else 0, 1, restart_delay=0.01)
+        self.assertEqual(0, _sup.run())
+        self.assertEqual(1, _sup.restarts)
+        self.assertEqual(2, len(os.listdir(self.tmpdir.name)))
+
+    def test_exception_in_child(self):
+        def _target():
+            self._mark()
+
+            if len(os.listdir(self.tmpdir.name)) < 3:
+                raise ValueError("Crash")
+
+            return 0
+
+        _sup = WorkerSupervisor(_target, 1, restart_delay=0.01)
+        self.assertEqual(0, _sup.run())
+        self.assertEqual(2, _sup.restarts)
+
+    def test_stop(self):
+        _sup = WorkerSupervisor(lambda: time.sleep(30) or 0, 2)
+        _timer = threading.Timer(0.5, _sup.stop)
+        _timer.start()
+        _start = time.monotonic()
+        self.assertEqual(0, _sup.run())
+        self.assertTrue(time.monotonic() - _start < 10)
+        self.assertEqual(0, _sup.restarts)
+        self.assertEqual({0: 0, 1: 0}, _sup.exit_codes)
@@ -15,6 +15,7 @@ setup(name="oc-checksums-worker",
             "oc-delivery-apps >= 11.2.9",
             "oc-orm-initializator",
             "oc-cdtapi",
+            "requests",
             "oc_logging"],
       packages={"oc_checksums_worker"},
       python_requires=">=3.6")